@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Compares engine.py REST and Modbus latency under concurrent load across run modes.
+
+Each mode starts its own engine.py on local ports, drives it with concurrent
+keep-alive HTTP clients and Modbus clients for a fixed duration, and reports
+requests/sec and p50/p99 latency per protocol. With --baseline REV the same
+modes are also run against engine.py as of git revision REV, for a
+before/after comparison. Options are only passed to an engine.py whose
+--help lists them: one without --modbus-port is loaded on the fixed port
+502 it serves Modbus on, and modes it has no flag for are skipped. The
+baseline gets --baseline-args instead of --engine-args.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from functools import lru_cache
+
+import numpy as np
+from pymodbus.client import AsyncModbusTcpClient
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENGINE = os.path.join(HERE, "engine.py")
+
+MODES = {
+    "threaded": [],
+    "async": ["--async-mode"],
+}
+
+# Port engine.py served Modbus on before it had --modbus-port
+FIXED_MODBUS_PORT = 502
+
+
+async def http_client(host, port, path, deadline, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in headers.split(b"\r\n"):
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def modbus_client(host, port, deadline, latencies):
+    client = AsyncModbusTcpClient(host, port=port)
+    await client.connect()
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.read_holding_registers(0, count=1)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        client.close()
+
+
+def summarize(latencies, duration):
+    if not latencies:
+        return {"requests": 0, "rps": 0.0, "p50_ms": None, "p99_ms": None}
+    p50, p99 = np.percentile(np.array(latencies) * 1000.0, [50, 99])
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": float(p50),
+        "p99_ms": float(p99),
+    }
+
+
+async def run_load(args, modbus_port):
+    rest, modbus = [], []
+    deadline = time.perf_counter() + args.duration
+    clients = []
+    if "rest" in args.protocols:
+        clients += [http_client("127.0.0.1", args.http_port, args.path, deadline, rest) for _ in range(args.clients)]
+    if "modbus" in args.protocols:
+        clients += [modbus_client("127.0.0.1", modbus_port, deadline, modbus) for _ in range(args.clients)]
+    await asyncio.gather(*clients)
+    results = {}
+    if "rest" in args.protocols:
+        results["rest"] = summarize(rest, args.duration)
+    if "modbus" in args.protocols:
+        results["modbus"] = summarize(modbus, args.duration)
+    return results
+
+
+async def wait_ready(ports, timeout):
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"engine.py did not open port {port} within {timeout}s")
+                await asyncio.sleep(0.2)
+
+
+def export_revision(revision, directory):
+    """
+    Extracts this directory as of a git revision, so an older engine.py can
+    be benchmarked with the modules it was written against.
+    """
+    archive = subprocess.run(["git", "archive", revision, "."], cwd=HERE, capture_output=True, check=True).stdout
+    with tempfile.TemporaryFile() as buffer:
+        buffer.write(archive)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer) as tar:
+            tar.extractall(directory, filter="data")
+    return os.path.join(directory, "engine.py")
+
+
+@lru_cache
+def engine_options(engine):
+    """
+    Returns the options an engine.py accepts, as listed by its --help.
+    """
+    usage = subprocess.run([sys.executable, engine, "--help"], capture_output=True, text=True, check=True).stdout
+    return frozenset(re.findall(r"(?<![\w-])--?[a-zA-Z][\w-]*", usage))
+
+
+def bench_mode(engine, mode, args, extra_args=()):
+    """
+    Returns the results of one mode, or None if engine has no flag for it.
+    """
+    options = engine_options(engine)
+    if not options.issuperset(MODES[mode]):
+        return None
+    command = [sys.executable, engine, "-i", "127.0.0.1", "-p", str(args.http_port)]
+    modbus_port = args.modbus_port
+    if "--modbus-port" in options:
+        command += ["-mp", str(modbus_port)]
+    else:
+        modbus_port = FIXED_MODBUS_PORT
+    command += [*MODES[mode], *extra_args]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_ready([args.http_port, modbus_port], args.startup_timeout))
+        return asyncio.run(run_load(args, modbus_port))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine REST/Modbus latency benchmark")
+    parser.add_argument("-m", "--modes", nargs="+", choices=sorted(MODES), default=["threaded", "async"], help="Run modes to compare")
+    parser.add_argument("-P", "--protocols", nargs="+", choices=["rest", "modbus"], default=["rest", "modbus"], help="Protocols to load")
+    parser.add_argument("-c", "--clients", type=int, default=16, help="Concurrent clients per protocol")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Load duration per mode in seconds")
+    parser.add_argument("--path", default="/engine", help="REST path to request")
+    parser.add_argument("--http-port", type=int, default=18000, help="REST port for the benchmarked engine")
+    parser.add_argument("--modbus-port", type=int, default=15020, help="Modbus port for the benchmarked engine")
+    parser.add_argument("--startup-timeout", type=float, default=20.0, help="Seconds to wait for engine.py to start")
+    parser.add_argument("-b", "--baseline", help="Git revision of engine.py to benchmark first, for a before/after comparison")
+    parser.add_argument("--baseline-args", type=shlex.split, default=[], help="Extra arguments of the baseline engine.py, as one string")
+    parser.add_argument("--engine-args", nargs=argparse.REMAINDER, default=[], help="Extra engine.py arguments (must come last)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = export_revision(args.baseline, directory)
+            for mode in args.modes:
+                results[f"{args.baseline}:{mode}"] = bench_mode(baseline, mode, args, args.baseline_args)
+    for mode in args.modes:
+        results[mode] = bench_mode(ENGINE, mode, args, args.engine_args)
+    for mode in [mode for mode, result in results.items() if result is None]:
+        print(f"Skipped {mode}: engine.py has no {' '.join(MODES[mode.rpartition(':')[2]])} option", file=sys.stderr)
+        del results[mode]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    width = max(len("mode"), *map(len, results))
+    print(f"{'mode':<{width}} {'protocol':<8} {'requests':>9} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, protocols in results.items():
+        for protocol, r in protocols.items():
+            if r["requests"]:
+                print(f"{mode:<{width}} {protocol:<8} {r['requests']:>9} {r['rps']:>10.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+            else:
+                print(f"{mode:<{width}} {protocol:<8} {0:>9} {'-':>10} {'-':>8} {'-':>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Modbus/TCP load generator and capacity benchmark for the device simulators.
+
+Opens --connections concurrent connections to a running simulator
+(engine.py, fan.py, tsens.py, random_modbus.py, modbus_host.py) and keeps
+up to --depth requests in flight on each, matched to their answers by
+transaction ID, for --duration seconds after a --warmup. Requests are
+drawn from a weighted mix of function codes and register ranges:
+
+    --mix 3:0-9:4=60 4:0-9:1=30 6:1-9:1=10
+
+is 60% reads of 4 holding registers starting anywhere in 0-9 (the read
+stays inside the range), 30% single input register reads and 10% single
+register writes somewhere in HR1-9. Supported function codes are 1-6, 15
+and 16; written values are random.
+
+Reports throughput, exception answers, timeouts and p50/p95/p99 latency,
+overall and per function code. --json prints the results and --output
+appends them, with the settings, to a JSON lines file so runs can be
+compared. With several --connections or --depth values every combination
+is run in turn, which shows where throughput stops growing and latency
+starts to. --rate paces the requests instead of sending the next one as
+soon as an answer frees the window; latency is then measured from when a
+request was due, so a stalled server is not hidden by a waiting client.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import struct
+import time
+from array import array
+
+import numpy as np
+
+# Transaction ID, protocol ID, length (unit ID + PDU), unit ID
+MBAP = struct.Struct(">HHHB")
+MBAP_SIZE = 7
+READ = struct.Struct(">BHH")
+WRITE_MULTIPLE = struct.Struct(">BHHB")
+
+# Largest quantity per request, from the Modbus application protocol
+LIMITS = {1: 2000, 2: 2000, 3: 125, 4: 125, 5: 1, 6: 1, 15: 1968, 16: 123}
+COIL_ON = 0xFF00
+
+# Distinct requests drawn from the mix; connections cycle through them
+POOL_SIZE = 4096
+READ_SIZE = 65536
+RETRY_DELAY = 0.1
+
+
+class Operation:
+    def __init__(self, spec, function_code, first, last, count, weight):
+        self.spec = spec
+        self.function_code = function_code
+        self.first = first
+        self.last = last
+        self.count = count
+        self.weight = weight
+
+    def request(self, rng):
+        """
+        A request PDU at a random address of the range, with random values for writes.
+        """
+        function_code = self.function_code
+        address = rng.randint(self.first, self.last - self.count + 1)
+        if function_code <= 4:
+            return READ.pack(function_code, address, self.count)
+        if function_code == 5:
+            return READ.pack(5, address, COIL_ON if rng.random() < 0.5 else 0)
+        if function_code == 6:
+            return READ.pack(6, address, rng.randint(0, 1000))
+        if function_code == 15:
+            data = bytes(rng.getrandbits(8) for _ in range((self.count + 7) // 8))
+        else:
+            data = struct.pack(f">{self.count}H", *(rng.randint(0, 1000) for _ in range(self.count)))
+        return WRITE_MULTIPLE.pack(function_code, address, self.count, len(data)) + data
+
+
+def parse_operation(spec):
+    """
+    Parses a mix entry FC[:FIRST[-LAST][:COUNT]][=WEIGHT], e.g. "3:0-9:4=60".
+    """
+    try:
+        body, _, weight = spec.partition("=")
+        parts = body.split(":")
+        if len(parts) > 3:
+            raise ValueError(spec)
+        function_code = int(parts[0])
+        first, _, last = (parts[1] if len(parts) > 1 else "0").partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        count = int(parts[2]) if len(parts) > 2 else 1
+        weight = float(weight) if weight else 1.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid mix entry '{spec}', expected FC[:FIRST[-LAST][:COUNT]][=WEIGHT]")
+    if function_code not in LIMITS:
+        raise argparse.ArgumentTypeError(f"Unsupported function code {function_code} in '{spec}', expected one of {sorted(LIMITS)}")
+    if not 1 <= count <= LIMITS[function_code]:
+        raise argparse.ArgumentTypeError(f"Count {count} in '{spec}' must be 1-{LIMITS[function_code]} for FC{function_code}")
+    if not 0 <= first <= last <= 65535 or last - first + 1 < count:
+        raise argparse.ArgumentTypeError(f"Range {first}-{last} in '{spec}' does not hold {count} address(es)")
+    if weight <= 0:
+        raise argparse.ArgumentTypeError(f"Weight in '{spec}' must be positive")
+    return Operation(spec, function_code, first, last, count, weight)
+
+
+def build_pool(mix, seed):
+    rng = random.Random(seed)
+    operations = rng.choices(mix, weights=[operation.weight for operation in mix], k=POOL_SIZE)
+    return [operation.request(rng) for operation in operations]
+
+
+class Results:
+    def __init__(self, measure_from):
+        # Requests sent before measure_from are warmup and not counted
+        self.measure_from = measure_from
+        self.latencies = {}
+        self.exceptions = {}
+        self.timeouts = 0
+        self.disconnects = 0
+        self.connect_errors = 0
+        self.unexpected = 0
+
+    def answer(self, sent, function_code, frame, offset, now):
+        if sent < self.measure_from:
+            return
+        latencies = self.latencies.get(function_code)
+        if latencies is None:
+            latencies = self.latencies[function_code] = array("d")
+        latencies.append(now - sent)
+        if frame[offset + MBAP_SIZE] & 0x80:
+            key = f"{function_code}:{frame[offset + MBAP_SIZE + 1]}"
+            self.exceptions[key] = self.exceptions.get(key, 0) + 1
+
+    def lost(self, pending):
+        return sum(1 for sent, _ in pending.values() if sent >= self.measure_from)
+
+    def merge(self, other):
+        for function_code, latencies in other.latencies.items():
+            self.latencies.setdefault(function_code, array("d")).extend(latencies)
+        for key, count in other.exceptions.items():
+            self.exceptions[key] = self.exceptions.get(key, 0) + count
+        self.timeouts += other.timeouts
+        self.disconnects += other.disconnects
+        self.connect_errors += other.connect_errors
+        self.unexpected += other.unexpected
+
+
+class Connection:
+    """
+    One client connection with up to depth requests in flight, reopened
+    if the server closes it or stops answering.
+    """
+
+    def __init__(self, target, unit, pool, depth, interval, timeout, start, deadline, results, rng):
+        self.target = target
+        self.unit = unit
+        self.pool = pool
+        self.depth = depth
+        self.interval = interval
+        self.timeout = timeout
+        self.deadline = deadline
+        self.results = results
+        self.index = rng.randrange(len(pool))
+        # Paced connections start at random phases so their requests don't come in waves
+        self.next_due = start + rng.random() * interval if interval else start
+        self.transaction = 0
+
+    async def run(self):
+        while time.perf_counter() < self.deadline:
+            try:
+                reader, writer = await asyncio.open_connection(*self.target)
+            except OSError:
+                self.results.connect_errors += 1
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pending = {}
+            try:
+                await self.exchange(reader, writer, pending)
+            except asyncio.TimeoutError:
+                self.results.timeouts += self.results.lost(pending)
+            except (OSError, asyncio.IncompleteReadError):
+                self.results.disconnects += 1
+                self.results.timeouts += self.results.lost(pending)
+                await asyncio.sleep(RETRY_DELAY)
+            finally:
+                writer.close()
+
+    def send(self, writer, pending, now):
+        frames = []
+        pool = self.pool
+        while len(pending) < self.depth:
+            if self.interval:
+                if self.next_due > now or self.next_due >= self.deadline:
+                    break
+                sent = self.next_due
+                self.next_due += self.interval
+            else:
+                sent = now
+            pdu = pool[self.index]
+            self.index = (self.index + 1) % len(pool)
+            self.transaction = (self.transaction + 1) & 0xFFFF
+            pending[self.transaction] = (sent, pdu[0])
+            frames.append(MBAP.pack(self.transaction, 0, len(pdu) + 1, self.unit) + pdu)
+        if frames:
+            # Pipelined requests go out in one write
+            writer.write(b"".join(frames))
+
+    async def exchange(self, reader, writer, pending):
+        buffer = bytearray()
+        results = self.results
+        while True:
+            now = time.perf_counter()
+            if now < self.deadline:
+                self.send(writer, pending, now)
+            elif not pending:
+                return
+            if not pending:
+                # Paced and ahead of schedule
+                await asyncio.sleep(max(min(self.next_due, self.deadline) - now, 0))
+                continue
+            # Wait for answers until the oldest request times out or the next paced one is due
+            expires = next(iter(pending.values()))[0] + self.timeout
+            wait = expires - now
+            if self.interval and len(pending) < self.depth and now < self.deadline:
+                wait = min(wait, self.next_due - now)
+            try:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), max(wait, 0))
+            except asyncio.TimeoutError:
+                if time.perf_counter() >= expires:
+                    raise
+                continue
+            if not data:
+                raise ConnectionResetError("Connection closed by the server")
+            buffer += data
+            now = time.perf_counter()
+            offset = 0
+            while len(buffer) - offset > MBAP_SIZE:
+                transaction, _, length, _ = MBAP.unpack_from(buffer, offset)
+                if length < 2:
+                    raise ConnectionResetError(f"Malformed answer with length {length}")
+                end = offset + 6 + length
+                if end > len(buffer):
+                    break
+                entry = pending.pop(transaction, None)
+                if entry:
+                    results.answer(entry[0], entry[1], buffer, offset, now)
+                else:
+                    results.unexpected += 1
+                offset = end
+            del buffer[:offset]
+
+
+async def run_load(target, unit, pool, connections, depth, rate, warmup, duration, timeout, seed):
+    start = time.perf_counter()
+    results = Results(start + warmup)
+    interval = connections / rate if rate else None
+    rng = random.Random(seed)
+    clients = [
+        Connection(target, unit, pool, depth, interval, timeout, start, start + warmup + duration, results, rng)
+        for _ in range(connections)
+    ]
+    await asyncio.gather(*[client.run() for client in clients])
+    return results
+
+
+def run_process(target, unit, pool, connections, depth, rate, warmup, duration, timeout, seed):
+    return asyncio.run(run_load(target, unit, pool, connections, depth, rate, warmup, duration, timeout, seed))
+
+
+def summarize(latencies, duration):
+    if not len(latencies):
+        return {"requests": 0, "rps": 0.0, "mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.frombuffer(latencies, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "requests": len(values),
+        "rps": len(values) / duration,
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(values.max()),
+    }
+
+
+def bench(args, pool, connections, depth):
+    """
+    Runs one load level, split over --processes client processes.
+    """
+    processes = min(args.processes, connections)
+    shares = [connections // processes + (index < connections % processes) for index in range(processes)]
+    rates = [args.rate * share / connections if args.rate else None for share in shares]
+    jobs = [
+        ((args.host, args.port), args.unit, pool, share, depth, rate, args.warmup, args.duration, args.timeout, args.seed + index)
+        for index, (share, rate) in enumerate(zip(shares, rates))
+    ]
+    if processes == 1:
+        results = run_process(*jobs[0])
+    else:
+        with multiprocessing.Pool(processes) as workers:
+            parts = workers.starmap(run_process, jobs)
+        results = parts[0]
+        for part in parts[1:]:
+            results.merge(part)
+
+    everything = array("d")
+    for latencies in results.latencies.values():
+        everything.extend(latencies)
+    summary = summarize(everything, args.duration)
+    exceptions = sum(results.exceptions.values())
+    return {
+        "connections": connections,
+        "depth": depth,
+        "rate": args.rate,
+        **summary,
+        "ok_rps": (summary["requests"] - exceptions) / args.duration,
+        "exceptions": results.exceptions,
+        "timeouts": results.timeouts,
+        "disconnects": results.disconnects,
+        "connect_errors": results.connect_errors,
+        "unexpected": results.unexpected,
+        "function_codes": {str(function_code): summarize(latencies, args.duration) for function_code, latencies in sorted(results.latencies.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus/TCP load generator and capacity benchmark")
+    parser.add_argument("-a", "--host", default="127.0.0.1", help="Simulator address")
+    parser.add_argument("-p", "--port", type=int, default=502, help="Simulator Modbus port")
+    parser.add_argument("-u", "--unit", type=int, default=1, help="Modbus unit ID")
+    parser.add_argument("-c", "--connections", type=int, nargs="+", default=[8], help="Concurrent connections (several values run one after the other)")
+    parser.add_argument("-D", "--depth", type=int, nargs="+", default=[1], help="Requests in flight per connection (several values run one after the other)")
+    parser.add_argument("-m", "--mix", type=parse_operation, nargs="+", default=[parse_operation("3:0-9:1")], help="Requests as FC[:FIRST[-LAST][:COUNT]][=WEIGHT] (default 3:0-9:1)")
+    parser.add_argument("-r", "--rate", type=float, help="Total requests per second to pace the load at, instead of as fast as answers come")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Measured seconds per load level")
+    parser.add_argument("-w", "--warmup", type=float, default=1.0, help="Seconds of load before measuring")
+    parser.add_argument("-t", "--timeout", type=float, default=5.0, help="Seconds without an answer before a request counts as timed out")
+    parser.add_argument("-j", "--processes", type=int, default=1, help="Client processes to spread the connections over")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Seed of the request mix")
+    parser.add_argument("-l", "--label", help="Name of the run in the results")
+    parser.add_argument("-o", "--output", help="JSON lines file the results are appended to")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if min(args.connections) < 1 or min(args.depth) < 1 or max(args.depth) > 4096:
+        parser.error("--connections must be at least 1 and --depth 1-4096")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    pool = build_pool(args.mix, args.seed)
+    settings = {
+        "label": args.label, "time": time.time(), "target": f"{args.host}:{args.port}", "unit": args.unit,
+        "mix": [operation.spec for operation in args.mix], "duration": args.duration, "warmup": args.warmup,
+        "processes": args.processes,
+    }
+    runs = []
+    for connections in args.connections:
+        for depth in args.depth:
+            run = bench(args, pool, connections, depth)
+            runs.append(run)
+            if args.output:
+                with open(args.output, "a") as f:
+                    f.write(json.dumps({**settings, **run}) + "\n")
+
+    if args.json:
+        print(json.dumps({**settings, "runs": runs}, indent=2))
+        return
+    print(f"{'conns':>5} {'depth':>5} {'requests':>9} {'req/s':>10} {'exc':>6} {'timeout':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for r in runs:
+        exceptions = sum(r["exceptions"].values())
+        if r["requests"]:
+            latency = f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}"
+        else:
+            latency = f"{'-':>8} {'-':>8} {'-':>8} {'-':>8}"
+        print(f"{r['connections']:>5} {r['depth']:>5} {r['requests']:>9} {r['rps']:>10.1f} {exceptions:>6} {r['timeouts']:>7} {latency}")
+        if r["exceptions"]:
+            print(f"{'':>11} exceptions (FC:code): {r['exceptions']}")
+        if r["disconnects"] or r["connect_errors"] or r["unexpected"]:
+            print(f"{'':>11} disconnects: {r['disconnects']}, failed connects: {r['connect_errors']}, unexpected answers: {r['unexpected']}")
+
+
+if __name__ == "__main__":
+    main()
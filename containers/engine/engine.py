@@ -1,11 +1,17 @@
 
+import asyncio
+import atexit
+import json
+import os
+import signal
+import sys
 import threading
 import time
 import argparse
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from pymodbus.server import StartTcpServer
 from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
 from pymodbus.pdu.device import ModbusDeviceIdentification
 import logging
@@ -13,110 +19,693 @@ import random
 import time
 import threading
 import argparse
+from functools import partial
+from typing import Literal
+import numpy as np
+from scheduler import Scheduler
+from thermal import engine_step, cooling_delta, COOLING_PERIOD
+from metrics import Registry, Counter, Histogram, CallbackGauge
+from shared_state import EngineState, TABLES
+from fast_modbus import FastModbusServer, Limits, add_limit_arguments, current_source
+from write_journal import WriteJournal, add_journal_arguments, serve_modbus
+from anomaly_detector import AnomalyDetector, add_anomaly_arguments
 
 
 class TemperatureUpdate(BaseModel):
     temperature: float
 
+class TemperatureDelta(BaseModel):
+    delta: float
+
+class CoolingUpdate(BaseModel):
+    rpm: float
+    capacity: float
+    power: float = 1.0
+    # Seconds the fan ran at rpm since its previous update
+    dt: float = COOLING_PERIOD
+
+class EngineOperation(BaseModel):
+    op: Literal["set_temperature", "delta", "cooling", "start", "stop"]
+    temperature: float | None = None
+    delta: float | None = None
+    rpm: float | None = None
+    capacity: float | None = None
+    power: float = 1.0
+    dt: float = COOLING_PERIOD
+
+class EngineBatch(BaseModel):
+    operations: list[EngineOperation]
+
+class ControlDataBlock(ModbusSequentialDataBlock):
+    """
+    Sequential data block that invokes a callback whenever a write touches
+    one of the watched addresses, before the Modbus response is sent.
+    Reads go through read(fn), so multi-register values are never torn.
+    """
+
+    def __init__(self, address, values, callbacks=None, read=None):
+        super().__init__(address, values)
+        if isinstance(values, np.ndarray):
+            # Keep the caller's (possibly shared) array instead of a private copy
+            self.values = values
+        self.callbacks = callbacks if callbacks is not None else {}
+        self.read = read if read is not None else (lambda fn: fn())
+
+    def getValues(self, address, count=1):
+        return self.read(partial(self._copy_values, address, count))
+
+    def _copy_values(self, address, count):
+        result = super().getValues(address, count)
+        if isinstance(result, np.ndarray):
+            return result.tolist()
+        return result
+
+    def setValues(self, address, values):
+        result = super().setValues(address, values)
+        if result is not None:
+            return result
+        if not isinstance(values, list):
+            values = [values]
+        for offset, value in enumerate(values):
+            callback = self.callbacks.get(address + offset)
+            if callback:
+                try:
+                    callback(value)
+                except Exception as e:
+                    print(f"Error in modbus write callback at {address + offset}: {e}")
+        return None
+
+class ChangeFeed:
+    """
+    Wakes asyncio waiters (long-polls and event streams) whenever an engine
+    publishes a new state version. Publishers may run on any thread. With a
+    poll_interval, waiters also re-check the version periodically, to see
+    changes published by other processes sharing the state.
+    """
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._waiters = set()
+
+    def publish(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def wait_for_change(self, engine, version, timeout):
+        """
+        Waits until the engine version differs from version or timeout expires.
+        Returns True if the version changed.
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        deadline = loop.time() + timeout
+        while engine.version == version:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            if self.poll_interval:
+                remaining = min(remaining, self.poll_interval)
+            waiter = loop.create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters.discard(waiter)
+        return True
+
+class HistoryRing:
+    """
+    Preallocated per-engine ring buffer of (timestamp, temperature, running)
+    samples, stored in the history arrays of an EngineState. Callers must hold
+    the state lock while recording and take snapshots through state.read().
+
+    A state change within the state's history interval of the newest sample
+    replaces it, so the ring holds at most one sample, the latest state, per
+    interval and covers capacity * interval seconds however often the state
+    changes. An interval of 0 records every change.
+    """
+
+    def __init__(self, state):
+        self.capacity = state.history_capacity
+        self.timestamp = state.history_timestamp
+        self.temperature = state.history_temperature
+        self.running = state.history_running
+        self.head = state.history_head
+        self.size = state.history_size
+        # Time the newest sample of each engine was appended
+        self.opened = state.history_opened
+        self.interval = state.history_interval
+
+    def record(self, indices, timestamp, temperature, running):
+        indices = np.atleast_1d(indices)
+        head = self.head[indices]
+        merge = (self.size[indices] > 0) & (timestamp - self.opened[indices] < self.interval)
+        position = np.where(merge, head - 1, head) % self.capacity
+        self.timestamp[indices, position] = timestamp
+        self.temperature[indices, position] = temperature
+        self.running[indices, position] = running
+        appended = indices[~merge]
+        self.opened[appended] = timestamp
+        self.head[appended] = (position[~merge] + 1) % self.capacity
+        self.size[appended] = np.minimum(self.size[appended] + 1, self.capacity)
+
+    def snapshot(self, index):
+        """
+        Returns copies of the samples of one engine, oldest first.
+        """
+        order = np.arange(self.head[index] - self.size[index], self.head[index]) % self.capacity
+        return self.timestamp[index, order], self.temperature[index, order], self.running[index, order]
+
+def downsample_history(timestamps, temperatures, running, start=None, end=None, step=None):
+    """
+    Filters samples to [start, end] and, if step is given, reduces them to
+    min/max/mean temperature buckets of step seconds starting at start.
+    """
+    if start is None:
+        start = float(timestamps[0]) if len(timestamps) else 0.0
+    if end is None:
+        end = float("inf")
+    mask = (timestamps >= start) & (timestamps <= end)
+    timestamps, temperatures, running = timestamps[mask], temperatures[mask], running[mask]
+
+    if step is None:
+        return {"samples": [
+            {"timestamp": t, "temperature": v, "status": "running" if r else "stopped"}
+            for t, v, r in zip(timestamps.tolist(), temperatures.tolist(), running.tolist())
+        ]}
+    if not len(timestamps):
+        return {"step": step, "buckets": []}
+
+    # Samples are time ordered, so each bucket is a contiguous run
+    buckets = np.floor((timestamps - start) / step).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    counts = np.diff(np.append(starts, len(timestamps)))
+    minimum = np.minimum.reduceat(temperatures, starts)
+    maximum = np.maximum.reduceat(temperatures, starts)
+    mean = np.add.reduceat(temperatures, starts) / counts
+    running_fraction = np.add.reduceat(running.astype(np.float64), starts) / counts
+    return {"step": step, "buckets": [
+        {"start": start + b * step, "count": c, "min": lo, "max": hi, "mean": m, "running": r}
+        for b, c, lo, hi, m, r in zip(buckets[starts].tolist(), counts.tolist(), minimum.tolist(),
+                                      maximum.tolist(), mean.tolist(), running_fraction.tolist())
+    ]}
+
+# Seconds between version checks of waiters when other processes may change the state
+SHARED_STATE_POLL_INTERVAL = 0.05
+
+# pymodbus' device context shifts protocol addresses by one before they reach the data block
+BLOCK_ADDRESS_OFFSET = 1
+
+# Engine state mirrored into Modbus: IR0-IR1 hold the temperature as a big-endian
+# float32 (high word first), DI0 is 1 while the engine runs
+TEMPERATURE_REGISTER = 0
+STATUS_INPUT = 0
+
+class EngineBank:
+    """
+    State of N engines kept in NumPy arrays and advanced by one vectorized step per tick.
+    The arrays live in an EngineState, private by default or shared with other
+    processes. Only the bank created with simulate=True initializes and ticks them.
+    """
+
+    def __init__(self, count, temp_step, interval_seconds, start_temp=0.0, scheduler=None, name="engines", history_size=16384, state=None, simulate=True, history_interval=1.0):
+        self.state = state if state is not None else EngineState.local(count, history_size)
+        self.count = self.state.count
+        self.temperature = self.state.temperature
+        self.running = self.state.running
+        self.temp_step = self.state.temp_step
+        self.interval = self.state.interval
+        self.version = self.state.version
+        self.lock = self.state.lock
+        # Called with (indices, temperature, running) for the registers mirror() writes
+        self.observer = None
+        self.feed = ChangeFeed(SHARED_STATE_POLL_INTERVAL if self.state.shared else None)
+        self.history = HistoryRing(self.state)
+        if not simulate:
+            return
+        with self.lock:
+            self.state.history_interval[()] = history_interval
+            self.temperature[:] = start_temp
+            self.running[:] = False
+            self.temp_step[:] = temp_step
+            self.interval[:] = interval_seconds
+            self.history.record(np.arange(self.count), time.time(), self.temperature, self.running)
+            self.mirror(np.arange(self.count))
+        self.scheduler = scheduler if scheduler is not None else Scheduler().start()
+        self.clock = self.scheduler.clock
+        self.next_due = np.full(self.count, self.clock() + interval_seconds, dtype=np.float64)
+        self.scheduler.every(name, float(self.interval.min()), self._tick)
+
+    def mirror(self, indices):
+        """
+        Copies the state of the given engines into their Modbus input registers
+        and discrete inputs. Callers must hold the lock.
+        """
+        indices = np.atleast_1d(indices)
+        registers = self.state.registers
+        words = self.temperature[indices].astype(">f4").view(">u2").reshape(-1, 2)
+        start = TEMPERATURE_REGISTER + BLOCK_ADDRESS_OFFSET
+        registers[indices, TABLES.index("ir"), start:start + 2] = words
+        registers[indices, TABLES.index("di"), STATUS_INPUT + BLOCK_ADDRESS_OFFSET] = self.running[indices]
+        if self.observer:
+            self.observer(indices, self.temperature[indices], self.running[indices])
+
+    def _tick(self):
+        now = self.clock()
+        with self.lock:
+            due = self.next_due <= now
+            if not due.any():
+                return
+            before = self.temperature[due]
+            after = engine_step(before, self.running[due], self.temp_step[due])
+            self.temperature[due] = after
+            # Missed deadlines are skipped, like the scheduler does
+            missed = np.floor((now - self.next_due[due]) / self.interval[due]) + 1
+            self.next_due[due] += missed * self.interval[due]
+            changed = np.zeros(self.count, dtype=bool)
+            changed[due] = after != before
+            self.version[changed] += 1
+            indices = np.flatnonzero(changed)
+            if len(indices):
+                self.history.record(indices, time.time(), self.temperature[indices], self.running[indices])
+                self.mirror(indices)
+        if changed.any():
+            self.feed.publish()
+
 class Engine:
-    def __init__(self, temp_step, interval_seconds, start_temp=0.0):
-        self.temperature = start_temp
-        self.status = "stopped"
-        self.temp_step = temp_step
-        self.interval_seconds = interval_seconds
-        self.running = False
-        self._thread = None
-        threading.Thread(target=self._cooling_loop, daemon=True).start()
+    """
+    Single-engine view over one slot of an EngineBank.
+    """
+
+    def __init__(self, bank, index):
+        self.bank = bank
+        self.index = index
+
+    @property
+    def temperature(self):
+        return float(self.bank.temperature[self.index])
+
+    @property
+    def running(self):
+        return bool(self.bank.running[self.index])
+
+    @property
+    def status(self):
+        return "running" if self.running else "stopped"
+
+    @property
+    def version(self):
+        return int(self.bank.version[self.index])
+
+    def _update(self, change):
+        """
+        Runs change() under the bank lock, bumps the version if the state moved
+        and returns the resulting state.
+        """
+        bank = self.bank
+        with bank.lock:
+            before = (bank.temperature[self.index], bank.running[self.index])
+            change()
+            changed = before != (bank.temperature[self.index], bank.running[self.index])
+            if changed:
+                bank.version[self.index] += 1
+                bank.history.record(self.index, time.time(), bank.temperature[self.index], bank.running[self.index])
+                bank.mirror(self.index)
+            state = self._state()
+        if changed:
+            bank.feed.publish()
+        return state
+
+    def _set(self, array, value):
+        def change():
+            array[self.index] = value
+        return self._update(change)
 
     def start(self):
-        if not self.running:
-            self.running = True
-            self.status = "running"
-            self._thread = threading.Thread(target=self._run_loop, daemon=True)
-            self._thread.start()
+        self._set(self.bank.running, True)
 
     def stop(self):
-        if self.running:
-            self.running = False
-            self.status = "stopped"
-            threading.Thread(target=self._cooling_loop, daemon=True).start()
-
-    def _run_loop(self):
-        while self.running:
-            time.sleep(self.interval_seconds)
-            self.temperature += self.temp_step
-
-    def _cooling_loop(self):
-        while not self.running:
-            time.sleep(self.interval_seconds)
-            if self.temperature > 0:
-                self.temperature = max(0.0, self.temperature - self.temp_step)
+        self._set(self.bank.running, False)
 
     def get_state(self):
+        return self.bank.state.read(self._state)
+
+    def _state(self):
         return {
-            "temperature": self.temperature,
-            "status": self.status
+            "temperature": float(self.bank.temperature[self.index]),
+            "status": "running" if self.bank.running[self.index] else "stopped",
+            "version": int(self.bank.version[self.index])
         }
 
     def set_temperature(self, temp):
-        self.temperature = temp
+        return self._set(self.bank.temperature, temp)
+
+    def apply_delta(self, delta):
+        def change():
+            self.bank.temperature[self.index] += delta
+        return self._update(change)
+
+    def apply_cooling(self, power, rpm, capacity, dt=COOLING_PERIOD):
+        return self.apply_delta(cooling_delta(power, rpm, capacity, dt))
 
-# Global engine instance
-engine = None
+    def apply_batch(self, operations):
+        """
+        Applies a list of EngineOperation atomically and returns the resulting state.
+        Raises ValueError, without applying anything, if an operation misses its arguments.
+        """
+        required = {"set_temperature": ("temperature",), "delta": ("delta",), "cooling": ("rpm", "capacity")}
+        for operation in operations:
+            missing = [field for field in required.get(operation.op, ()) if getattr(operation, field) is None]
+            if missing:
+                raise ValueError(f"Operation {operation.op} requires {', '.join(missing)}")
+
+        def change():
+            bank, index = self.bank, self.index
+            for operation in operations:
+                if operation.op == "set_temperature":
+                    bank.temperature[index] = operation.temperature
+                elif operation.op == "delta":
+                    bank.temperature[index] += operation.delta
+                elif operation.op == "cooling":
+                    bank.temperature[index] += cooling_delta(operation.power, operation.rpm, operation.capacity, operation.dt)
+                elif operation.op == "start":
+                    bank.running[index] = True
+                elif operation.op == "stop":
+                    bank.running[index] = False
+        return self._update(change)
+
+    def history(self, start=None, end=None, step=None):
+        samples = self.bank.state.read(lambda: self.bank.history.snapshot(self.index))
+        return downsample_history(*samples, start=start, end=end, step=step)
+
+# Global engine instances, indexed by engine id
+engines = []
+# Client writes to the Modbus registers, set up in main()
+journal = None
+
+# Operational metrics served on /metrics
+registry = Registry()
+http_requests = registry.register(Counter("engine_http_requests_total", "REST requests by method, route and status", ("method", "route", "status")))
+http_latency = registry.register(Histogram("engine_http_request_duration_seconds", "Time until the REST response starts, by method and route", ("method", "route")))
+modbus_requests = registry.register(Counter("engine_modbus_requests_total", "Modbus requests by function code", ("function_code",)))
+modbus_exceptions = registry.register(Counter("engine_modbus_exceptions_total", "Modbus exception responses by function code", ("function_code",)))
+tick_lateness = registry.register(Histogram("engine_tick_lateness_seconds", "Delay between a simulation tick deadline and its start", ("job",)))
+tick_duration = registry.register(Histogram("engine_tick_duration_seconds", "Time spent running a simulation tick", ("job",)))
+registry.register(CallbackGauge("engine_threads", "Live threads in the engine process", threading.active_count))
+# Index of this REST worker process, 0 for the main one
+worker = 0
+registry.register(CallbackGauge("engine_worker", "REST worker process that answered the scrape, 0 for the main process with the Modbus and tick metrics", lambda: worker))
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them up to the response start,
+    so long-lived streams do not skew the latency histogram.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                path = route.path if route is not None else "unmatched"
+                http_latency.observe(time.perf_counter() - started, scope["method"], path)
+                http_requests.inc(scope["method"], path, str(message["status"]))
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+def trace_modbus_pdu(sending, pdu):
+    if not sending:
+        modbus_requests.inc(str(pdu.function_code))
+    elif pdu.function_code & 0x80:
+        modbus_exceptions.inc(str(pdu.function_code & 0x7F))
+    return pdu
+
+def observe_modbus(function_code, exception_code):
+    # Same counters as trace_modbus_pdu, for the fast Modbus server
+    modbus_requests.inc(str(function_code))
+    if exception_code is not None:
+        modbus_exceptions.inc(str(function_code))
+
+def observe_tick(job, lateness, duration):
+    tick_lateness.observe(max(lateness, 0.0), job.name)
+    tick_duration.observe(duration, job.name)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics")
+def get_metrics():
+    # Metrics are kept per process: under --workers a scrape sees the counters
+    # of whichever worker accepted it, see engine_worker
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def state_response(state):
+    # The state document is tiny and always JSON-safe, so skip FastAPI's generic encoder
+    return Response(json.dumps(state, separators=(",", ":")), media_type="application/json")
+
+def get_engine(engine_id):
+    if 0 <= engine_id < len(engines):
+        return engines[engine_id]
+    return None
+
+# Seconds between keep-alive comments on idle event streams
+STREAM_KEEPALIVE = 15.0
+
+async def stream_engine_state(engine):
+    version = None
+    while True:
+        if engine.version != version:
+            state = engine.get_state()
+            version = state["version"]
+            yield f"data: {json.dumps(state)}\n\n"
+        elif not await engines_feed().wait_for_change(engine, version, STREAM_KEEPALIVE):
+            yield ": keep-alive\n\n"
+
+def engines_feed():
+    return engines[0].bank.feed
 
 @app.get("/engine")
-def get_engine_status():
-    global engine
-    if engine:
-        return engine.get_state()
-    return {"error": "Engine not initialized"}
+async def get_engine_status(wait_for_change: int | None = None, timeout: float = 30.0):
+    return await get_engine_status_by_id(0, wait_for_change, timeout)
 
 @app.post("/engine/temperature")
-def set_engine_temperature(update: TemperatureUpdate):
-    global engine
+async def set_engine_temperature(update: TemperatureUpdate):
+    return await set_engine_temperature_by_id(0, update)
+
+@app.post("/engine/temperature/delta")
+async def apply_engine_delta(update: TemperatureDelta):
+    return await apply_engine_delta_by_id(0, update)
+
+@app.post("/engine/cooling")
+async def apply_engine_cooling(update: CoolingUpdate):
+    return await apply_engine_cooling_by_id(0, update)
+
+@app.post("/engine/batch")
+async def apply_engine_batch(batch: EngineBatch):
+    return await apply_engine_batch_by_id(0, batch)
+
+@app.get("/journal")
+def get_journal(since: int = 0, limit: int = 1000):
+    if journal is None:
+        return {"error": "Journal disabled"}
+    if os.getpid() != journal.pid:
+        # Forked REST workers only hold a copy from before the fork
+        return {"error": "The journal is kept by the Modbus process, query it with --workers 1 or read the journal file"}
+    return journal.query(since, limit)
+
+@app.get("/journal.bin")
+def get_journal_raw(since: int = 0):
+    if journal is None:
+        return {"error": "Journal disabled"}
+    if os.getpid() != journal.pid:
+        return {"error": "The journal is kept by the Modbus process, query it with --workers 1 or read the journal file"}
+    first, data = journal.raw(since)
+    return Response(data, media_type="application/octet-stream", headers={"X-Journal-First": str(first)})
+
+@app.get("/engine/history")
+def get_engine_history(start: float | None = Query(None, alias="from"), end: float | None = Query(None, alias="to"), step: float | None = None):
+    return get_engine_history_by_id(0, start, end, step)
+
+@app.get("/engine/stream")
+async def stream_engine_status():
+    return await stream_engine_status_by_id(0)
+
+@app.get("/engine/{engine_id}/stream")
+async def stream_engine_status_by_id(engine_id: int):
+    if not engines:
+        return {"error": "Engine not initialized"}
+    engine = get_engine(engine_id)
+    if engine:
+        return StreamingResponse(
+            stream_engine_state(engine),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
+    return {"error": f"Engine {engine_id} not found"}
+
+@app.get("/engine/{engine_id}/history")
+def get_engine_history_by_id(engine_id: int, start: float | None = Query(None, alias="from"), end: float | None = Query(None, alias="to"), step: float | None = None):
+    """
+    Returns the recorded state changes between from and to (unix seconds),
+    downsampled to min/max/mean buckets of step seconds when step is given.
+    """
+    if not engines:
+        return {"error": "Engine not initialized"}
+    if step is not None and step <= 0:
+        return {"error": "step must be positive"}
+    engine = get_engine(engine_id)
+    if engine:
+        return engine.history(start, end, step)
+    return {"error": f"Engine {engine_id} not found"}
+
+@app.get("/engine/{engine_id}")
+async def get_engine_status_by_id(engine_id: int, wait_for_change: int | None = None, timeout: float = 30.0):
+    """
+    Returns the engine state. With wait_for_change=<version>, holds the
+    request until the state version differs from it or timeout expires.
+    """
+    if not engines:
+        return {"error": "Engine not initialized"}
+    engine = get_engine(engine_id)
+    if engine:
+        if wait_for_change is not None:
+            await engines_feed().wait_for_change(engine, wait_for_change, timeout)
+        return state_response(engine.get_state())
+    return {"error": f"Engine {engine_id} not found"}
+
+@app.post("/engine/{engine_id}/temperature")
+async def set_engine_temperature_by_id(engine_id: int, update: TemperatureUpdate):
+    if not engines:
+        return {"error": "Engine not initialized"}
+    engine = get_engine(engine_id)
+    if engine:
+        return state_response(engine.set_temperature(update.temperature))
+    return {"error": f"Engine {engine_id} not found"}
+
+@app.post("/engine/{engine_id}/temperature/delta")
+async def apply_engine_delta_by_id(engine_id: int, update: TemperatureDelta):
+    if not engines:
+        return {"error": "Engine not initialized"}
+    engine = get_engine(engine_id)
     if engine:
-        engine.set_temperature(update.temperature)
-        return engine.get_state()
-    return {"error": "Engine not initialized"}
+        return state_response(engine.apply_delta(update.delta))
+    return {"error": f"Engine {engine_id} not found"}
+
+@app.post("/engine/{engine_id}/cooling")
+async def apply_engine_cooling_by_id(engine_id: int, update: CoolingUpdate):
+    if not engines:
+        return {"error": "Engine not initialized"}
+    engine = get_engine(engine_id)
+    if engine:
+        return state_response(engine.apply_cooling(update.power, update.rpm, update.capacity, update.dt))
+    return {"error": f"Engine {engine_id} not found"}
+
+@app.post("/engine/{engine_id}/batch")
+async def apply_engine_batch_by_id(engine_id: int, batch: EngineBatch):
+    if not engines:
+        return {"error": "Engine not initialized"}
+    engine = get_engine(engine_id)
+    if engine:
+        try:
+            return state_response(engine.apply_batch(batch.operations))
+        except ValueError as e:
+            return {"error": str(e)}
+    return {"error": f"Engine {engine_id} not found"}
 
 @app.get("/")
-def root():
-    return get_engine_status()
+async def root():
+    return await get_engine_status()
 
-def monitor_modbus(context):
-    global engine
-    
-    slave_id = 0x00
-    address = 0x00
-    
+def engine_control(engine, value):
+    if value == 1 and not engine.running:
+        engine.start()
+    elif value == 0 and engine.running:
+        engine.stop()
+
+def build_device_context(engine, controls):
+    # Register tables live in the engine state, so processes sharing it see the same registers
+    registers = engine.bank.state.registers[engine.index]
+    callbacks = {table: {} for table in TABLES}
+    for table, address in controls:
+        callbacks[table][address + BLOCK_ADDRESS_OFFSET] = partial(engine_control, engine)
+    return ModbusDeviceContext(**{
+        table: ControlDataBlock(0, registers[position], callbacks[table], engine.bank.state.read)
+        for position, table in enumerate(TABLES)
+    })
+
+def observe_mirror(detector, indices, temperatures, running):
+    """
+    Feeds the temperature and status EngineBank.mirror() wrote to the anomaly
+    detector, whose device index is the engine index. The temperature is
+    observed decoded as one value at IR0: the statistics of the two float32
+    words would follow IEEE 754 bit patterns, not temperatures.
+    """
+    for index, temperature, status in zip(indices.tolist(), temperatures.tolist(), running.tolist()):
+        detector.observe(index, 4, TEMPERATURE_REGISTER, [temperature])
+        detector.observe(index, 2, STATUS_INPUT, [status])
+
+def parse_control(spec):
+    """
+    Parses a control point such as "hr:0" or "co:3" into (table, address).
+    """
+    table, _, address = spec.partition(":")
+    table = table.lower()
+    if table not in ("hr", "co") or not address.isdigit():
+        raise argparse.ArgumentTypeError(f"Invalid control point '{spec}', expected hr:<address> or co:<address>")
+    return table, int(address)
+
+def run_modbus_server(context, port=502, fast_server=None):
+    # Retry loop for Modbus server
     while True:
         try:
-            # Read holding register 0
-            # getValues returns a list
-            values = context[slave_id].getValues(3, address, count=1)
-            val = values[0]
-            
-            if engine:
-                if val == 1 and not engine.running:
-                    engine.start()
-                elif val == 0 and engine.running:
-                    engine.stop()
-                    
+            if fast_server:
+                asyncio.run(fast_server.serve_forever())
+            else:
+                asyncio.run(serve_modbus(context, ("0.0.0.0", port), journal, trace_pdu=trace_modbus_pdu))
         except Exception as e:
-            print(f"Error in modbus monitor: {e}")
-            
-        time.sleep(0.5)
+            print(f"Modbus server failed to start or crashed: {e}. Retrying in 2 seconds...")
+            time.sleep(2)
 
-def run_modbus_server(context):
+async def run_modbus_server_async(context, port=502, fast_server=None):
     # Retry loop for Modbus server
     while True:
         try:
-            StartTcpServer(context=context, address=("0.0.0.0", 502))
+            if fast_server:
+                await fast_server.serve_forever()
+            else:
+                await serve_modbus(context, ("0.0.0.0", port), journal, trace_pdu=trace_modbus_pdu)
         except Exception as e:
             print(f"Modbus server failed to start or crashed: {e}. Retrying in 2 seconds...")
-            time.sleep(2)
+            await asyncio.sleep(2)
+
+async def serve_async(config, sock, context, scheduler, modbus_port, fast_server=None):
+    """
+    Runs the Modbus server, the REST API on the pre-bound socket and the
+    simulation ticks as tasks of the current event loop.
+    """
+    server = uvicorn.Server(config)
+    await asyncio.gather(
+        run_modbus_server_async(context, modbus_port, fast_server),
+        server.serve(sockets=[sock]),
+        scheduler.run_async(),
+    )
 
 import socket
 
@@ -128,7 +717,8 @@ def bind_socket_robust(host, port, retries=5, delay=2):
     """
     for attempt in range(retries):
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # An explicit IPPROTO_TCP lets asyncio enable TCP_NODELAY on accepted connections
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.bind((host, port))
             return sock
@@ -139,58 +729,180 @@ def bind_socket_robust(host, port, retries=5, delay=2):
             else:
                 raise e
 
+def stop_workers(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
 def main():
-    global engine
     parser = argparse.ArgumentParser(description="Engine Simulator")
     parser.add_argument("-i", "--interface", type=str, required=False, default="0.0.0.0", help="Interface to bind to")
     parser.add_argument("-p", "--port", type=int, required=False, default=8000, help="Port to bind to") 
     parser.add_argument("-t", "--temperature-step", type=float, required=False, default=+1, help="Temperature increase step")
     parser.add_argument("-s", "--seconds", type=float, required=False, default=1, help="Time interval in seconds")
     parser.add_argument("-ts", "--temperature-start", type=float, required=False, default=30, help="Temperature start value")
+    parser.add_argument("-c", "--control", type=parse_control, action="append", required=False, help="Coil or register that starts (1) and stops (0) the engine, e.g. hr:0 or co:0 (repeatable, default hr:0)")
+    parser.add_argument("-n", "--engines", type=int, required=False, default=1, help="Number of engines simulated by this process")
+    parser.add_argument("-u", "--unit-base", type=int, required=False, default=1, help="Modbus unit ID of engine 0 when simulating more than one engine")
+    parser.add_argument("-mp", "--modbus-port", type=int, required=False, default=502, help="ModbusTCP port")
+    parser.add_argument("--fast-modbus", action="store_true", help="Serve Modbus reads and writes with the lightweight fast_modbus server, other requests still go to pymodbus")
+    add_limit_arguments(parser)
+    add_journal_arguments(parser)
+    add_anomaly_arguments(parser)
+    parser.add_argument("--async-mode", action="store_true", help="Run the Modbus server, REST API and simulation on a single asyncio event loop")
+    parser.add_argument("-hs", "--history-size", type=int, required=False, default=16384, help="Samples kept per engine for /engine/history, 17 bytes each per engine (about 4.5 hours at the default interval)")
+    parser.add_argument("-hi", "--history-interval", type=float, required=False, default=1.0, help="Seconds per /engine/history sample, state changes within one replace it; 0 records every change")
+    parser.add_argument("--shared-state", type=str, required=False, help="Keep engine state and registers in the named shared memory segment")
+    parser.add_argument("--attach", action="store_true", help="Serve the engines of an existing --shared-state segment without simulating them")
+    parser.add_argument("-w", "--workers", type=int, required=False, default=1, help="REST worker processes sharing the listening socket and engine state; /metrics then reports the process that answers each scrape")
+    parser.add_argument("-ka", "--keep-alive", type=float, required=False, default=60.0, help="Seconds an idle keep-alive HTTP connection stays open, longer than the slowest client's poll interval")
+    parser.add_argument("--backlog", type=int, required=False, default=2048, help="Pending connection queue length of the REST socket")
+    parser.add_argument("--access-log", action=argparse.BooleanOptionalAction, default=True, help="Log every REST request")
     args = parser.parse_args()
 
-    # start modbus server
-    store = ModbusDeviceContext(
-        hr=ModbusSequentialDataBlock(0, [0]*100),
-        co=ModbusSequentialDataBlock(0, [0]*100),
-        di=ModbusSequentialDataBlock(0, [0]*100),
-        ir=ModbusSequentialDataBlock(0, [0]*100),
-    )
-
-    context = ModbusServerContext(
-        devices=store,
-        single=True
-    )
+    if args.engines < 1:
+        parser.error("--engines must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.history_size < 1:
+        parser.error("--history-size must be at least 1")
+    if args.history_interval < 0:
+        parser.error("--history-interval must not be negative")
+    if args.attach and not args.shared_state:
+        parser.error("--attach requires --shared-state")
+    if args.workers > 1 and args.async_mode:
+        parser.error("--workers is not supported with --async-mode")
+    controls = args.control or [("hr", 0)]
 
-    threading.Thread(
-        target=run_modbus_server,
-        args=(context,),
-        daemon=True
-    ).start()
+    # Workers are separate processes, so they need the state in shared memory
+    segment = args.shared_state or (f"engine-{os.getpid()}" if args.workers > 1 else None)
+    if args.attach:
+        state = EngineState.attach(segment)
+    elif segment:
+        try:
+            # A segment named after this pid can only be left over from a crashed run
+            state = EngineState.create(segment, args.engines, args.history_size, replace=not args.shared_state)
+        except FileExistsError:
+            parser.error(f"Shared state {segment} already exists: serve it with --attach, or remove /dev/shm/{segment} if a crashed run left it behind")
+        atexit.register(state.unlink)
+    else:
+        state = None
 
     # start API REST
-    engine = Engine(args.temperature_step, args.seconds, args.temperature_start)
-    
-    # Start Modbus monitor thread
-    threading.Thread(target=monitor_modbus, args=(context,), daemon=True).start()
+    # In async mode the simulation ticks run on the event loop instead of a scheduler thread
+    scheduler = Scheduler(on_run=observe_tick)
+    registry.register(CallbackGauge(
+        "engine_tick_overruns_total", "Simulation ticks skipped because a tick overran its period",
+        lambda: {(name,): stats["overruns"] for name, stats in scheduler.stats().items()},
+        labels=("job",), kind="counter"
+    ))
+    bank = EngineBank(args.engines, args.temperature_step, args.seconds, args.temperature_start, scheduler=scheduler, history_size=args.history_size, state=state, simulate=not args.attach, history_interval=args.history_interval)
+    engines.extend(Engine(bank, index) for index in range(bank.count))
 
-    print(f"Starting Engine with step={args.temperature_step}, interval={args.seconds}, start_temp={args.temperature_start}")
+    # start modbus server
+    global journal, worker
+    journal = WriteJournal.from_args(args, current_source)
+    devices = [build_device_context(engine, controls) for engine in engines]
+    if journal:
+        for index, device in enumerate(devices):
+            journal.watch(device, f"engine{index}")
+    detector = AnomalyDetector.from_args(args)
+    if detector:
+        for index, device in enumerate(devices):
+            detector.watch(device, f"engine{index}")
+        # The mirrored input registers are written without setValues
+        bank.observer = partial(observe_mirror, detector)
+        registry.register(CallbackGauge(
+            "engine_anomaly_total", "Register writes analysed and dropped, and anomaly alerts raised and pushed",
+            lambda: {(name,): value for name, value in detector.stats.items()},
+            labels=("event",), kind="counter"
+        ))
+    if bank.count == 1:
+        # A single engine answers on every unit ID
+        context = ModbusServerContext(
+            devices=devices[0],
+            single=True
+        )
+    else:
+        context = ModbusServerContext(
+            devices={args.unit_base + index: device for index, device in enumerate(devices)},
+            single=False
+        )
+
+    limits = Limits.from_args(args)
+    fast_server = None
+    if args.fast_modbus or limits.enabled:
+        fast_server = FastModbusServer(context, ("0.0.0.0", args.modbus_port), observe_modbus, limits)
+        registry.register(CallbackGauge(
+            "engine_modbus_admission_total", "Modbus requests and connections by admission control outcome",
+            lambda: {(name,): value for name, value in fast_server.stats.items()},
+            labels=("event",), kind="counter"
+        ))
+
+    if args.attach:
+        print(f"Attached to {bank.count} engine(s) in shared state {segment}")
+    else:
+        print(f"Starting {args.engines} engine(s) with step={args.temperature_step}, interval={args.seconds}, start_temp={args.temperature_start}")
     
     # Robustly bind the socket and pass it to Uvicorn
     # This prevents the race condition where the port is released and stolen before Uvicorn starts
     try:
         sock = bind_socket_robust(args.interface, args.port)
+
         # Verify if we need to listen(), uvicorn usually expects a bound socket.
         # Calling listen is safe.
         # sock.listen(5) # Optional, uvicorn might do it, but let's be safe if we pass FD.
         # Actually, let's look at how uvicorn handles it. 
         # If we just bind, uvicorn will call listen.
         
-        print(f"Socket successfully bound to {args.interface}:{args.port}. Passing FD to Uvicorn...")
+        # Note: host/port are only used for logging here.
+        config = uvicorn.Config(
+            app, host=args.interface, port=args.port,
+            timeout_keep_alive=args.keep_alive, backlog=args.backlog, access_log=args.access_log
+        )
+
+        # Fork the extra REST workers before any thread starts; they accept on the
+        # same socket and only serve REST, the simulation and Modbus stay here
+        workers = []
+        for index in range(1, args.workers):
+            pid = os.fork()
+            if pid == 0:
+                worker = index
+                uvicorn.Server(config).run(sockets=[sock])
+                os._exit(0)
+            workers.append(pid)
+        if workers:
+            atexit.register(stop_workers, workers)
+        if journal:
+            journal.start()
+            if args.journal_port:
+                journal.serve(args.interface, args.journal_port)
+        if detector:
+            detector.start()
+
+        if not args.async_mode:
+            scheduler.start()
+            threading.Thread(
+                target=run_modbus_server,
+                args=(context, args.modbus_port, fast_server),
+                daemon=True
+            ).start()
+
+        if args.async_mode:
+            print(f"Socket successfully bound to {args.interface}:{args.port}. Serving Modbus, REST and simulation on one event loop...")
+            asyncio.run(serve_async(config, sock, context, scheduler, args.modbus_port, fast_server))
+            return
+
+        print(f"Socket successfully bound to {args.interface}:{args.port}. Passing socket to Uvicorn...")
         
-        # Pass the file descriptor to Uvicorn
-        # Note: When using fd, host/port args in run() are typically ignored for binding but used for logging.
-        uvicorn.run(app, fd=sock.fileno(), host=args.interface, port=args.port)
+        # Pass the socket itself rather than its FD: Uvicorn wraps bare FDs as AF_UNIX,
+        # which leaves Nagle enabled on every connection and adds ~40 ms per keep-alive request.
+        # Uvicorn re-raises SIGTERM after shutting down; exit normally so atexit cleanup runs
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        uvicorn.Server(config).run(sockets=[sock])
         
     except Exception as e:
         print(f"CRITICAL ERROR: Failed to start engine server: {e}")
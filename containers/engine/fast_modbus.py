@@ -0,0 +1,451 @@
+"""
+Lightweight asyncio Modbus/TCP server for polling and flood scenarios.
+
+Read coils/discrete inputs/holding/input registers (FC1-4), write single
+coil/register (FC5/6) and write multiple coils/registers (FC15/16) are
+parsed with precompiled structs and answered straight from the device
+context, without pymodbus' framer or PDU objects. Every complete request
+in a read is handled, so pipelined transactions on one connection get
+their answers in order, written back in one go.
+
+The datastore semantics are pymodbus': the same ModbusServerContext, the
+same getValues/setValues calls (so data block callbacks still run), the
+same unit ID handling. Blocks with a view() method, like
+compact_datablock.CompactDataBlock, serve register reads as zero-copy
+slices. Any other function code is decoded and run by pymodbus.
+
+Limits add admission control against floods and scans: a cap on open
+connections (extra ones are closed at once), a token bucket per source
+address (requests over the rate get DEVICE_BUSY), an idle timeout, and
+a bound on the requests queued per connection. A connection whose
+queue is full, or whose client does not read its answers, stops being
+read, so the backlog stays in the client's TCP window rather than in
+the device. stats counts what was rejected, throttled and closed.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import struct
+import time
+from collections import deque
+
+from pymodbus.constants import ExcCodes
+from pymodbus.exceptions import NoSuchIdException
+from pymodbus.pdu import DecodePDU
+
+log = logging.getLogger("fast_modbus")
+
+# Transaction ID, protocol ID, length (unit ID + PDU), unit ID
+MBAP = struct.Struct(">HHHB")
+MBAP_SIZE = 6
+# Largest length field: unit ID + the largest PDU (253 bytes)
+MAX_LENGTH = 254
+
+ADDRESS_COUNT = struct.Struct(">HH")
+ADDRESS_COUNT_BYTES = struct.Struct(">HHB")
+HEADER = struct.Struct(">BB")
+
+# Largest quantity per request, from the Modbus application protocol
+READ_LIMITS = {1: 2000, 2: 2000, 3: 125, 4: 125}
+WRITE_LIMITS = {15: 1968, 16: 123}
+COIL_ON = 0xFF00
+
+# pymodbus' device context shifts protocol addresses by one before they reach the data block
+BLOCK_ADDRESS_OFFSET = 1
+
+# Token buckets kept for sources without connections before idle ones are dropped
+MAX_SOURCES = 4096
+STATS_LOG_INTERVAL = 10.0
+
+# Client address of the request being handled, for write_journal. Protocol
+# callbacks and drain tasks run in their own contexts, so interleaved
+# connections don't see each other's
+_request_source = contextvars.ContextVar("fast_modbus_request_source", default=None)
+
+
+def current_source():
+    return _request_source.get()
+
+
+def pack_bits(values):
+    packed = bytearray((len(values) + 7) // 8)
+    for index, value in enumerate(values):
+        if value:
+            packed[index >> 3] |= 1 << (index & 7)
+    return packed
+
+
+def unpack_bits(data, count):
+    return [bool(data[index >> 3] & (1 << (index & 7))) for index in range(count)]
+
+
+def exception(function_code, code):
+    return HEADER.pack(function_code | 0x80, code)
+
+
+class Limits:
+    def __init__(self, max_connections=0, rate=0.0, burst=0.0, idle_timeout=0.0, queue_size=64):
+        """
+        0 disables a limit. burst defaults to one second worth of rate.
+        """
+        self.max_connections = max_connections
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.idle_timeout = idle_timeout
+        self.queue_size = max(queue_size, 1)
+
+    @property
+    def enabled(self):
+        return bool(self.max_connections or self.rate or self.idle_timeout)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.max_connections, args.rate_limit, args.burst, args.idle_timeout, args.queue_size)
+
+
+def add_limit_arguments(parser):
+    """
+    Adds the Limits options to parser. Defaults come from the MODBUS_*
+    environment variables, so containers can be tuned without new flags.
+    """
+    env = os.environ.get
+    group = parser.add_argument_group("Modbus admission control (any limit enables the fast server)")
+    group.add_argument("--max-connections", type=int, default=int(env("MODBUS_MAX_CONNECTIONS", 0)), help="Most simultaneous Modbus connections, 0 for no limit")
+    group.add_argument("--rate-limit", type=float, default=float(env("MODBUS_RATE_LIMIT", 0)), help="Requests per second allowed per source address, 0 for no limit")
+    group.add_argument("--burst", type=float, default=float(env("MODBUS_BURST", 0)), help="Requests a source may send at once above the rate (default: one second worth)")
+    group.add_argument("--idle-timeout", type=float, default=float(env("MODBUS_IDLE_TIMEOUT", 0)), help="Seconds without requests before a Modbus connection is closed, 0 to keep it")
+    group.add_argument("--queue-size", type=int, default=int(env("MODBUS_QUEUE_SIZE", 64)), help="Requests queued per connection before it stops being read")
+    return group
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class FastModbusServer:
+    def __init__(self, context, address, observe=None, limits=None):
+        """
+        observe(function_code, exception_code) is called for every request,
+        with the exception code of the answer or None.
+        """
+        self.context = context
+        self.address = address
+        self.observe = observe
+        self.limits = limits or Limits()
+        self.decoder = DecodePDU(True)
+        self.connections = 0
+        self.buckets = {}
+        self.stats = {"requests": 0, "throttled": 0, "rejected_connections": 0, "idle_closed": 0, "paused": 0}
+
+    async def serve_forever(self):
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: ModbusConnection(self), *self.address, reuse_address=True)
+        log.info(f"Fast Modbus server listening on {self.address[0]}:{self.address[1]}")
+        async with server:
+            if self.limits.enabled:
+                await asyncio.gather(server.serve_forever(), self.log_stats())
+            else:
+                await server.serve_forever()
+
+    async def log_stats(self):
+        logged = dict(self.stats)
+        while True:
+            await asyncio.sleep(STATS_LOG_INTERVAL)
+            if any(self.stats[name] != logged[name] for name in self.stats if name != "requests"):
+                logged = dict(self.stats)
+                log.warning(f"{self.address[1]}: {self.connections} connection(s), " + ", ".join(f"{name} {value}" for name, value in logged.items()))
+
+    def bucket(self, source):
+        """
+        The token bucket of a source address, shared by all its connections
+        and kept after they close, so reconnecting does not refill it.
+        """
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            now = time.monotonic()
+            if len(self.buckets) >= MAX_SOURCES:
+                self.buckets = {key: value for key, value in self.buckets.items() if not value.full(now)}
+            bucket = self.buckets[source] = TokenBucket(self.limits.rate, self.limits.burst, now)
+        return bucket
+
+    def device(self, unit):
+        try:
+            return self.context[unit]
+        except NoSuchIdException:
+            return None
+
+    def respond(self, unit, pdu):
+        """
+        Returns the response PDU for a request PDU, or None when pymodbus
+        has to handle it.
+        """
+        function_code = pdu[0]
+        if function_code not in READ_LIMITS and function_code not in (5, 6, 15, 16):
+            return None
+        device = self.device(unit)
+        if device is None:
+            response = exception(function_code, ExcCodes.GATEWAY_NO_RESPONSE)
+        else:
+            try:
+                response = self.execute(device, function_code, pdu)
+            except Exception as e:
+                log.error(f"Datastore unable to fulfill request: {e}")
+                response = exception(function_code, ExcCodes.DEVICE_FAILURE)
+        if self.observe:
+            self.observe(function_code, response[1] if response[0] & 0x80 else None)
+        return response
+
+    def execute(self, device, function_code, pdu):
+        if function_code in READ_LIMITS:
+            if len(pdu) != 5:
+                return exception(function_code, ExcCodes.ILLEGAL_VALUE)
+            address, count = ADDRESS_COUNT.unpack_from(pdu, 1)
+            if not 1 <= count <= READ_LIMITS[function_code]:
+                return exception(function_code, ExcCodes.ILLEGAL_VALUE)
+            return self.read(device, function_code, address, count)
+
+        if function_code in (5, 6):
+            if len(pdu) != 5:
+                return exception(function_code, ExcCodes.ILLEGAL_VALUE)
+            address, value = ADDRESS_COUNT.unpack_from(pdu, 1)
+            if function_code == 5:
+                if value not in (COIL_ON, 0):
+                    return exception(function_code, ExcCodes.ILLEGAL_VALUE)
+                value = value == COIL_ON
+            result = device.setValues(function_code, address, [value])
+            # The answer to a single write echoes the request
+            return exception(function_code, result) if result else bytes(pdu)
+
+        if len(pdu) < 6:
+            return exception(function_code, ExcCodes.ILLEGAL_VALUE)
+        address, count, size = ADDRESS_COUNT_BYTES.unpack_from(pdu, 1)
+        expected = (count + 7) // 8 if function_code == 15 else count * 2
+        if not 1 <= count <= WRITE_LIMITS[function_code] or size != expected or len(pdu) != 6 + size:
+            return exception(function_code, ExcCodes.ILLEGAL_VALUE)
+        data = pdu[6:]
+        if function_code == 15:
+            values = unpack_bits(data, count)
+        elif hasattr(self.block(device, function_code), "view"):
+            # Wire-order blocks take the request payload as is
+            values = bytes(data)
+        else:
+            values = list(struct.unpack(f">{count}H", data))
+        result = device.setValues(function_code, address, values)
+        if result:
+            return exception(function_code, result)
+        return bytes((function_code,)) + ADDRESS_COUNT.pack(address, count)
+
+    def read(self, device, function_code, address, count):
+        block = self.block(device, function_code)
+        view = getattr(block, "view", None)
+        if view and function_code in (3, 4):
+            values = view(address + BLOCK_ADDRESS_OFFSET, count)
+            if isinstance(values, ExcCodes):
+                return exception(function_code, values)
+            return HEADER.pack(function_code, count * 2) + values
+        values = device.getValues(function_code, address, count)
+        if isinstance(values, ExcCodes):
+            return exception(function_code, values)
+        if function_code in (1, 2):
+            payload = pack_bits(values)
+        else:
+            try:
+                payload = struct.pack(f">{count}H", *values)
+            except struct.error:
+                log.error(f"Registers {address}-{address + count - 1} hold values that do not fit 16 bits")
+                return exception(function_code, ExcCodes.DEVICE_FAILURE)
+        return HEADER.pack(function_code, len(payload)) + payload
+
+    @staticmethod
+    def block(device, function_code):
+        store = getattr(device, "store", None)
+        return store.get(device.decode(function_code)) if isinstance(store, dict) else None
+
+    async def fallback(self, unit, transaction, pdu):
+        """
+        Runs a request the fast path does not handle through pymodbus.
+        """
+        request = self.decoder.decode(bytes(pdu))
+        if request is None:
+            response = exception(pdu[0], ExcCodes.ILLEGAL_FUNCTION)
+        else:
+            device = self.device(unit)
+            try:
+                if device is None:
+                    response = exception(pdu[0], ExcCodes.GATEWAY_NO_RESPONSE)
+                else:
+                    result = await request.update_datastore(device)
+                    response = result.function_code.to_bytes(1, "big") + result.encode()
+            except Exception as e:
+                log.error(f"Datastore unable to fulfill request: {e}")
+                response = exception(pdu[0], ExcCodes.DEVICE_FAILURE)
+        if self.observe:
+            self.observe(pdu[0], response[1] if response[0] & 0x80 else None)
+        return response
+
+
+class ModbusConnection(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.accepted = False
+        self.buffer = bytearray()
+        # (transaction, unit, pdu, response) waiting behind a request pymodbus is handling,
+        # to keep answers in order; response is set for requests answered up front
+        self.pending = deque()
+        self.draining = False
+        self.bucket = None
+        self.source = None
+        self.write_paused = False
+        self.read_paused = False
+        self.last_activity = 0.0
+        self.idle_timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        server = self.server
+        limits = server.limits
+        if limits.max_connections and server.connections >= limits.max_connections:
+            server.stats["rejected_connections"] += 1
+            transport.abort()
+            return
+        self.accepted = True
+        server.connections += 1
+        peer = transport.get_extra_info("peername")
+        self.source = peer[0] if peer else None
+        if limits.rate:
+            self.bucket = server.bucket(self.source)
+        if limits.idle_timeout:
+            self.last_activity = time.monotonic()
+            self.idle_timer = asyncio.get_running_loop().call_later(limits.idle_timeout, self.check_idle)
+
+    def connection_lost(self, exc):
+        if self.accepted:
+            self.server.connections -= 1
+        if self.idle_timer:
+            self.idle_timer.cancel()
+        self.transport = None
+
+    def check_idle(self):
+        if not self.transport:
+            return
+        timeout = self.server.limits.idle_timeout
+        idle = time.monotonic() - self.last_activity
+        if idle >= timeout:
+            self.server.stats["idle_closed"] += 1
+            self.transport.close()
+        else:
+            self.idle_timer = asyncio.get_running_loop().call_later(timeout - idle, self.check_idle)
+
+    def pause_writing(self):
+        # The client is not reading its answers, stop reading its requests
+        self.write_paused = True
+        self.update_reading()
+
+    def resume_writing(self):
+        self.write_paused = False
+        self.update_reading()
+
+    def update_reading(self):
+        if not self.transport:
+            return
+        paused = self.write_paused or len(self.pending) >= self.server.limits.queue_size
+        if paused != self.read_paused:
+            self.read_paused = paused
+            if paused:
+                self.server.stats["paused"] += 1
+                self.transport.pause_reading()
+            else:
+                self.transport.resume_reading()
+
+    def data_received(self, data):
+        self.buffer += data
+        if self.idle_timer:
+            self.last_activity = time.monotonic()
+        self.process()
+
+    def process(self):
+        server = self.server
+        queue_size = server.limits.queue_size
+        now = time.monotonic()
+        _request_source.set(self.source)
+        responses = []
+        offset = 0
+        while len(self.buffer) - offset >= MBAP_SIZE + 1 and len(self.pending) < queue_size:
+            transaction, protocol, length, unit = MBAP.unpack_from(self.buffer, offset)
+            if protocol != 0 or not 2 <= length <= MAX_LENGTH:
+                log.error(f"Invalid MBAP header (protocol {protocol}, length {length}), closing connection")
+                self.transport.close()
+                return
+            end = offset + MBAP_SIZE + length
+            if end > len(self.buffer):
+                break
+            pdu = bytes(self.buffer[offset + MBAP_SIZE + 1:end])
+            offset = end
+            server.stats["requests"] += 1
+            if self.bucket and not self.bucket.take(now):
+                server.stats["throttled"] += 1
+                busy = exception(pdu[0], ExcCodes.DEVICE_BUSY)
+                if self.draining:
+                    # Answered in turn, after the requests queued before it
+                    self.pending.append((transaction, unit, pdu, busy))
+                else:
+                    responses.append(self.frame(transaction, unit, busy))
+                continue
+            if self.draining:
+                self.pending.append((transaction, unit, pdu, None))
+                continue
+            response = server.respond(unit, pdu)
+            if response is None:
+                self.pending.append((transaction, unit, pdu, None))
+                self.draining = True
+                asyncio.ensure_future(self.drain())
+            else:
+                responses.append(self.frame(transaction, unit, response))
+        del self.buffer[:offset]
+        if responses:
+            self.transport.write(b"".join(responses))
+        self.update_reading()
+
+    async def drain(self):
+        while self.pending and self.transport:
+            transaction, unit, pdu, response = self.pending.popleft()
+            if response is None:
+                _request_source.set(self.source)
+                response = self.server.respond(unit, pdu)
+            if response is None:
+                _request_source.set(self.source)
+                response = await self.server.fallback(unit, transaction, pdu)
+            if self.transport:
+                self.transport.write(self.frame(transaction, unit, response))
+        self.draining = False
+        if self.transport:
+            # Requests left in the buffer while the queue was full
+            self.process()
+
+    @staticmethod
+    def frame(transaction, unit, response):
+        return MBAP.pack(transaction, 0, len(response) + 1, unit) + response
+
+
+def run(context, address, observe=None, limits=None):
+    """
+    Serves context on address until interrupted, like pymodbus' StartTcpServer.
+    """
+    asyncio.run(FastModbusServer(context, address, observe, limits).serve_forever())
@@ -0,0 +1,163 @@
+"""
+Engine bank storage laid out as NumPy arrays over one flat buffer. The buffer
+is either private to the process or a multiprocessing.shared_memory segment
+that other engine.py processes (REST workers, Modbus servers) attach to by name.
+
+Writers serialize on EngineState.lock, which also excludes writers in other
+processes for shared segments. Readers go through read(), a seqlock that
+retries instead of blocking writers.
+"""
+import fcntl
+import os
+import tempfile
+import threading
+from math import prod
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Registers per Modbus table and engine
+REGISTERS = 100
+
+# Order of the Modbus tables in the register array
+TABLES = ("hr", "co", "di", "ir")
+
+# Header words: seqlock sequence, engine count, history size, registers per table
+HEADER = 4
+
+# Optimistic seqlock read attempts before falling back to the writer lock
+READ_RETRIES = 3
+
+
+def _layout(count, history_size):
+    fields = [
+        ("temperature", np.float64, (count,)),
+        ("temp_step", np.float64, (count,)),
+        ("interval", np.float64, (count,)),
+        ("version", np.int64, (count,)),
+        ("history_head", np.int64, (count,)),
+        ("history_size", np.int64, (count,)),
+        ("history_opened", np.float64, (count,)),
+        ("history_interval", np.float64, ()),
+        ("history_timestamp", np.float64, (count, history_size)),
+        ("history_temperature", np.float64, (count, history_size)),
+        ("registers", np.uint16, (count, len(TABLES), REGISTERS)),
+        ("running", np.bool_, (count,)),
+        ("history_running", np.bool_, (count, history_size)),
+    ]
+    layout = []
+    offset = HEADER * 8
+    for name, dtype, shape in fields:
+        offset = (offset + 7) // 8 * 8
+        layout.append((name, dtype, shape, offset))
+        offset += np.dtype(dtype).itemsize * prod(shape)
+    return layout, offset
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+
+def _attach_segment(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with the resource
+        # tracker, which would unlink it when this process exits
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class StateLock:
+    """
+    Writer lock that excludes other threads and, given a lock file, other
+    processes. Bumps the seqlock sequence to odd on entry and back to even on exit.
+    """
+
+    def __init__(self, header, path=None):
+        self.header = header
+        self._thread_lock = threading.Lock()
+        self._file = open(path, "a+b") if path else None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._file:
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+        self.header[0] += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.header[0] += 1
+        if self._file:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class EngineState:
+    def __init__(self, count, history_size, buffer, lock_path=None):
+        self.count = count
+        self.history_capacity = history_size
+        self.header = np.ndarray((HEADER,), dtype=np.int64, buffer=buffer)
+        layout, _ = _layout(count, history_size)
+        for name, dtype, shape, offset in layout:
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset))
+        self.shared = lock_path is not None
+        self.lock = StateLock(self.header, lock_path)
+        self._segment = None
+
+    @classmethod
+    def local(cls, count, history_size):
+        _, size = _layout(count, history_size)
+        return cls(count, history_size, bytearray(size))
+
+    @classmethod
+    def create(cls, name, count, history_size, replace=False):
+        """
+        Creates the named segment. An existing one, e.g. left behind by a
+        crashed run, raises FileExistsError unless replace is set, which
+        unlinks it first; processes still attached keep using the old one.
+        """
+        _, size = _layout(count, history_size)
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        state = cls(count, history_size, segment.buf, _lock_path(name))
+        state.header[1:] = (count, history_size, REGISTERS)
+        state._segment = segment
+        return state
+
+    @classmethod
+    def attach(cls, name):
+        segment = _attach_segment(name)
+        count, history_size, registers = np.ndarray((HEADER,), dtype=np.int64, buffer=segment.buf)[1:].tolist()
+        if registers != REGISTERS:
+            raise ValueError(f"Shared state {name} has {registers} registers per table, expected {REGISTERS}")
+        state = cls(count, history_size, segment.buf, _lock_path(name))
+        state._segment = segment
+        return state
+
+    def read(self, fn):
+        """
+        Returns fn() computed from a consistent snapshot. fn must copy what it
+        reads, since it may run concurrently with a writer and be retried.
+        """
+        sequence = self.header
+        for _ in range(READ_RETRIES):
+            before = int(sequence[0])
+            if before & 1 == 0:
+                result = fn()
+                if int(sequence[0]) == before:
+                    return result
+        with self.lock:
+            return fn()
+
+    def unlink(self):
+        if self._segment is not None:
+            self._segment.unlink()
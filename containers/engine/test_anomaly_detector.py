@@ -0,0 +1,74 @@
+from functools import partial
+
+from pymodbus.datastore import ModbusDeviceContext, ModbusSequentialDataBlock
+
+from anomaly_detector import AnomalyDetector
+from engine import EngineBank, observe_mirror
+
+
+def watched(**options):
+    detector = AnomalyDetector(**options)
+    device = ModbusDeviceContext(hr=ModbusSequentialDataBlock(0, [0] * 16), di=ModbusSequentialDataBlock(0, [0] * 16))
+    detector.watch(device, "engine0")
+    return detector, device
+
+
+def kinds(detector):
+    return [alert["kind"] for _, _, alert in detector.pending]
+
+
+def test_hr0_toggle_alerts():
+    detector, device = watched()
+    # A start/stop switch flipped twice a second, too slow for the write rate check
+    for tick in range(40):
+        device.setValues(6, 0, [tick % 2])
+    for index, item in enumerate(list(detector.queue)):
+        detector.process(index * 0.5, *item[1:])
+    # Once per cooldown, the first within four flips
+    assert kinds(detector) == ["toggle", "toggle"]
+    assert detector.pending[0][0] <= 2.0
+    assert detector.pending[0][2]["address"] == 0
+
+
+def test_occasional_start_stop_does_not_alert():
+    detector, _ = watched()
+    for index, value in enumerate([0] * 30 + [1] * 30 + [0] * 30):
+        detector.process(index * 1.0, 0, 6, 0, [value])
+    assert kinds(detector) == []
+
+
+def test_register_leaving_0_1_is_not_binary():
+    detector, _ = watched()
+    for index in range(40):
+        detector.process(index * 0.5, 0, 4, 0, [index % 2 + 2 * (index == 0)])
+    assert "toggle" not in kinds(detector)
+
+
+def test_observe_feeds_updates_made_without_setvalues():
+    detector, _ = watched(toggle_rate=0.1)
+    for index in range(4):
+        detector.observe(0, 2, 0, [index % 2 == 1])
+    assert detector.drain() == 4
+    assert kinds(detector) == ["toggle"]
+    assert detector.pending[0][2]["table"] == "di"
+
+
+def test_range_alert():
+    detector, _ = watched(ranges=[(None, "hr", 0, 0, 3000)])
+    detector.process(0.0, 0, 6, 0, [4000])
+    assert kinds(detector) == ["range"]
+
+
+def test_mirrored_temperature_is_observed_decoded():
+    detector, _ = watched(ranges=[(None, "ir", 0, -10, 120)])
+    bank = EngineBank(1, 1.0, 1.0, simulate=False)
+    bank.observer = partial(observe_mirror, detector)
+    for second in range(101):
+        bank.temperature[0] = 100.0 - second
+        bank.mirror(0)
+        while detector.queue:
+            detector.process(float(second), *detector.queue.popleft()[1:])
+    # Ordinary cooling, which the float32 words of IR0-IR1 made look wild
+    assert kinds(detector) == []
+    assert detector.registers[0][("ir", 0)].value == 0.0
+    assert ("ir", 1) not in detector.registers[0]
@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import random
+import struct
+from array import array
+from collections import Counter
+
+import pytest
+from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
+
+from bench_modbus import POOL_SIZE, build_pool, parse_operation, run_load, summarize
+from fast_modbus import FastModbusServer, ModbusConnection
+
+
+def test_parse_operation():
+    operation = parse_operation("3:0-9:4=60")
+    assert (operation.function_code, operation.first, operation.last, operation.count, operation.weight) == (3, 0, 9, 4, 60.0)
+    operation = parse_operation("6:5")
+    assert (operation.first, operation.last, operation.count, operation.weight) == (5, 5, 1, 1.0)
+    assert parse_operation("4").first == 0
+
+
+@pytest.mark.parametrize("spec", [
+    "x", "3:a-b", "3:0-9:4:1", "7:0", "3:0-9:126", "6:0-9:2", "3:5-2", "3:0-2:4", "3:0-70000", "3:0=0", "3:0=-1",
+])
+def test_parse_operation_errors(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_operation(spec)
+
+
+@pytest.mark.parametrize("spec", ["1:0-99:16", "3:10-19:4", "4:0-3:4"])
+def test_reads_stay_inside_the_range(spec):
+    operation = parse_operation(spec)
+    rng = random.Random(1)
+    for _ in range(200):
+        function_code, address, count = struct.unpack(">BHH", operation.request(rng))
+        assert function_code == operation.function_code and count == operation.count
+        assert operation.first <= address and address + count - 1 <= operation.last
+
+
+def test_write_requests():
+    rng = random.Random(2)
+    assert struct.unpack(">BHH", parse_operation("5:3").request(rng))[2] in (0, 0xFF00)
+    pdu = parse_operation("15:0-20:10").request(rng)
+    assert pdu[0] == 15 and pdu[5] == 2 and len(pdu) == 8
+    pdu = parse_operation("16:0-20:3").request(rng)
+    function_code, address, count, size = struct.unpack_from(">BHHB", pdu)
+    assert (function_code, count, size, len(pdu)) == (16, 3, 6, 12)
+    assert all(value <= 1000 for value in struct.unpack_from(">3H", pdu, 6))
+
+
+def test_pool_follows_the_weights_and_the_seed():
+    mix = [parse_operation("3:0=60"), parse_operation("4:0=30"), parse_operation("6:0=10")]
+    pool = build_pool(mix, seed=3)
+    assert len(pool) == POOL_SIZE
+    assert pool == build_pool(mix, seed=3)
+    counts = Counter(pdu[0] for pdu in pool)
+    assert counts[3] / POOL_SIZE == pytest.approx(0.6, abs=0.03)
+    assert counts[6] / POOL_SIZE == pytest.approx(0.1, abs=0.03)
+
+
+def test_summarize():
+    assert summarize(array("d"), 1.0)["requests"] == 0
+    summary = summarize(array("d", [0.001] * 99 + [0.101]), 2.0)
+    assert summary["requests"] == 100
+    assert summary["rps"] == 50.0
+    assert summary["p50_ms"] == pytest.approx(1.0)
+    assert summary["max_ms"] == pytest.approx(101.0)
+
+
+def test_run_load_against_fast_modbus():
+    device = ModbusDeviceContext(hr=ModbusSequentialDataBlock(0, [0] * 16), ir=ModbusSequentialDataBlock(0, [0] * 16))
+    fast = FastModbusServer(ModbusServerContext(devices=device, single=True), ("127.0.0.1", 0))
+    # Reads past the end of the 16-register block answer ILLEGAL_ADDRESS
+    pool = build_pool([parse_operation("3:0-9:4=3"), parse_operation("6:0-9=1"), parse_operation("4:20-29:2=1")], seed=1)
+
+    async def run():
+        server = await asyncio.get_running_loop().create_server(lambda: ModbusConnection(fast), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await run_load(("127.0.0.1", port), 1, pool, 2, 4, None, 0.1, 0.3, 1.0, 1)
+
+    results = asyncio.run(run())
+    assert set(results.latencies) == {3, 4, 6}
+    assert set(results.exceptions) == {"4:2"}
+    assert results.exceptions["4:2"] == len(results.latencies[4])
+    assert (results.timeouts, results.disconnects, results.connect_errors, results.unexpected) == (0, 0, 0, 0)
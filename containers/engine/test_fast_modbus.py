@@ -0,0 +1,333 @@
+import asyncio
+import struct
+
+from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
+
+from fast_modbus import MBAP, FastModbusServer, Limits, ModbusConnection, TokenBucket, current_source
+
+
+class FakeTransport:
+    def __init__(self, peer=("127.0.0.1", 50000)):
+        self.peer = peer
+        self.written = []
+        self.closed = False
+        self.reading = True
+
+    def get_extra_info(self, name):
+        return self.peer if name == "peername" else None
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+    abort = close
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+
+def device():
+    return ModbusDeviceContext(
+        di=ModbusSequentialDataBlock(0, [0] * 32), co=ModbusSequentialDataBlock(0, [0] * 32),
+        hr=ModbusSequentialDataBlock(0, [0] * 32), ir=ModbusSequentialDataBlock(0, [0] * 32)
+    )
+
+
+def server(units=None, **options):
+    if units is None:
+        context = ModbusServerContext(devices=device(), single=True)
+    else:
+        context = ModbusServerContext(devices={unit: device() for unit in units}, single=False)
+    return FastModbusServer(context, ("127.0.0.1", 0), **options)
+
+
+def connect(server, peer=("127.0.0.1", 50000)):
+    connection = ModbusConnection(server)
+    connection.connection_made(FakeTransport(peer))
+    return connection
+
+
+def request(transaction, pdu, unit=1):
+    return MBAP.pack(transaction, 0, len(pdu) + 1, unit) + pdu
+
+
+def responses(connection):
+    """
+    Returns (transaction, unit, pdu) of every answer written so far.
+    """
+    data = b"".join(connection.transport.written)
+    frames = []
+    while data:
+        transaction, protocol, length, unit = MBAP.unpack_from(data)
+        assert protocol == 0
+        frames.append((transaction, unit, data[7:6 + length]))
+        data = data[6 + length:]
+    return frames
+
+
+def read(function_code, address, count):
+    return struct.pack(">BHH", function_code, address, count)
+
+
+async def drained(connection):
+    while connection.draining:
+        await asyncio.sleep(0)
+
+
+def test_read_holding_registers():
+    fast = server()
+    fast.context[0].setValues(3, 2, [10, 20, 30])
+    connection = connect(fast)
+    connection.data_received(request(7, read(3, 2, 3), unit=5))
+    assert responses(connection) == [(7, 5, bytes([3, 6, 0, 10, 0, 20, 0, 30]))]
+
+
+def test_read_coils_are_packed():
+    fast = server()
+    fast.context[0].setValues(1, 0, [True, False, True, True, False, False, False, False, True])
+    connection = connect(fast)
+    connection.data_received(request(1, read(1, 0, 9)))
+    assert responses(connection) == [(1, 1, bytes([1, 2, 0b00001101, 0b00000001]))]
+
+
+def test_pipelined_requests_are_answered_in_order_in_one_write():
+    fast = server()
+    fast.context[0].setValues(4, 0, [1, 2])
+    connection = connect(fast)
+    connection.data_received(b"".join(request(transaction, read(4, transaction - 1, 1)) for transaction in (1, 2, 3)))
+    assert len(connection.transport.written) == 1
+    assert [(transaction, pdu[-1]) for transaction, _, pdu in responses(connection)] == [(1, 1), (2, 2), (3, 0)]
+
+
+def test_partial_frames_wait_for_the_rest():
+    fast = server()
+    connection = connect(fast)
+    frame = request(1, read(3, 0, 1)) + request(2, read(3, 1, 1))
+    for index in range(len(frame)):
+        connection.data_received(frame[index:index + 1])
+        if index < 11:
+            assert responses(connection) == []
+    assert [transaction for transaction, _, _ in responses(connection)] == [1, 2]
+    assert connection.buffer == bytearray()
+
+
+def test_invalid_mbap_closes_connection():
+    connection = connect(server())
+    connection.data_received(struct.pack(">HHHB", 1, 1, 6, 1) + read(3, 0, 1))
+    assert connection.transport.closed
+    assert responses(connection) == []
+
+
+def test_oversized_length_closes_connection():
+    connection = connect(server())
+    connection.data_received(struct.pack(">HHHB", 1, 0, 300, 1))
+    assert connection.transport.closed
+
+
+def test_read_quantity_limits():
+    connection = connect(server())
+    connection.data_received(request(1, read(3, 0, 0)) + request(2, read(3, 0, 126)) + request(3, read(1, 0, 2001)))
+    assert [pdu for _, _, pdu in responses(connection)] == [bytes([0x83, 3]), bytes([0x83, 3]), bytes([0x81, 3])]
+
+
+def test_read_outside_block_is_illegal_address():
+    connection = connect(server())
+    connection.data_received(request(1, read(3, 30, 10)))
+    assert responses(connection) == [(1, 1, bytes([0x83, 2]))]
+
+
+def test_write_single_register_echoes_request():
+    fast = server()
+    connection = connect(fast)
+    pdu = struct.pack(">BHH", 6, 4, 1234)
+    connection.data_received(request(1, pdu))
+    assert responses(connection) == [(1, 1, pdu)]
+    assert fast.context[0].getValues(3, 4, 1) == [1234]
+
+
+def test_write_single_coil_only_takes_on_and_off():
+    fast = server()
+    connection = connect(fast)
+    connection.data_received(request(1, struct.pack(">BHH", 5, 3, 0xFF00)) + request(2, struct.pack(">BHH", 5, 3, 0x1234)))
+    assert [pdu for _, _, pdu in responses(connection)] == [struct.pack(">BHH", 5, 3, 0xFF00), bytes([0x85, 3])]
+    assert fast.context[0].getValues(1, 3, 1) == [True]
+
+
+def test_write_multiple_registers_and_coils():
+    fast = server()
+    connection = connect(fast)
+    connection.data_received(
+        request(1, struct.pack(">BHHB3H", 16, 1, 3, 6, 7, 8, 9))
+        + request(2, struct.pack(">BHHBB", 15, 0, 3, 1, 0b101))
+    )
+    assert [pdu for _, _, pdu in responses(connection)] == [struct.pack(">BHH", 16, 1, 3), struct.pack(">BHH", 15, 0, 3)]
+    assert fast.context[0].getValues(3, 1, 3) == [7, 8, 9]
+    assert fast.context[0].getValues(1, 0, 3) == [True, False, True]
+
+
+def test_write_multiple_byte_count_must_match():
+    fast = server()
+    connection = connect(fast)
+    connection.data_received(request(1, struct.pack(">BHHB2H", 16, 0, 3, 4, 1, 2)))
+    assert responses(connection) == [(1, 1, bytes([0x90, 3]))]
+    assert fast.context[0].getValues(3, 0, 2) == [0, 0]
+
+
+def test_unknown_unit():
+    connection = connect(server(units=[1, 2]))
+    connection.data_received(request(1, read(3, 0, 1), unit=2) + request(2, read(3, 0, 1), unit=9))
+    assert [pdu for _, _, pdu in responses(connection)] == [bytes([3, 2, 0, 0]), bytes([0x83, 0x0B])]
+
+
+def test_source_is_known_while_handling():
+    sources = []
+    fast = server()
+    fast.context[0].setValues = lambda function_code, address, values: sources.append(current_source())
+    connection = connect(fast, peer=("10.0.0.7", 1234))
+    connection.data_received(request(1, struct.pack(">BHH", 6, 0, 1)))
+    assert sources == ["10.0.0.7"]
+
+
+def test_source_stays_with_a_request_awaiting_the_fallback():
+    async def run():
+        sources = []
+        release = asyncio.Event()
+        fast = server()
+
+        async def fallback(unit, transaction, pdu):
+            await release.wait()
+            sources.append(current_source())
+            return pdu
+
+        fast.fallback = fallback
+        slow = connect(fast, peer=("10.0.0.1", 1))
+        slow.data_received(request(1, bytes([23, 0, 0, 0, 1, 0, 0, 0, 0])))
+        await asyncio.sleep(0)
+        # Another client is handled while the first request waits
+        connect(fast, peer=("10.0.0.2", 2)).data_received(request(1, read(3, 0, 1)))
+        release.set()
+        await drained(slow)
+        return sources
+
+    assert asyncio.run(run()) == ["10.0.0.1"]
+
+
+def test_fallback_runs_other_function_codes_through_pymodbus_in_order():
+    async def run():
+        fast = server()
+        fast.context[0].setValues(3, 0, [5, 6])
+        connection = connect(fast)
+        # Read/write multiple registers (FC23), then a read queued behind it
+        fc23 = struct.pack(">BHHHHB2H", 23, 0, 2, 10, 2, 4, 11, 12)
+        connection.data_received(request(1, fc23) + request(2, read(3, 10, 2)))
+        assert responses(connection) == []
+        await drained(connection)
+        return responses(connection)
+
+    assert asyncio.run(run()) == [(1, 1, bytes([23, 4, 0, 5, 0, 6])), (2, 1, bytes([3, 4, 0, 11, 0, 12]))]
+
+
+def test_fallback_unknown_function_code():
+    async def run():
+        connection = connect(server())
+        connection.data_received(request(1, bytes([0x41, 0, 0])))
+        await drained(connection)
+        return responses(connection)
+
+    assert asyncio.run(run()) == [(1, 1, bytes([0xC1, 1]))]
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2.0, burst=2.0, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [True, True, False]
+    assert not bucket.full(0.5)
+    assert bucket.take(0.5)
+    assert bucket.full(1.5)
+
+
+def test_limits_defaults():
+    assert not Limits().enabled
+    assert Limits(rate=50).burst == 50
+    assert Limits(rate=0.5).burst == 1.0
+    assert Limits(queue_size=0).queue_size == 1
+
+
+def test_rate_limit_answers_device_busy():
+    fast = server(limits=Limits(rate=1.0, burst=2.0))
+    connection = connect(fast)
+    connection.data_received(b"".join(request(transaction, read(3, 0, 1)) for transaction in (1, 2, 3)))
+    assert [pdu for _, _, pdu in responses(connection)] == [bytes([3, 2, 0, 0])] * 2 + [bytes([0x83, 6])]
+    assert fast.stats["throttled"] == 1
+
+
+def test_rate_limit_is_shared_by_connections_of_a_source():
+    fast = server(limits=Limits(rate=1.0, burst=1.0))
+    first, second, other = connect(fast), connect(fast), connect(fast, peer=("127.0.0.2", 50000))
+    for connection in (first, second, other):
+        connection.data_received(request(1, read(3, 0, 1)))
+    assert [responses(connection)[0][2][0] for connection in (first, second, other)] == [3, 0x83, 3]
+
+
+def test_throttled_answers_stay_behind_queued_requests():
+    async def run():
+        fast = server(limits=Limits(rate=1.0, burst=3.0))
+        connection = connect(fast)
+        fc23 = struct.pack(">BHHHHB1H", 23, 0, 1, 0, 1, 2, 1)
+        connection.data_received(request(1, fc23) + b"".join(request(transaction, read(3, 0, 1)) for transaction in range(2, 7)))
+        await drained(connection)
+        return [(transaction, pdu[0]) for transaction, _, pdu in responses(connection)]
+
+    assert asyncio.run(run()) == [(1, 0x17), (2, 3), (3, 3), (4, 0x83), (5, 0x83), (6, 0x83)]
+
+
+def test_max_connections():
+    fast = server(limits=Limits(max_connections=1))
+    first, second = connect(fast), connect(fast)
+    assert not first.transport.closed and second.transport.closed
+    assert fast.stats["rejected_connections"] == 1
+    second.connection_lost(None)
+    first.connection_lost(None)
+    assert fast.connections == 0
+    assert not connect(fast).transport.closed
+
+
+def test_full_queue_pauses_reading():
+    async def run():
+        fast = server(limits=Limits(queue_size=2))
+        connection = connect(fast)
+        fc23 = struct.pack(">BHHHHB1H", 23, 0, 1, 0, 1, 2, 1)
+        connection.data_received(request(1, fc23) + b"".join(request(transaction, read(3, 0, 1)) for transaction in range(2, 6)))
+        paused = not connection.transport.reading
+        # The rest stays in the buffer until the queue drains
+        buffered = len(connection.buffer)
+        await drained(connection)
+        return paused, buffered, connection.transport.reading, [transaction for transaction, _, _ in responses(connection)]
+
+    paused, buffered, reading, transactions = asyncio.run(run())
+    assert paused and buffered and reading
+    assert transactions == [1, 2, 3, 4, 5]
+
+
+def test_client_not_reading_pauses_reading():
+    connection = connect(server())
+    connection.pause_writing()
+    assert not connection.transport.reading
+    connection.resume_writing()
+    assert connection.transport.reading
+
+
+def test_idle_timeout_closes_connection():
+    async def run():
+        fast = server(limits=Limits(idle_timeout=0.05))
+        busy, idle = connect(fast), connect(fast)
+        for _ in range(4):
+            await asyncio.sleep(0.02)
+            busy.data_received(request(1, read(3, 0, 1)))
+        return busy.transport.closed, idle.transport.closed, fast.stats["idle_closed"]
+
+    assert asyncio.run(run()) == (False, True, 1)
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from engine import HistoryRing, downsample_history
+from shared_state import EngineState
+
+
+def samples(timestamps, temperatures, running=None):
+    running = [False] * len(timestamps) if running is None else running
+    return np.array(timestamps, dtype=float), np.array(temperatures, dtype=float), np.array(running, dtype=bool)
+
+
+def test_all_samples_without_step():
+    result = downsample_history(*samples([1.0, 2.0], [30.0, 31.0], [False, True]))
+    assert result == {"samples": [
+        {"timestamp": 1.0, "temperature": 30.0, "status": "stopped"},
+        {"timestamp": 2.0, "temperature": 31.0, "status": "running"},
+    ]}
+
+
+def test_range_is_inclusive():
+    result = downsample_history(*samples([1.0, 2.0, 3.0, 4.0], [1.0, 2.0, 3.0, 4.0]), start=2.0, end=3.0)
+    assert [sample["timestamp"] for sample in result["samples"]] == [2.0, 3.0]
+
+
+def test_buckets():
+    history = samples([0.0, 0.5, 1.0, 3.2, 3.9], [10.0, 20.0, 30.0, 40.0, 60.0], [True, True, False, False, True])
+    result = downsample_history(*history, step=1.0)
+    assert result["step"] == 1.0
+    # Empty buckets (2-3 s) are left out
+    assert result["buckets"] == [
+        {"start": 0.0, "count": 2, "min": 10.0, "max": 20.0, "mean": 15.0, "running": 1.0},
+        {"start": 1.0, "count": 1, "min": 30.0, "max": 30.0, "mean": 30.0, "running": 0.0},
+        {"start": 3.0, "count": 2, "min": 40.0, "max": 60.0, "mean": 50.0, "running": 0.5},
+    ]
+
+
+def test_buckets_start_at_start():
+    history = samples([10.0, 10.4, 10.6], [1.0, 2.0, 3.0])
+    result = downsample_history(*history, start=9.5, step=1.0)
+    assert [(bucket["start"], bucket["count"]) for bucket in result["buckets"]] == [(9.5, 2), (10.5, 1)]
+
+
+def test_empty():
+    assert downsample_history(*samples([], [])) == {"samples": []}
+    assert downsample_history(*samples([], []), step=5.0) == {"step": 5.0, "buckets": []}
+    assert downsample_history(*samples([1.0], [1.0]), start=2.0, step=5.0) == {"step": 5.0, "buckets": []}
+
+
+def test_ring_keeps_the_newest_in_order():
+    state = EngineState.local(2, 4)
+    ring = HistoryRing(state)
+    for second in range(6):
+        ring.record(np.array([0]), float(second), np.array([second * 10.0]), np.array([second % 2 == 1]))
+    ring.record(np.array([1]), 100.0, np.array([1.0]), np.array([True]))
+    timestamps, temperatures, running = ring.snapshot(0)
+    assert timestamps.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert temperatures.tolist() == [20.0, 30.0, 40.0, 50.0]
+    assert running.tolist() == [False, True, False, True]
+    assert ring.snapshot(1)[0].tolist() == [100.0]
+
+
+def test_ring_records_many_engines_at_once():
+    state = EngineState.local(3, 8)
+    ring = HistoryRing(state)
+    ring.record(np.arange(3), 1.0, np.array([1.0, 2.0, 3.0]), np.array([True, False, True]))
+    ring.record(np.array([0, 2]), 2.0, np.array([4.0, 5.0]), np.array([False, False]))
+    assert [ring.snapshot(index)[1].tolist() for index in range(3)] == [[1.0, 4.0], [2.0], [3.0, 5.0]]
+
+
+@pytest.mark.parametrize("size", [1, 3])
+def test_small_rings(size):
+    state = EngineState.local(1, size)
+    ring = HistoryRing(state)
+    for second in range(5):
+        ring.record(np.array([0]), float(second), np.array([float(second)]), np.array([False]))
+    assert ring.snapshot(0)[0].tolist() == [float(second) for second in range(5 - size, 5)]
+
+
+def test_changes_within_the_interval_replace_the_newest_sample():
+    state = EngineState.local(2, 4)
+    state.history_interval[()] = 1.0
+    ring = HistoryRing(state)
+    # A fan cooling engine 0 every 0.1 s, engine 1 changing once a second
+    for tick in range(30):
+        now = tick * 0.1
+        ring.record(np.array([0]), now, np.array([100.0 - tick]), np.array([tick >= 25]))
+        if tick % 10 == 0:
+            ring.record(np.array([1]), now, np.array([float(tick)]), np.array([False]))
+    timestamps, temperatures, running = ring.snapshot(0)
+    # One sample per second holding the latest state of that second
+    assert timestamps.tolist() == pytest.approx([0.9, 1.9, 2.9])
+    assert temperatures.tolist() == [91.0, 81.0, 71.0]
+    assert running.tolist() == [False, False, True]
+    assert ring.snapshot(1)[1].tolist() == [0.0, 10.0, 20.0]
+
+
+def test_sampled_ring_covers_capacity_intervals():
+    state = EngineState.local(1, 8)
+    state.history_interval[()] = 1.0
+    ring = HistoryRing(state)
+    for tick in range(1000):
+        ring.record(0, tick * 0.1, float(tick), False)
+    timestamps = ring.snapshot(0)[0]
+    assert len(timestamps) == 8
+    assert timestamps[-1] - timestamps[0] == pytest.approx(7.0)
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_due(scheduler):
+    """
+    Runs the jobs due at the current time of the scheduler's clock.
+    """
+    while True:
+        with scheduler._cond:
+            job, deadline, now = scheduler._pop_due()
+        if job is None:
+            return deadline
+        scheduler._run(job, deadline, now)
+
+
+def test_first_run_after_delay_then_every_interval():
+    clock = FakeClock()
+    scheduler = Scheduler(clock)
+    runs = []
+    scheduler.every("job", 1.0, lambda: runs.append(clock.now), delay=0.5)
+    assert run_due(scheduler) == 0.5
+    for now in (0.5, 1.0, 1.5, 2.5):
+        clock.now = now
+        run_due(scheduler)
+    assert runs == [0.5, 1.5, 2.5]
+
+
+def test_lateness_is_recorded():
+    clock = FakeClock()
+    scheduler = Scheduler(clock)
+    job = scheduler.every("job", 1.0, lambda: None)
+    clock.now = 1.25
+    run_due(scheduler)
+    assert job.last_lateness == pytest.approx(0.25)
+    assert job.max_lateness == pytest.approx(0.25)
+    # Late runs keep the original phase
+    assert job.deadline == 2.0
+
+
+def test_overrun_skips_missed_deadlines_in_phase():
+    clock = FakeClock()
+    scheduler = Scheduler(clock)
+
+    def slow():
+        clock.now += 2.5
+
+    job = scheduler.every("job", 1.0, slow)
+    clock.now = 1.0
+    run_due(scheduler)
+    # Ran 1.0-3.5: the deadlines at 2.0 and 3.0 are skipped, not run back to back
+    assert job.runs == 1
+    assert job.overruns == 2
+    assert job.deadline == 4.0
+    assert scheduler.stats()["job"]["overruns"] == 2
+
+
+def test_on_run_gets_lateness_and_duration():
+    clock = FakeClock()
+    observed = []
+    scheduler = Scheduler(clock, on_run=lambda job, lateness, duration: observed.append((job.name, lateness, duration)))
+
+    def work():
+        clock.now += 0.25
+
+    scheduler.every("job", 1.0, work)
+    clock.now = 1.5
+    run_due(scheduler)
+    assert observed == [("job", 0.5, 0.25)]
+
+
+def test_failing_job_keeps_running():
+    clock = FakeClock()
+    scheduler = Scheduler(clock)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    job = scheduler.every("job", 1.0, fail)
+    for now in (1.0, 2.0):
+        clock.now = now
+        run_due(scheduler)
+    assert job.runs == 2
+
+
+def test_same_name_replaces_job_and_cancel_removes_it():
+    clock = FakeClock()
+    scheduler = Scheduler(clock)
+    runs = []
+    scheduler.every("job", 1.0, lambda: runs.append("old"))
+    scheduler.every("job", 1.0, lambda: runs.append("new"))
+    clock.now = 1.0
+    run_due(scheduler)
+    assert runs == ["new"]
+    scheduler.cancel("job")
+    clock.now = 2.0
+    assert run_due(scheduler) is None
+    assert runs == ["new"]
+    assert scheduler.stats() == {}
+
+
+def test_invalid_interval():
+    with pytest.raises(ValueError):
+        Scheduler().every("job", 0, lambda: None)
+
+
+def test_run_async():
+    scheduler = Scheduler()
+    runs = []
+    scheduler.every("job", 0.01, lambda: runs.append(1), delay=0)
+
+    async def run():
+        task = asyncio.ensure_future(scheduler.run_async())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+    assert len(runs) >= 3
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from shared_state import EngineState
+
+
+@pytest.fixture
+def name():
+    name = f"engine-test-{os.getpid()}"
+    yield name
+    if os.path.exists(f"/dev/shm/{name}"):
+        os.unlink(f"/dev/shm/{name}")
+
+
+def test_attach_sees_the_created_state(name):
+    state = EngineState.create(name, 3, 8)
+    state.temperature[1] = 42.0
+    attached = EngineState.attach(name)
+    assert (attached.count, attached.history_capacity) == (3, 8)
+    assert attached.temperature.tolist() == [0.0, 42.0, 0.0]
+
+
+def test_existing_segment_is_refused_or_replaced(name):
+    stale = EngineState.create(name, 1, 4)
+    stale.temperature[0] = 99.0
+    with pytest.raises(FileExistsError):
+        EngineState.create(name, 2, 4)
+    state = EngineState.create(name, 2, 4, replace=True)
+    assert state.temperature.tolist() == [0.0, 0.0]
+    assert EngineState.attach(name).count == 2
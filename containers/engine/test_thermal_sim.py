@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from thermal_sim import parameter_grid, simulate
+
+
+def grid(**values):
+    return parameter_grid({"temp_step": [1.0], "capacity": [2.0], "interval": [1.0], "high": [90.0], "low": [50.0], **values})
+
+
+def test_settled_fan_ticks_at_the_idle_period():
+    # The threshold is never reached, so the fan stays settled at 0 RPM
+    metrics = simulate(grid(high=[1000.0]), 60.0, 0.02, fan_period=0.1, idle_period=1.0)
+    assert metrics["fan_ticks"].tolist() == [61]
+    assert np.isnan(metrics["time_to_threshold"][0])
+
+
+def test_idle_ticks_cool_like_fixed_ticks():
+    params = grid(capacity=[1.0, 2.0, 4.0])
+    fixed = simulate(params, 900.0, 0.02, fan_period=0.1)
+    idle = simulate(params, 900.0, 0.02, fan_period=0.1, idle_period=1.0)
+    assert (idle["fan_ticks"] < fixed["fan_ticks"] / 2).all()
+    assert idle["time_to_threshold"].tolist() == fixed["time_to_threshold"].tolist()
+    assert idle["peak_temperature"] == pytest.approx(fixed["peak_temperature"], abs=0.5)
+    assert idle["cycles"].tolist() == fixed["cycles"].tolist()
+
+
+def test_new_target_wakes_an_idle_fan():
+    # Idle at 0 RPM until the PLC switches the fan on at 90 degrees after 60 s
+    metrics = simulate(grid(), 61.0, 0.02, fan_period=0.1, idle_period=5.0)
+    # 13 idle ticks up to 60 s, the woken tick on the next step, then 60.1-61.0 s every 0.1 s
+    assert metrics["fan_ticks"][0] == 13 + 1 + 10
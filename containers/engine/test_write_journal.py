@@ -0,0 +1,153 @@
+import asyncio
+import json
+import urllib.request
+
+from pymodbus.datastore import ModbusDeviceContext, ModbusSequentialDataBlock
+
+from write_journal import RECORD, WriteJournal, address_to_int
+
+
+def device():
+    return ModbusDeviceContext(hr=ModbusSequentialDataBlock(0, [0] * 32), co=ModbusSequentialDataBlock(0, [0] * 32))
+
+
+def records(journal, since=0):
+    return [(record["seq"], record["address"], record["old"], record["new"]) for record in journal.query(since)["records"]]
+
+
+def test_client_writes_are_recorded_with_old_and_new_values():
+    journal = WriteJournal(16, source=lambda: "10.1.2.3")
+    store = journal.watch(device(), "fan")
+    store.setValues(6, 3, [7])
+    store.setValues(16, 3, [8, 9])
+    # Device updates are not journaled
+    store.setValues(3, 0, [1])
+    result = journal.query()
+    assert [(r["function_code"], r["address"], r["old"], r["new"]) for r in result["records"]] == [(6, 3, 0, 7), (16, 3, 7, 8), (16, 4, 0, 9)]
+    assert {r["source"] for r in result["records"]} == {"10.1.2.3"}
+    assert {r["device"] for r in result["records"]} == {"fan"}
+
+
+def test_unknown_source_is_zero():
+    journal = WriteJournal(4)
+    journal.watch(device()).setValues(5, 0, [True])
+    assert journal.query()["records"][0]["source"] == "0.0.0.0"
+    assert address_to_int("::1") == 0
+
+
+def test_ring_wraps_and_keeps_the_newest():
+    journal = WriteJournal(4)
+    store = journal.watch(device())
+    for value in range(1, 7):
+        store.setValues(6, 0, [value])
+    assert journal.written == 6
+    assert records(journal) == [(2, 0, 2, 3), (3, 0, 3, 4), (4, 0, 4, 5), (5, 0, 5, 6)]
+    assert records(journal, since=4) == [(4, 0, 4, 5), (5, 0, 5, 6)]
+    assert records(journal, since=6) == []
+
+
+def test_raw_export_across_the_wrap():
+    journal = WriteJournal(4)
+    store = journal.watch(device())
+    for value in range(1, 7):
+        store.setValues(6, 0, [value])
+    first, data = journal.raw(1)
+    assert first == 2
+    assert len(data) == 4 * RECORD.size
+    assert [values[-1] for values in RECORD.iter_unpack(data)] == [3, 4, 5, 6]
+
+
+def test_flush_appends_and_counts_overwritten_records(tmp_path):
+    path = str(tmp_path / "journal")
+    journal = WriteJournal(4, path)
+    store = journal.watch(device(), "engine0")
+    store.setValues(6, 0, [1])
+    journal.flush()
+    for value in range(2, 8):
+        store.setValues(6, 0, [value])
+    journal.flush()
+    with open(path, "rb") as f:
+        flushed = [values[-1] for values in RECORD.iter_unpack(f.read())]
+    assert flushed == [1, 4, 5, 6, 7]
+    assert journal.dropped == 2
+    with open(path + ".json") as f:
+        assert json.load(f)["devices"] == ["engine0"]
+
+
+def test_serve_json_and_raw():
+    journal = WriteJournal(8)
+    journal.watch(device()).setValues(6, 1, [5])
+    server = journal.serve("127.0.0.1", 0)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(base + "/journal?since=0") as response:
+            assert json.load(response)["records"][0]["new"] == 5
+        with urllib.request.urlopen(base + "/journal.bin") as response:
+            assert response.headers["X-Journal-First"] == "0"
+            assert len(response.read()) == RECORD.size
+    finally:
+        server.shutdown()
+
+
+class FakeTransport:
+    def get_extra_info(self, name):
+        return ("10.9.8.7", 5020) if name == "peername" else None
+
+
+def test_trace_knows_the_client_of_pymodbus_handlers():
+    journal = WriteJournal(8)
+    store = journal.watch(device())
+
+    class Handler:
+        transport = FakeTransport()
+
+        async def handle_request(self):
+            store.setValues(6, 0, [1])
+
+    class OldHandler:
+        transport = FakeTransport()
+
+        async def _async_execute(self, request, *addr):
+            store.setValues(6, 1, [request])
+
+    for handler in (Handler, OldHandler):
+        server = type("Server", (), {"callback_new_connection": lambda self, handler=handler: handler()})()
+        journal.trace(server)
+        connection = server.callback_new_connection()
+        if handler is Handler:
+            asyncio.run(connection.handle_request())
+        else:
+            asyncio.run(connection._async_execute(2, None))
+    # Writes outside a request have no client
+    store.setValues(6, 2, [3])
+    assert [record["source"] for record in journal.query()["records"]] == ["10.9.8.7", "10.9.8.7", "0.0.0.0"]
+
+
+def test_trace_keeps_the_client_of_interleaved_requests():
+    journal = WriteJournal(8)
+    store = journal.watch(device())
+
+    class Handler:
+        def __init__(self, peer, release):
+            self.transport = type("Transport", (), {"get_extra_info": lambda self, name: peer})()
+            self.release = release
+
+        async def handle_request(self):
+            await self.release.wait()
+            store.setValues(6, 0, [1])
+
+    async def run():
+        first, second = asyncio.Event(), asyncio.Event()
+        peers = iter([(("10.0.0.1", 1), first), (("10.0.0.2", 2), second)])
+        server = type("Server", (), {"callback_new_connection": lambda self: Handler(*next(peers))})()
+        journal.trace(server)
+        slow, fast = server.callback_new_connection(), server.callback_new_connection()
+        waiting = asyncio.ensure_future(slow.handle_request())
+        await asyncio.sleep(0)
+        second.set()
+        await fast.handle_request()
+        first.set()
+        await waiting
+
+    asyncio.run(run())
+    assert [record["source"] for record in journal.query()["records"]] == ["10.0.0.2", "10.0.0.1"]
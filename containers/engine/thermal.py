@@ -0,0 +1,59 @@
+"""
+Update rules of the engine/fan/PLC thermal loop, shared by the device
+simulators and the batch simulation. Every function works elementwise on
+plain floats as well as NumPy arrays.
+"""
+import numpy as np
+
+# Fan speed at which a fan delivers its full cooling capacity
+FULL_COOLING_RPM = 1000.0
+
+# Time constant (s) of the fan's first-order RPM lag. Matches the former model,
+# which closed 2.5% of the gap to the target on every 0.1 s fan tick
+FAN_TIME_CONSTANT = 3.95
+
+# RPM closer than this to the target counts as settled, and the fan ticks at its idle period
+SETTLED_RPM = 0.5
+
+# Fan tick period that cooling capacities are expressed for (fan.py's default --fetch-time)
+COOLING_PERIOD = 0.1
+
+
+def engine_step(temperature, running, temp_step):
+    """
+    One engine tick: heat while running, cool down towards 0 while stopped.
+    """
+    cooled = np.where(temperature > 0, np.maximum(0.0, temperature - temp_step), temperature)
+    return np.where(running, temperature + temp_step, cooled)
+
+
+def cooling_delta(power, rpm, capacity, dt=COOLING_PERIOD):
+    """
+    Temperature change caused by a fan spinning at the given RPM for dt
+    seconds. capacity is the cooling at full speed per COOLING_PERIOD.
+    """
+    return -(power * (rpm / FULL_COOLING_RPM) * capacity * (dt / COOLING_PERIOD))
+
+
+def fan_rpm_step(current_rpm, target_rpm, dt, acceleration=None, time_constant=FAN_TIME_CONSTANT):
+    """
+    Advances the fan RPM by dt seconds towards target_rpm: a first-order lag
+    whose rate of change is capped at acceleration RPM/s, if given. The
+    solution is exact, so the result does not depend on how dt is split.
+    """
+    gap = target_rpm - current_rpm
+    if acceleration is None:
+        return target_rpm - gap * np.exp(-dt / time_constant)
+    # The lag asks for more than the acceleration limit while the gap is wider
+    # than acceleration * time_constant: close it linearly until then
+    limited = np.clip((np.abs(gap) - acceleration * time_constant) / acceleration, 0.0, dt)
+    gap = gap - np.sign(gap) * acceleration * limited
+    return target_rpm - gap * np.exp(-(dt - limited) / time_constant)
+
+
+def hysteresis_target(temperature, target, high=90, low=50, on_rpm=1000):
+    """
+    FanControl (rpmfan_control.st) scan: full speed at or above high, off
+    below low, unchanged in between.
+    """
+    return np.where(temperature >= high, on_rpm, np.where(temperature < low, 0, target))
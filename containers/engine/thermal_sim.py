@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Faster-than-real-time simulation of the engine/fan/PLC thermal loop.
+
+Steps the same update rules as engine.py, fan.py and rpmfan_control.st on a
+virtual clock, vectorized across every combination of the swept parameters,
+and writes one CSV row of summary metrics per combination.
+"""
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+from thermal import engine_step, cooling_delta, fan_rpm_step, hysteresis_target, SETTLED_RPM
+
+PARAMETERS = ("temp_step", "capacity", "interval", "high", "low")
+
+METRICS = ("time_to_threshold", "peak_temperature", "oscillation_period", "cycles", "final_temperature", "fan_ticks")
+
+# Tolerance when comparing virtual time against component deadlines
+EPSILON = 1e-9
+
+
+def simulate(params, duration, dt, start_temp=30.0, fan_period=0.1, plc_period=0.02, acceleration=None, idle_period=None):
+    """
+    Simulates len(params["temp_step"]) independent loops for duration virtual
+    seconds in steps of dt. Components fire on the first step at or after
+    their deadline, so periods that are not multiples of dt are rounded up.
+
+    The engine runs from t=0 and ticks every interval and the PLC scans every
+    plc_period, reading the temperature as the integer published in the input
+    register. The fan ticks like fan.py: every fan_period (first tick at t=0),
+    integrating its RPM over the elapsed time towards the target it read on
+    the previous tick, capped at acceleration RPM/s if given. Once the RPM is
+    within SETTLED_RPM of the target it ticks every idle_period (fan_period
+    if None) until the PLC writes a new target, which wakes it at once.
+    """
+    temp_step = params["temp_step"]
+    capacity = params["capacity"]
+    interval = params["interval"]
+    high = params["high"]
+    low = params["low"]
+    count = len(temp_step)
+    if idle_period is None:
+        idle_period = fan_period
+
+    temperature = np.full(count, start_temp, dtype=np.float64)
+    running = np.ones(count, dtype=bool)
+    rpm = np.zeros(count, dtype=np.float64)
+    target = np.zeros(count, dtype=np.float64)
+    # fan.py's target_rpm, HR0 as of the fan's last tick
+    fan_target = np.zeros(count, dtype=np.float64)
+    engine_next = interval.astype(np.float64).copy()
+    fan_next = np.zeros(count, dtype=np.float64)
+    fan_tick = np.full(count, fan_period, dtype=np.float64)
+    # The first fan tick integrates one fan_period, like fan.py's
+    fan_last = np.full(count, -fan_period, dtype=np.float64)
+    fan_ticks = np.zeros(count, dtype=np.int64)
+    plc_next = 0.0
+
+    peak = temperature.copy()
+    time_to_threshold = np.full(count, np.nan)
+    first_on = np.full(count, np.nan)
+    last_on = np.full(count, np.nan)
+    cycles = np.zeros(count, dtype=np.int64)
+
+    for step in range(int(round(duration / dt)) + 1):
+        now = step * dt
+
+        due = engine_next <= now + EPSILON
+        if due.any():
+            temperature[due] = engine_step(temperature[due], running[due], temp_step[due])
+            engine_next[due] += interval[due]
+
+        ticking = fan_next <= now + EPSILON
+        if ticking.any():
+            elapsed = now - fan_last[ticking]
+            fan_last[ticking] = now
+            spun = fan_rpm_step(rpm[ticking], fan_target[ticking], elapsed, acceleration)
+            seen = target[ticking]
+            settled = np.abs(seen - spun) < SETTLED_RPM
+            spun = np.where(settled, seen, spun)
+            rpm[ticking] = spun
+            fan_target[ticking] = seen
+            # fan.py only asks the engine to cool once its integer RPM is above zero
+            cooling = np.trunc(spun) > 0
+            temperature[ticking] += np.where(cooling, cooling_delta(1.0, spun, capacity[ticking], elapsed), 0.0)
+            # The scheduler keeps the phase of an unchanged period, a new one starts now
+            period = np.where(settled, idle_period, fan_period)
+            fan_next[ticking] = np.where(period == fan_tick[ticking], fan_next[ticking] + period, now + period)
+            fan_tick[ticking] = period
+            fan_ticks += ticking
+
+        if plc_next <= now + EPSILON:
+            new_target = hysteresis_target(np.trunc(temperature), target, high, low)
+            # A changed HR0 wakes the fan for a tick at the next step
+            woken = new_target != target
+            fan_next = np.where(woken, now, fan_next)
+            fan_tick = np.where(woken, fan_period, fan_tick)
+            switched_on = (new_target > 0) & (target == 0)
+            first_on = np.where(switched_on & np.isnan(first_on), now, first_on)
+            last_on = np.where(switched_on, now, last_on)
+            cycles += switched_on
+            target = new_target
+            plc_next += plc_period
+
+        np.maximum(peak, temperature, out=peak)
+        crossed = np.isnan(time_to_threshold) & (temperature >= high)
+        time_to_threshold[crossed] = now
+
+    # Mean time between fan switch-ons, defined once the loop has oscillated at least once
+    with np.errstate(invalid="ignore", divide="ignore"):
+        period = np.where(cycles > 1, (last_on - first_on) / (cycles - 1), np.nan)
+
+    return {
+        "time_to_threshold": time_to_threshold,
+        "peak_temperature": peak,
+        "oscillation_period": period,
+        "cycles": cycles,
+        "final_temperature": temperature,
+        "fan_ticks": fan_ticks,
+    }
+
+
+def parameter_grid(values):
+    """
+    Returns the cartesian product of the swept values as flat arrays.
+    """
+    grid = np.meshgrid(*[np.asarray(values[name], dtype=np.float64) for name in PARAMETERS], indexing="ij")
+    return {name: axis.ravel() for name, axis in zip(PARAMETERS, grid)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine/fan/PLC thermal loop parameter sweep")
+    parser.add_argument("-t", "--temp-step", type=float, nargs="+", default=[1.0], help="Engine temperature steps to sweep")
+    parser.add_argument("-c", "--capacity", type=float, nargs="+", default=[2.0], help="Fan capacities to sweep")
+    parser.add_argument("-s", "--interval", type=float, nargs="+", default=[1.0], help="Engine tick intervals (s) to sweep")
+    parser.add_argument("--high", type=float, nargs="+", default=[90.0], help="PLC fan-on thresholds to sweep")
+    parser.add_argument("--low", type=float, nargs="+", default=[50.0], help="PLC fan-off thresholds to sweep")
+    parser.add_argument("-ts", "--temperature-start", type=float, default=30.0, help="Engine start temperature")
+    parser.add_argument("-d", "--duration", type=float, default=3600.0, help="Virtual seconds to simulate")
+    parser.add_argument("--dt", type=float, default=0.02, help="Virtual clock step in seconds")
+    parser.add_argument("--fan-period", type=float, default=0.1, help="Fan tick period (fan.py --fetch-time)")
+    parser.add_argument("--idle-period", type=float, default=1.0, help="Fan tick period once its RPM has settled (fan.py --idle-time)")
+    parser.add_argument("--plc-period", type=float, default=0.02, help="PLC scan period (task0 INTERVAL)")
+    parser.add_argument("-acc", "--acceleration", type=float, default=100.0, help="Fan RPM acceleration limit in RPM/s (fan.py --acceleration), 0 for none")
+    parser.add_argument("-o", "--output", help="CSV output file (default stdout)")
+    args = parser.parse_args()
+
+    params = parameter_grid({
+        "temp_step": args.temp_step,
+        "capacity": args.capacity,
+        "interval": args.interval,
+        "high": args.high,
+        "low": args.low,
+    })
+    started = time.perf_counter()
+    metrics = simulate(params, args.duration, args.dt, args.temperature_start, args.fan_period, args.plc_period, args.acceleration or None, args.idle_period)
+    elapsed = time.perf_counter() - started
+    print(f"Simulated {len(params['temp_step'])} combinations x {args.duration}s in {elapsed:.2f}s", file=sys.stderr)
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(PARAMETERS + METRICS)
+        columns = [params[name].tolist() for name in PARAMETERS] + [metrics[name].tolist() for name in METRICS]
+        writer.writerows(zip(*columns))
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 
-import time
 import requests
 from pymodbus.client import ModbusTcpClient
 
@@ -26,14 +25,13 @@ def test():
         return
 
     print("\n--- Test 2: Start Engine (Write 1 to Register 0) ---")
+    # The write callback starts the engine before the Modbus response is sent
     client.write_register(0, 1)
-    time.sleep(2) # Give some time for the monitor loop
     if not check_status("running"):
         return
 
     print("\n--- Test 3: Stop Engine (Write 0 to Register 0) ---")
     client.write_register(0, 0)
-    time.sleep(2)
     if not check_status("stopped"):
         return
     
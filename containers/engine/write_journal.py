@@ -0,0 +1,308 @@
+"""
+Journal of the Modbus writes a simulated device receives.
+
+Every register or coil changed by a client write (FC5, 6, 15, 16, 22, 23)
+is recorded with its timestamp, the client's address, the function code,
+the address and the old and new values. Records go into a preallocated
+ring buffer with a precompiled struct, so the journal never grows; the
+oldest records are overwritten once it is full. watch() reads the old and
+new values back through the device, so a journaled write costs about 8 us
+more than a plain one for a single register, half of it in those reads,
+plus about 0.7 us per further register (pymodbus 3.11, sequential block).
+
+The client's address comes from fast_modbus or, for servers started with
+serve_modbus() or passed to trace(), from pymodbus' connection handler.
+
+A background thread appends new records to a file in batches. The file
+is the raw records back to back (RECORD, little-endian), next to a
+<path>.json describing the fields and the watched devices. serve()
+answers GET /journal?since=<seq>&limit=<n> with JSON and GET /journal.bin
+with the raw records (the sequence number of the first in the
+X-Journal-First header), for devices without a REST API.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from pymodbus.server import ModbusTcpServer
+
+log = logging.getLogger("write_journal")
+
+# time, source IPv4 address, device, function code, address, old value, new value
+RECORD = struct.Struct("<dIHBHHH")
+FIELDS = ("time", "source", "device", "function_code", "address", "old", "new")
+
+# Function codes clients use to change registers and coils; devices update their own with others
+WRITE_FUNCTION_CODES = (5, 6, 15, 16, 22, 23)
+
+# Per-request coroutine of the connection handlers of pymodbus >= 3.7 and of older versions
+REQUEST_HANDLERS = ("handle_request", "_async_execute")
+
+# Client address of the request a traced pymodbus server is handling. A
+# context variable, so each request task sees its own while others interleave
+_request_source = contextvars.ContextVar("journal_request_source", default=None)
+
+
+def add_journal_arguments(parser):
+    """
+    Adds the journal options to parser, with defaults from the JOURNAL_*
+    environment variables.
+    """
+    env = os.environ.get
+    group = parser.add_argument_group("Modbus write journal")
+    group.add_argument("--journal-size", type=int, default=int(env("JOURNAL_SIZE", 65536)), help="Register writes kept in memory, 0 to disable the journal")
+    group.add_argument("--journal", default=env("JOURNAL_PATH"), help="File the journal is appended to")
+    group.add_argument("--journal-flush", type=float, default=float(env("JOURNAL_FLUSH", 5.0)), help="Seconds between journal file writes")
+    group.add_argument("--journal-port", type=int, default=int(env("JOURNAL_PORT", 0)), help="Serve the journal over HTTP on this port, 0 to disable")
+    return group
+
+
+def address_to_int(address):
+    try:
+        return int.from_bytes(socket.inet_aton(address), "big")
+    except (OSError, TypeError):
+        # Unknown or not IPv4
+        return 0
+
+
+class WriteJournal:
+    def __init__(self, capacity=65536, path=None, flush_interval=5.0, source=None):
+        """
+        source() returns the address of the client whose request is being
+        handled, or None when it is unknown.
+        """
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.source = source
+        self.devices = []
+        # Records ever written and ever flushed; a record's sequence number is its position in that count
+        self.written = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.pid = os.getpid()
+        self._addresses = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_args(cls, args, source=None):
+        if args.journal_size <= 0:
+            return None
+        return cls(args.journal_size, args.journal, args.journal_flush, source)
+
+    def watch(self, device, name="device"):
+        """
+        Journals the client writes of a pymodbus device context by wrapping
+        its setValues. Returns the device.
+        """
+        index = len(self.devices)
+        self.devices.append(name)
+        get_values = device.getValues
+        set_values = device.setValues
+
+        def journaled(function_code, address, values):
+            if function_code not in WRITE_FUNCTION_CODES:
+                return set_values(function_code, address, values)
+            if isinstance(values, (bytes, bytearray, memoryview)):
+                count = len(values) // 2
+            else:
+                count = len(values) if isinstance(values, list) else 1
+            old = get_values(function_code, address, count)
+            result = set_values(function_code, address, values)
+            if not result and isinstance(old, list):
+                new = get_values(function_code, address, count)
+                if isinstance(new, list):
+                    self.record(index, function_code, address, old, new)
+            return result
+
+        device.setValues = journaled
+        return device
+
+    def trace(self, server):
+        """
+        Makes the client address of the requests a pymodbus server handles
+        known to the journal, for writes that do not go through fast_modbus.
+        Returns the server.
+        """
+        new_connection = server.callback_new_connection
+
+        def traced_connection():
+            handler = new_connection()
+            for name in REQUEST_HANDLERS:
+                handle = getattr(handler, name, None)
+                if handle:
+                    setattr(handler, name, partial(_handle_traced, handler, handle))
+                    break
+            return handler
+
+        server.callback_new_connection = traced_connection
+        return server
+
+    def record(self, device, function_code, address, old, new):
+        now = time.time()
+        source = self._source()
+        pack_into = RECORD.pack_into
+        buffer = self.buffer
+        capacity = self.capacity
+        count = min(len(old), len(new))
+        with self._lock:
+            written = self.written
+            for offset in range(count):
+                pack_into(
+                    buffer, (written + offset) % capacity * RECORD.size,
+                    now, source, device, function_code, (address + offset) & 0xFFFF, old[offset] & 0xFFFF, new[offset] & 0xFFFF
+                )
+            self.written = written + count
+
+    def _source(self):
+        address = self.source() if self.source else None
+        if address is None:
+            address = _request_source.get()
+        if address is None:
+            return 0
+        value = self._addresses.get(address)
+        if value is None:
+            value = self._addresses[address] = address_to_int(address)
+        return value
+
+    def raw(self, since=0):
+        """
+        Returns (first sequence number, raw records from it to the newest),
+        starting at since or at the oldest record still in the ring.
+        """
+        with self._lock:
+            first = max(since, self.written - self.capacity, 0)
+            start = (first % self.capacity) * RECORD.size
+            end = (self.written % self.capacity) * RECORD.size
+            if first >= self.written:
+                return first, b""
+            if start < end:
+                return first, bytes(self.buffer[start:end])
+            # The range wraps around the end of the ring
+            return first, bytes(self.buffer[start:]) + bytes(self.buffer[:end])
+
+    def query(self, since=0, limit=1000):
+        first, data = self.raw(since)
+        records = []
+        for index, values in enumerate(RECORD.iter_unpack(data[:limit * RECORD.size])):
+            record = dict(zip(FIELDS, values))
+            record["seq"] = first + index
+            record["source"] = socket.inet_ntoa(record["source"].to_bytes(4, "big"))
+            record["device"] = self.devices[record["device"]] if record["device"] < len(self.devices) else record["device"]
+            records.append(record)
+        return {"written": self.written, "dropped": self.dropped, "records": records}
+
+    def flush(self):
+        if not self.path:
+            return
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        first, data = self.raw(self.flushed)
+        if first > self.flushed:
+            # Overwritten before they could be flushed
+            self.dropped += first - self.flushed
+            log.warning(f"Journal overwrote {first - self.flushed} record(s) before they were flushed")
+        if not os.path.exists(self.path + ".json"):
+            with open(self.path + ".json", "w") as f:
+                json.dump({"record": RECORD.format, "fields": FIELDS, "devices": self.devices}, f)
+        if data:
+            with open(self.path, "ab") as f:
+                f.write(data)
+        self.flushed = first + len(data) // RECORD.size
+
+    def start(self):
+        """
+        Starts the background flushes, if the journal has a file.
+        """
+        if self.path:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                log.error(f"Journal flush to {self.path} failed: {e}")
+
+    def serve(self, address, port):
+        """
+        Serves the journal over HTTP from a background thread.
+        """
+        journal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                headers = {}
+                params = parse_qs(url.query)
+                try:
+                    since = int(params.get("since", ["0"])[0])
+                    limit = int(params.get("limit", ["1000"])[0])
+                except ValueError:
+                    self.send_error(400, "since and limit must be integers")
+                    return
+                if url.path == "/journal":
+                    body = json.dumps(journal.query(since, limit), separators=(",", ":")).encode()
+                    content_type = "application/json"
+                elif url.path == "/journal.bin":
+                    first, body = journal.raw(since)
+                    content_type = "application/octet-stream"
+                    headers["X-Journal-First"] = str(first)
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log.info(f"Journal served on http://{address}:{port}/journal")
+        return server
+
+
+async def _handle_traced(handler, handle, *args):
+    peer = handler.transport.get_extra_info("peername") if handler.transport else None
+    token = _request_source.set(peer[0] if peer else None)
+    try:
+        await handle(*args)
+    finally:
+        _request_source.reset(token)
+
+
+async def serve_modbus(context, address, journal=None, **kwargs):
+    """
+    Serves context with pymodbus until cancelled, like its StartAsyncTcpServer,
+    with the server traced by journal if given.
+    """
+    server = ModbusTcpServer(context, address=address, **kwargs)
+    if journal:
+        journal.trace(server)
+    await server.serve_forever()
@@ -0,0 +1,56 @@
+import logging
+import time
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+
+log = logging.getLogger("computed_datablock")
+
+# pymodbus' device context shifts protocol addresses by one before they reach the data block
+BLOCK_ADDRESS_OFFSET = 1
+
+
+class ComputedDataBlock(ModbusSequentialDataBlock):
+    """
+    Sequential data block whose registers can be bound to functions of time.
+    A bound function runs when a client reads its registers, so nothing is
+    computed while nobody polls and readers always get a fresh value. With
+    a ttl, the value is cached and reused for ttl seconds.
+
+    Unbound registers behave like a plain ModbusSequentialDataBlock.
+    """
+
+    def __init__(self, address, values, clock=time.monotonic):
+        super().__init__(address, values)
+        self.clock = clock
+        # Block address -> [func, count, ttl, expires]
+        self.sources = {}
+
+    def bind(self, address, func, count=1, ttl=0.0):
+        """
+        Computes the count registers starting at protocol address with
+        func(now), which returns a value or a list of count values.
+        """
+        self.sources[address + BLOCK_ADDRESS_OFFSET] = [func, count, ttl, float("-inf")]
+
+    def getValues(self, address, count=1):
+        now = self.clock()
+        for start, source in self.sources.items():
+            func, width, ttl, expires = source
+            if start < address + count and address < start + width and now >= expires:
+                self._refresh(start, source, now)
+        return super().getValues(address, count)
+
+    def _refresh(self, start, source, now):
+        func, width, ttl, _ = source
+        try:
+            value = func(now)
+        except Exception as e:
+            # Serve the previous value rather than failing the whole read
+            log.error(f"Computing register {start - BLOCK_ADDRESS_OFFSET} failed: {e}")
+            return
+        values = value if isinstance(value, list) else [value]
+        if len(values) != width:
+            log.error(f"Register {start - BLOCK_ADDRESS_OFFSET} computed {len(values)} values, expected {width}")
+            return
+        super().setValues(start, values)
+        source[3] = now + ttl
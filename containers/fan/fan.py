@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
-import requests
 import pymodbus
 import argparse
-from pymodbus.server import StartTcpServer
+import asyncio
 from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
 from pymodbus.pdu.device import ModbusDeviceIdentification
 import logging
@@ -12,6 +11,15 @@ import threading
 import math
 
 import os
+from scheduler import Scheduler
+from engine_stream import EngineStream
+from engine_modbus import EngineModbus
+from engine_client import EngineClient
+from thermal import fan_rpm_step, SETTLED_RPM
+from computed_datablock import ComputedDataBlock
+import fast_modbus
+import write_journal
+import anomaly_detector
 
 # Argument parsing
 parser = argparse.ArgumentParser(description="modbusTCP")
@@ -20,8 +28,19 @@ parser.add_argument("-p", "--port", required=False, default=502, type=int, help=
 parser.add_argument("-c", "--capacity", required=False, default=float(os.environ.get("CAPACITY", 2.0)), type=float, help="Fan capacity")
 parser.add_argument("-e", "--endpoint", required=False, default=os.environ.get("ENDPOINT", "http://localhost:8000/"), help="Endpoint API REST")
 parser.add_argument("-ft", "--fetch-time", required=False, default=0.1, type=float, help="Fetch time in seconds")
+parser.add_argument("-it", "--idle-time", required=False, default=float(os.environ.get("IDLE_TIME", 1.0)), type=float, help="Fetch time in seconds once the RPM has settled on its target")
 parser.add_argument("-acc", "--acceleration", required=False, default=float(os.environ.get("ACCELERATION", 100.0)), type=float, help="RPM acceleration (RPM/s)")
+parser.add_argument("-to", "--timeout", required=False, default=1.0, type=float, help="Longest wait for an engine answer in seconds, also bounded by the tick period")
+parser.add_argument("--stream", action="store_true", default=os.environ.get("STREAM", "false") == "true", help="Follow the engine event stream instead of polling it")
+parser.add_argument("-em", "--engine-modbus", required=False, default=os.environ.get("ENGINE_MODBUS"), help="Poll the engine temperature from its Modbus server (host[:port]) instead of the REST API")
+parser.add_argument("--fast-modbus", action="store_true", default=os.environ.get("FAST_MODBUS", "false") == "true", help="Serve reads and writes with the lightweight fast_modbus server, other requests still go to pymodbus")
+fast_modbus.add_limit_arguments(parser)
+write_journal.add_journal_arguments(parser)
+anomaly_detector.add_anomaly_arguments(parser)
+parser.add_argument("-eu", "--engine-unit", required=False, default=int(os.environ.get("ENGINE_UNIT", 1)), type=int, help="Modbus unit ID of the engine")
 args = parser.parse_args()
+if args.acceleration <= 0:
+    parser.error("--acceleration must be positive")
 
 # Enable logging
 logging.basicConfig()
@@ -33,74 +52,159 @@ COILS=16
 HOLDING_REGS=16
 INPUT_REGS=16
 
+class TargetDataBlock(ModbusSequentialDataBlock):
+    """
+    Holding registers that call on_change() when a write changes a value,
+    so a new target RPM is picked up without waiting for an idle tick.
+    """
+
+    def __init__(self, address, values, on_change):
+        super().__init__(address, values)
+        self.on_change = on_change
+
+    def setValues(self, address, values):
+        before = list(self.values)
+        result = super().setValues(address, values)
+        if result is None and self.values != before:
+            self.on_change()
+        return result
+
+def wake():
+    schedule(args.fetch_time, delay=0)
+
+input_registers = ComputedDataBlock(0, [0]*INPUT_REGS)
 store = ModbusDeviceContext(
 	di=ModbusSequentialDataBlock(0, [0]*DISCRETE_INPUTS),  # Discrete Inputs
 	co=ModbusSequentialDataBlock(0, [0]*COILS),  # Coils
-	hr=ModbusSequentialDataBlock(0, [0]*HOLDING_REGS),  # Holding Registers
-	ir=ModbusSequentialDataBlock(0, [0]*INPUT_REGS)   # Input Registers
+	hr=TargetDataBlock(0, [0]*HOLDING_REGS, wake),  # Holding Registers
+	ir=input_registers   # Input Registers
 )
 context = ModbusServerContext(devices=store, single=True)
 
+# Client writes are journaled with the address of the client that sent them
+journal = write_journal.WriteJournal.from_args(args, fast_modbus.current_source)
+if journal:
+	journal.watch(store, "fan")
+	journal.start()
+	if args.journal_port:
+		journal.serve(args.address, args.journal_port)
+
+# Register activity is checked for anomalies off the request path
+detector = anomaly_detector.AnomalyDetector.from_args(args)
+if detector:
+	detector.watch(store, "fan")
+	detector.start()
+
+current_rpm = 0.0
+target_rpm = 0.0
+last_tick = None
+# (time, rpm, target) of the last tick, replaced as a whole so readers see a consistent triple
+rpm_anchor = (time.monotonic(), 0.0, 0.0)
+
+def rpm_at(now):
+    # The RPM keeps moving towards the target between ticks
+    anchor, rpm, target = rpm_anchor
+    return int(fan_rpm_step(rpm, target, max(0.0, now - anchor), args.acceleration))
+
 def update_values(context):
-    current_rpm = 0.0
-    while True:
-        # Read Target RPM (HR 0)
-        hr0 = context[0].getValues(3, 0, count=1)
-        if isinstance(hr0, list):
-            target_rpm = hr0[0]
+    global current_rpm, target_rpm, last_tick, rpm_anchor
+    now = time.monotonic()
+    dt = args.fetch_time if last_tick is None else now - last_tick
+    last_tick = now
+
+    # Spin towards the target that was in force since the previous tick
+    current_rpm = fan_rpm_step(current_rpm, target_rpm, dt, args.acceleration)
+
+    # Read Target RPM (HR 0)
+    hr0 = context[0].getValues(3, 0, count=1)
+    if isinstance(hr0, list):
+        if hr0[0] != target_rpm:
+            log.info(f"Target RPM (HR 0): {hr0[0]}")
+        target_rpm = hr0[0]
+    else:
+        log.error(f"Error reading Target RPM from HR 0: {hr0}")
+        target_rpm = 0.0 # Default if error
+
+    # Tick slowly once the fan has settled on its target, a new target wakes it up
+    settled = abs(target_rpm - current_rpm) < SETTLED_RPM
+    if settled:
+        current_rpm = float(target_rpm)
+    rpm_anchor = (now, current_rpm, target_rpm)
+    with tick_lock:
+        # HR0 is changed before wake() takes the lock: a target written since
+        # the read above must not be left waiting for an idle tick
+        if settled and context[0].getValues(3, 0, count=1) != hr0:
+            settled = False
+        period = args.idle_time if settled else args.fetch_time
+        schedule(period)
+
+    # Power is no longer read from registers, defaulting to 1 for cooling calculation
+    power = 1.0
+
+    log.debug(f"Current RPM: {int(current_rpm)}")
+
+    # Engine answers arriving after the next tick is due are useless
+    deadline = now + period
+    try:
+        stale = False
+        if int(current_rpm) > 0:
+            # The engine applies the cooling atomically and answers with the resulting state
+            # (cooling = power * current_rpm / 1000 * capacity per 0.1 s of dt, full capacity at 1000 RPM)
+            payload = {"rpm": current_rpm, "capacity": args.capacity, "power": power, "dt": dt}
+            data, stale = engine.post("engine/cooling", payload, deadline)
+            if engine_stream and not stale:
+                # The response already carries the state we produced, don't wait for its event
+                engine_stream.offer(data)
+        elif engine_modbus:
+            temperature = engine_modbus.temperature()
+            if temperature is None:
+                return
+            data = {"temperature": temperature}
+        elif engine_stream:
+            data = engine_stream.state()
+            if data is None:
+                log.warning("No engine state received from stream yet")
+                return
         else:
-            log.error(f"Error reading Target RPM from HR 0: {hr0}")
-            target_rpm = 0.0 # Default if error
-        log.info(f"Target RPM (HR 0): {target_rpm}")
-
-        # Power is no longer read from registers, defaulting to 1 for cooling calculation
-        power = 1.0
-
-        delta = target_rpm - current_rpm
-        delta_to_apply = delta * 0.025
-        current_rpm += delta_to_apply
-
-        # Update Current RPM (IR 1)
-        context[0].setValues(4, 1, [int(current_rpm)])
-        log.info(f"Current RPM: {int(current_rpm)}")
-
-        try:
-            response = requests.get(args.endpoint + "engine")
-            if response.status_code == 200:
-                data = response.json()
-                temperature = data.get("temperature")
-                
-                if temperature is not None:
-                    # Update Temperature (IR 0)
-                    context[0].setValues(4, 0, [int(temperature)])
-                    log.info(f"Read temperature: {temperature}")
-                    
-                    # Calculate cooling based on power and current RPM
-                    # If RPM is 0, cooling is 0. If RPM is 1000, cooling is full power.
-                    # We can use (current_rpm / 1000.0) as a factor if we want, 
-                    # but let's stick to the simplest interpretation first.
-                    # I'll use current_rpm as the primary cooling factor if it's used.
-                    # For now, I'll keep the existing 'power' logic but scaled by RPM/1000.
-                    rpm_factor = current_rpm / 1000.0
-                    new_temperature = temperature - (power * rpm_factor * args.capacity)
-                    
-                    post_url = args.endpoint + "engine/temperature"
-                    payload = {"temperature": new_temperature}
-                    post_response = requests.post(post_url, json=payload)
-                    if post_response.status_code == 200:
-                        log.info(f"Decreased temperature to {new_temperature}")
-                    else:
-                        log.error(f"Failed to decrease temperature. Status: {post_response.status_code}")
-                else:
-                    log.warning("No temperature in response")
-            else:
-                log.error(f"Error fetching endpoint: {response.status_code}")
-        except Exception as e:
-            log.error(f"Exception in update loop: {e}")
-            
-        time.sleep(args.fetch_time)
-
-threading.Thread(target=update_values, args=(context,), daemon=True).start()
+            data, stale = engine.get("engine", deadline)
+        if data is None:
+            log.warning("No engine state received yet")
+            return
+        # Flag a temperature that could not be refreshed (DI 0)
+        context[0].setValues(2, 0, [int(stale)])
+        temperature = data.get("temperature")
+
+        if temperature is not None:
+            # Update Temperature (IR 0)
+            context[0].setValues(4, 0, [int(temperature)])
+            log.debug(f"Read temperature: {temperature}")
+        else:
+            log.warning("No temperature in response")
+    except Exception as e:
+        log.error(f"Exception in update loop: {e}")
+
+engine = EngineClient(args.endpoint, timeout=args.timeout)
+# Current RPM (IR 1) is evaluated on every read
+input_registers.bind(1, rpm_at)
+engine_stream = EngineStream(args.endpoint + "engine/stream").start() if args.stream else None
+engine_modbus = EngineModbus(args.engine_modbus, args.engine_unit) if args.engine_modbus else None
+scheduler = Scheduler().start()
+tick_period = None
+# Serializes rescheduling by the tick and by wake() from Modbus write handlers
+tick_lock = threading.RLock()
+
+def schedule(period, delay=None):
+    """
+    (Re)schedules the fan tick every period seconds. Rescheduling at the
+    current period is a no-op unless an immediate tick is requested.
+    """
+    global tick_period
+    with tick_lock:
+        if period != tick_period or delay is not None:
+            tick_period = period
+            scheduler.every("fan", period, lambda: update_values(context), delay=delay)
+
+schedule(args.fetch_time, delay=0)
 	
 
 # Start the server
@@ -113,4 +217,8 @@ identity.ProductName = 'Pymodbus Server'
 identity.ModelName = 'Pymodbus Server'
 identity.MajorMinorRevision = '1.0'
 
-StartTcpServer(context=context, identity=identity, address=(args.address, args.port))
+limits = fast_modbus.Limits.from_args(args)
+if args.fast_modbus or limits.enabled:
+	fast_modbus.run(context, (args.address, args.port), limits=limits)
+else:
+	asyncio.run(write_journal.serve_modbus(context, (args.address, args.port), journal, identity=identity))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from thermal import FAN_TIME_CONSTANT, fan_rpm_step
+
+
+def steps(rpm, target, dt, parts, acceleration=None):
+    for _ in range(parts):
+        rpm = fan_rpm_step(rpm, target, dt / parts, acceleration)
+    return rpm
+
+
+@pytest.mark.parametrize("acceleration", [None, 50.0, 500.0])
+@pytest.mark.parametrize("rpm, target", [(0.0, 1000.0), (1000.0, 0.0), (400.0, 420.0), (3000.0, 2990.0)])
+def test_result_does_not_depend_on_how_dt_is_split(rpm, target, acceleration):
+    whole = fan_rpm_step(rpm, target, 7.3, acceleration)
+    for parts in (2, 3, 73, 730):
+        assert steps(rpm, target, 7.3, parts, acceleration) == pytest.approx(whole, abs=1e-6)
+
+
+def test_matches_the_former_per_tick_lag():
+    # The former model closed 2.5% of the gap on every 0.1 s tick
+    assert fan_rpm_step(0.0, 1000.0, 0.1) == pytest.approx(25.0, rel=0.01)
+
+
+@pytest.mark.parametrize("acceleration", [10.0, 100.0])
+def test_acceleration_caps_the_rate_of_change(acceleration):
+    rpm = 0.0
+    for _ in range(200):
+        after = fan_rpm_step(rpm, 3000.0, 0.1, acceleration)
+        assert after - rpm <= acceleration * 0.1 + 1e-9
+        rpm = after
+    assert fan_rpm_step(3000.0, 0.0, 1.0, acceleration) == pytest.approx(3000.0 - acceleration)
+
+
+def test_lag_takes_over_near_the_target():
+    # Within acceleration * time constant of the target the plain lag applies
+    acceleration = 100.0
+    gap = acceleration * FAN_TIME_CONSTANT / 2
+    assert fan_rpm_step(1000.0 - gap, 1000.0, 1.0, acceleration) == pytest.approx(fan_rpm_step(1000.0 - gap, 1000.0, 1.0))
+
+
+def test_converges_and_stays_at_the_target():
+    assert fan_rpm_step(0.0, 1000.0, 120.0, 100.0) == pytest.approx(1000.0)
+    assert fan_rpm_step(1000.0, 1000.0, 5.0, 100.0) == 1000.0
+    assert fan_rpm_step(500.0, 1000.0, 0.0, 100.0) == 500.0
+
+
+def test_elementwise_on_arrays():
+    rpm = np.array([0.0, 1000.0, 500.0])
+    target = np.array([1000.0, 0.0, 500.0])
+    result = fan_rpm_step(rpm, target, 2.0, 100.0)
+    assert result.tolist() == pytest.approx([fan_rpm_step(r, t, 2.0, 100.0) for r, t in zip(rpm, target)])
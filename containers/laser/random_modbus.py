@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
-from pymodbus.server import StartTcpServer
 from pymodbus.datastore import ModbusServerContext, ModbusSlaveContext, ModbusSequentialDataBlock
 from pymodbus.device import ModbusDeviceIdentification  # solo se <3.0
+import asyncio
 import logging
 import random
 import time
 import threading
 import argparse
+from scheduler import Scheduler
+import signal_generator
+from register_profile import RegisterProfile
+import write_journal
+import anomaly_detector
 
 
 	
@@ -15,27 +20,69 @@ logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.INFO)
 identity = ModbusDeviceIdentification()
+parser = argparse.ArgumentParser(description="modbusTCP")
+parser.add_argument("-a", "--address", required=False, default="0.0.0.0", help="ModbusTCP Address")
+parser.add_argument("-p", "--port", required=False, default=1502, help="ModbusTCP port")
+parser.add_argument("--signal", choices=signal_generator.SOURCES, help="Publish a generated signal instead of random values")
+parser.add_argument("--period", type=float, default=60.0, help="Period of the waveform in seconds")
+parser.add_argument("--amplitude", type=float, default=500.0, help="Amplitude of the waveform (standard deviation for noise)")
+parser.add_argument("--offset", type=float, default=500.0, help="Vertical offset of the waveform")
+parser.add_argument("--seed", type=int, help="Seed of the noise signal or register profile")
+parser.add_argument("--trace", help="Trace to replay with --signal trace (.csv, .npy or raw float32)")
+parser.add_argument("--sample-period", type=float, default=1.0, help="Seconds between samples of the trace")
+parser.add_argument("-i", "--interval", type=float, default=2, help="Seconds between register updates")
+parser.add_argument("--profile", help="Register profile (JSON) describing how whole register blocks evolve")
+write_journal.add_journal_arguments(parser)
+anomaly_detector.add_anomaly_arguments(parser)
+args = parser.parse_args()
+
+profile = RegisterProfile.load(args.profile, args.seed) if args.profile else None
+sizes = {table: max(16, profile.size(table) if profile else 0) for table in ("di", "co", "hr", "ir")}
 store = ModbusSlaveContext(
-	di=ModbusSequentialDataBlock(0, [0]*16),  # Discrete Inputs
-	co=ModbusSequentialDataBlock(0, [0]*16),  # Coils
-	hr=ModbusSequentialDataBlock(0, [0]*16),  # Holding Registers
-	ir=ModbusSequentialDataBlock(0, [0]*16)   # Input Registers
+	di=ModbusSequentialDataBlock(0, [0]*sizes["di"]),  # Discrete Inputs
+	co=ModbusSequentialDataBlock(0, [0]*sizes["co"]),  # Coils
+	hr=ModbusSequentialDataBlock(0, [0]*sizes["hr"]),  # Holding Registers
+	ir=ModbusSequentialDataBlock(0, [0]*sizes["ir"])   # Input Registers
 )
 context = ModbusServerContext(slaves=store, single=True)
+
+# Client writes are journaled with the address of the client that sent them
+journal = write_journal.WriteJournal.from_args(args)
+if journal:
+	journal.watch(store, "random_modbus")
+	journal.start()
+	if args.journal_port:
+		journal.serve(args.address, args.journal_port)
+
+# Register activity is checked for anomalies off the request path
+detector = anomaly_detector.AnomalyDetector.from_args(args)
+if detector:
+	detector.watch(store, "random_modbus")
+	detector.start()
+
+signal = signal_generator.create(
+	args.signal, args.period, args.amplitude, args.offset, args.seed, args.trace, args.sample_period
+) if args.signal else None
+start_time = time.monotonic()
+
 def update_values(context):
     slave_id = 0x00
-    while True:
+    if signal:
+        # Registers hold unsigned 16-bit values
+        value = min(max(int(signal.sample(time.monotonic() - start_time)), 0), 65535)
+    else:
         value = random.randint(0, 1000)
-        context[slave_id].setValues(4, 0, [value])  # HR0
-        print(f"[update] HR0 = {value}")
-        time.sleep(2)
+    context[slave_id].setValues(4, 0, [value])  # IR0
+    log.debug(f"[update] IR0 = {value}")
 
-threading.Thread(target=update_values, args=(context,), daemon=True).start()
-parser = argparse.ArgumentParser(description="modbusTCP")
-parser.add_argument("-a", "--address", required=False, default="0.0.0.0", help="ModbusTCP Address")
-parser.add_argument("-p", "--port", required=False, default=1502, help="ModbusTCP port")
-args = parser.parse_args()
+scheduler = Scheduler().start()
+if profile:
+	# One vectorized draw and one write per block of the profile
+	for index, block in enumerate(profile.blocks):
+		scheduler.every(f"profile/{index}", block.interval, lambda block=block: block.apply(store), delay=0)
+else:
+	scheduler.every("random_modbus", args.interval, lambda: update_values(context), delay=0)
 	
 # Start the server
 print(f"Server has started on port {args.port}")
-StartTcpServer(context, identity=identity, address=(args.address, args.port))
+asyncio.run(write_journal.serve_modbus(context, (args.address, args.port), journal, identity=identity))
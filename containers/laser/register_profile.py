@@ -0,0 +1,106 @@
+"""
+Register profiles: JSON descriptions of how a simulated device's registers
+and coils evolve. A profile is a list of blocks, each a run of consecutive
+addresses in one table, drawn together from a per-block NumPy generator
+on every update: one vectorized draw and one setValues call per block.
+
+    {
+      "seed": 42,
+      "interval": 1.0,
+      "blocks": [
+        {"table": "ir", "address": 0, "count": 100, "distribution": "normal",
+         "mean": 500, "std": 50, "correlation": 0.8, "persistence": 0.9},
+        {"table": "hr", "address": 0, "count": 10, "distribution": "uniform", "low": 0, "high": 1000},
+        {"table": "co", "address": 0, "count": 16, "distribution": "bernoulli", "p": 0.1, "interval": 5.0}
+      ]
+    }
+
+Distributions:
+- normal: mean and std. correlation (0-1) is the correlation between the
+  registers of the block (a shared factor). persistence (0-1) is the
+  correlation of each register with its previous value (AR(1)).
+- uniform: integers in [low, high].
+- bernoulli: 1 with probability p, for coils and discrete inputs.
+
+Register values are rounded and clipped to min/max (default 0-65535).
+Blocks update every interval seconds (the profile's by default). The same
+seed always produces the same sequence for each block.
+"""
+import json
+
+import numpy as np
+
+# Modbus function codes used by pymodbus' setValues for each table
+FUNCTION_CODES = {"co": 1, "di": 2, "hr": 3, "ir": 4}
+
+DISTRIBUTIONS = ("normal", "uniform", "bernoulli")
+
+# pymodbus' device context shifts protocol addresses by one before they reach the data block
+BLOCK_ADDRESS_OFFSET = 1
+
+
+class Block:
+    def __init__(self, spec, seed, index, interval):
+        self.table = spec.get("table", "ir")
+        if self.table not in FUNCTION_CODES:
+            raise ValueError(f"Unknown table {self.table}")
+        self.distribution = spec.get("distribution", "uniform")
+        if self.distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution {self.distribution}")
+        self.address = int(spec.get("address", 0))
+        self.count = int(spec.get("count", 1))
+        self.interval = float(spec.get("interval", interval))
+        if self.count < 1 or self.interval <= 0:
+            raise ValueError(f"Invalid count or interval in block {index}")
+        self.spec = spec
+        # One stream per block, so adding a block does not change the others
+        self.rng = np.random.default_rng(None if seed is None else [seed, index])
+        self.state = None
+
+    def draw(self):
+        spec = self.spec
+        if self.distribution == "bernoulli":
+            return (self.rng.random(self.count) < spec.get("p", 0.5)).astype(np.uint16).tolist()
+        if self.distribution == "uniform":
+            values = self.rng.integers(spec.get("low", 0), spec.get("high", 1000), self.count, endpoint=True)
+        else:
+            values = self._normal()
+        low, high = spec.get("min", 0), spec.get("max", 65535)
+        return np.clip(np.rint(values), low, high).astype(np.uint16).tolist()
+
+    def _normal(self):
+        correlation = self.spec.get("correlation", 0.0)
+        persistence = self.spec.get("persistence", 0.0)
+        # Standard normal innovations with the requested cross-register correlation
+        shared = self.rng.standard_normal()
+        own = self.rng.standard_normal(self.count)
+        noise = np.sqrt(correlation) * shared + np.sqrt(1.0 - correlation) * own
+        if self.state is None:
+            self.state = noise
+        else:
+            self.state = persistence * self.state + np.sqrt(1.0 - persistence ** 2) * noise
+        return self.spec.get("mean", 0.0) + self.spec.get("std", 1.0) * self.state
+
+    def apply(self, store):
+        store.setValues(FUNCTION_CODES[self.table], self.address, self.draw())
+
+
+class RegisterProfile:
+    def __init__(self, spec, seed=None):
+        seed = spec.get("seed") if seed is None else seed
+        interval = float(spec.get("interval", 2.0))
+        self.blocks = [Block(block, seed, index, interval) for index, block in enumerate(spec.get("blocks", []))]
+        if not self.blocks:
+            raise ValueError("Register profile has no blocks")
+
+    @classmethod
+    def load(cls, path, seed=None):
+        with open(path) as f:
+            return cls(json.load(f), seed)
+
+    def size(self, table):
+        """
+        Number of values the data block of table needs to hold every block
+        of the profile.
+        """
+        return max((block.address + block.count + BLOCK_ADDRESS_OFFSET for block in self.blocks if block.table == table), default=0)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compares the memory and throughput of the stock pymodbus data block with
+the compact and sparse blocks of compact_datablock.py.
+
+Memory is what tracemalloc sees allocated for --devices devices with four
+--registers-sized tables each (sparse: --intervals intervals of 125
+registers spread over that space). Throughput is the rate of --count-register
+reads and writes at random addresses of one holding register table.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+
+from compact_datablock import CompactDataBlock, SparseDataBlock
+
+TABLES = ("di", "co", "hr", "ir")
+
+
+def build(kind, registers, intervals, bits=False):
+    if kind == "list":
+        return ModbusSequentialDataBlock(0, [0]*registers)
+    if kind == "compact":
+        return CompactDataBlock(0, registers, bits)
+    step = registers // intervals
+    return SparseDataBlock([(index * step, 125) for index in range(intervals)], bits)
+
+
+def memory(kind, devices, registers, intervals):
+    tracemalloc.start()
+    stores = [[build(kind, registers, intervals, table in ("di", "co")) for table in TABLES] for _ in range(devices)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del stores
+    return size
+
+
+def throughput(kind, registers, intervals, count, duration):
+    block = build(kind, registers, intervals)
+    if kind == "sparse":
+        step = registers // intervals
+        addresses = [index * step for index in range(intervals)]
+    else:
+        addresses = list(range(0, registers - count))
+    rng = random.Random(0)
+    picks = [rng.choice(addresses) for _ in range(4096)]
+    values = list(range(count))
+    results = {}
+    operations = [("read", lambda address: block.getValues(address, count)),
+                  ("write", lambda address: block.setValues(address, values))]
+    if kind != "list":
+        operations.append(("view", lambda address: block.view(address, count)))
+    for name, operation in operations:
+        done = 0
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            for address in picks:
+                operation(address)
+            done += len(picks)
+        results[name] = done / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus data block memory and throughput comparison")
+    parser.add_argument("-d", "--devices", type=int, default=100, help="Devices to allocate for the memory comparison")
+    parser.add_argument("-r", "--registers", type=int, default=65536, help="Addresses per table")
+    parser.add_argument("-n", "--count", type=int, default=125, help="Registers per read and write")
+    parser.add_argument("-i", "--intervals", type=int, default=4, help="Mapped intervals of the sparse block")
+    parser.add_argument("-t", "--duration", type=float, default=1.0, help="Seconds per throughput measurement")
+    args = parser.parse_args()
+
+    print(f"{'block':<8} {'MiB':>9} {'read/s':>10} {'write/s':>10} {'view/s':>10}")
+    for kind in ("list", "compact", "sparse"):
+        size = memory(kind, args.devices, args.registers, args.intervals)
+        rates = throughput(kind, args.registers, args.intervals, args.count, args.duration)
+        view = f"{rates['view']:>10.0f}" if "view" in rates else f"{'-':>10}"
+        print(f"{kind:<8} {size / 2**20:>9.1f} {rates['read']:>10.0f} {rates['write']:>10.0f} {view}")
+
+
+if __name__ == "__main__":
+    main()
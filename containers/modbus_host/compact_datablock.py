@@ -0,0 +1,154 @@
+"""
+Compact Modbus data blocks for large address spaces.
+
+The stock ModbusSequentialDataBlock keeps a Python list with one int object
+reference per address (8 bytes each, plus the int for non-cached values).
+CompactDataBlock keeps registers in a bytearray in Modbus wire order (two
+big-endian bytes per register) and bits in a bytearray of one 0/1 byte
+each, so a full 65536-register table takes 128 KiB instead of 512 KiB.
+
+Range reads through view() are zero-copy memoryview slices, already in the
+byte order a response carries; bulk writes are slice assignments. The
+getValues/setValues pair keeps the stock block's interface for pymodbus.
+
+SparseDataBlock maps only the given address intervals, each backed by its
+own CompactDataBlock, for maps that are mostly empty. Reads and writes
+outside them fail with ILLEGAL_ADDRESS, like a real device with gaps.
+
+Addresses are block addresses, as for the stock blocks: pymodbus' device
+context adds BLOCK_ADDRESS_OFFSET to protocol addresses before they get here.
+"""
+import bisect
+import struct
+
+from pymodbus.constants import ExcCodes
+from pymodbus.datastore.store import BaseModbusDataBlock
+
+# pymodbus' device context shifts protocol addresses by one before they reach the data block
+BLOCK_ADDRESS_OFFSET = 1
+
+
+class CompactDataBlock(BaseModbusDataBlock):
+    def __init__(self, address, count, bits=False):
+        self.address = address
+        self.count = count
+        self.bits = bits
+        self.width = 1 if bits else 2
+        self.default_value = False if bits else 0
+        self.values = bytearray(count * self.width)
+
+    def __len__(self):
+        return self.count
+
+    def __str__(self):
+        return f"CompactDataBlock({self.address}, {self.count}, bits={self.bits})"
+
+    def __iter__(self):
+        return enumerate(self.getValues(self.address, self.count), self.address)
+
+    def reset(self):
+        self.values[:] = bytes(len(self.values))
+
+    def view(self, address, count=1):
+        """
+        Zero-copy memoryview of count values from address, as big-endian
+        register bytes or 0/1 bit bytes, or ExcCodes.ILLEGAL_ADDRESS. The
+        view tracks later writes, so copy it if it must stay unchanged.
+        """
+        start = address - self.address
+        if start < 0 or count < 0 or start + count > self.count:
+            return ExcCodes.ILLEGAL_ADDRESS
+        return memoryview(self.values)[start * self.width:(start + count) * self.width]
+
+    def getValues(self, address, count=1):
+        start = address - self.address
+        if start < 0 or count < 0 or start + count > self.count:
+            return ExcCodes.ILLEGAL_ADDRESS
+        if self.bits:
+            return list(map(bool, self.values[start:start + count]))
+        return list(struct.unpack_from(f">{count}H", self.values, start * 2))
+
+    def setValues(self, address, values):
+        """
+        Writes a list of values, a single value, or raw bytes in wire order
+        (as carried by a write request) starting at address.
+        """
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            data = values
+        else:
+            if not isinstance(values, list):
+                values = [values]
+            try:
+                data = bytes(map(bool, values)) if self.bits else struct.pack(f">{len(values)}H", *values)
+            except struct.error:
+                return ExcCodes.ILLEGAL_VALUE
+        start = (address - self.address) * self.width
+        if start < 0 or len(data) % self.width or start + len(data) > len(self.values):
+            return ExcCodes.ILLEGAL_ADDRESS
+        self.values[start:start + len(data)] = data
+        return None
+
+
+class SparseDataBlock(BaseModbusDataBlock):
+    def __init__(self, intervals, bits=False):
+        """
+        intervals is a list of (address, count). Overlapping and adjacent
+        intervals are merged, so any range inside the mapped space is
+        served by a single segment.
+        """
+        self.bits = bits
+        self.default_value = False if bits else 0
+        merged = []
+        for address, count in sorted(intervals):
+            if count <= 0:
+                continue
+            if merged and address <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], address + count)
+            else:
+                merged.append([address, address + count])
+        self.segments = [CompactDataBlock(start, end - start, bits) for start, end in merged]
+        self.starts = [segment.address for segment in self.segments]
+        self.address = self.starts[0] if self.starts else 0
+        self.values = {}
+
+    def __len__(self):
+        return sum(segment.count for segment in self.segments)
+
+    def __str__(self):
+        return f"SparseDataBlock({[(segment.address, segment.count) for segment in self.segments]}, bits={self.bits})"
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
+
+    def reset(self):
+        for segment in self.segments:
+            segment.reset()
+
+    def segment(self, address, count=1):
+        """
+        The segment holding the whole range, or None if any of it is unmapped.
+        """
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index < 0:
+            return None
+        segment = self.segments[index]
+        if address + count > segment.address + segment.count:
+            return None
+        return segment
+
+    def view(self, address, count=1):
+        segment = self.segment(address, count)
+        return segment.view(address, count) if segment else ExcCodes.ILLEGAL_ADDRESS
+
+    def getValues(self, address, count=1):
+        segment = self.segment(address, count)
+        return segment.getValues(address, count) if segment else ExcCodes.ILLEGAL_ADDRESS
+
+    def setValues(self, address, values):
+        if isinstance(values, (bytes, bytearray, memoryview)):
+            count = len(values) // (1 if self.bits else 2)
+        else:
+            count = len(values) if isinstance(values, list) else 1
+        segment = self.segment(address, count)
+        return segment.setValues(address, values) if segment else ExcCodes.ILLEGAL_ADDRESS
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Hosts many simulated Modbus field devices in one process.
+
+Devices come from a JSON config file. Each one gets a register store, a
+port and optionally a unit ID; devices sharing a port are served by one
+server and told apart by unit ID. All servers and register updates run
+on a single asyncio event loop, and --processes spreads the ports over
+several processes to use more cores.
+
+Config format:
+
+    {
+      "defaults": {"registers": 16, "interval": 2.0},
+      "devices": [
+        {"name": "apg", "port": 1502},
+        {"name": "laser", "port": 1503, "signal": {"source": "sine", "period": 60, "amplitude": 500, "offset": 500}},
+        {"name": "line", "port": 1600, "unit": 1, "count": 200, "unit_step": 1}
+      ]
+    }
+
+Without a signal a device publishes a random value in 0-1000 to IR 0,
+like random_modbus.py. A "profile" (a register_profile.py JSON file, or
+the same object inline) replaces that with vectorized updates of whole
+register blocks; the device seed, if set, overrides the profile's.
+
+"datastore" picks the register storage: "compact" (default) keeps each
+table in a bytearray (compact_datablock.py), "list" uses the stock
+pymodbus block, and "sparse" maps only the intervals listed in "map",
+e.g. {"hr": [[0, 100], [40000, 200]]}, plus the profile's blocks; tables
+without intervals get the first "registers" addresses.
+
+"count" expands an entry into that many devices named <name>-<index>,
+with port and unit advanced by port_step (default 0 when a unit is given,
+1 otherwise) and unit_step (default 1).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import signal
+import sys
+import time
+from functools import partial
+
+from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
+from pymodbus.server import ModbusTcpServer
+
+import signal_generator
+from compact_datablock import BLOCK_ADDRESS_OFFSET, CompactDataBlock, SparseDataBlock
+from fast_modbus import FastModbusServer, Limits, add_limit_arguments, current_source
+from register_profile import RegisterProfile
+from scheduler import Scheduler
+from write_journal import WriteJournal, add_journal_arguments
+from anomaly_detector import AnomalyDetector, add_anomaly_arguments
+
+logging.basicConfig()
+log = logging.getLogger("modbus_host")
+log.setLevel(logging.INFO)
+
+DEFAULTS = {"registers": 16, "interval": 2.0, "unit": None, "signal": None, "seed": None, "profile": None,
+            "datastore": "compact", "map": {}}
+
+DATASTORES = ("compact", "list", "sparse")
+BIT_TABLES = ("di", "co")
+
+
+def expand_devices(config):
+    """
+    Returns the flat list of devices in config, with defaults applied and
+    count entries expanded. Raises ValueError on invalid or clashing entries.
+    """
+    defaults = dict(DEFAULTS, **config.get("defaults", {}))
+    devices = []
+    for entry in config.get("devices", []):
+        entry = dict(defaults, **entry)
+        if "name" not in entry or "port" not in entry:
+            raise ValueError(f"Device entry needs a name and a port: {entry}")
+        count = entry.pop("count", 1)
+        port_step = entry.pop("port_step", 0 if entry["unit"] is not None else 1)
+        unit_step = entry.pop("unit_step", 1)
+        for index in range(count):
+            device = dict(entry)
+            if count > 1:
+                device["name"] = f"{entry['name']}-{index}"
+                device["port"] = entry["port"] + index * port_step
+                if entry["unit"] is not None:
+                    device["unit"] = entry["unit"] + index * unit_step
+                if entry["seed"] is not None:
+                    device["seed"] = entry["seed"] + index
+            devices.append(device)
+
+    names = [device["name"] for device in devices]
+    if len(set(names)) != len(names):
+        raise ValueError("Device names must be unique")
+    for device in devices:
+        if device["datastore"] not in DATASTORES:
+            raise ValueError(f"Unknown datastore {device['datastore']} for {device['name']}")
+    by_port = group_by_port(devices)
+    for port, group in by_port.items():
+        units = [device["unit"] for device in group]
+        if len(group) > 1 and None in units:
+            raise ValueError(f"Devices sharing port {port} need unit IDs: {[device['name'] for device in group]}")
+        if len(set(units)) != len(units):
+            raise ValueError(f"Duplicate unit IDs on port {port}")
+    return devices
+
+
+def group_by_port(devices):
+    groups = {}
+    for device in devices:
+        groups.setdefault(device["port"], []).append(device)
+    return groups
+
+
+def build_signal(device):
+    spec = device["signal"]
+    if spec is None:
+        return None
+    spec = dict(spec)
+    source = spec.pop("source")
+    spec.setdefault("seed", device["seed"])
+    return signal_generator.create(source, **spec)
+
+
+def build_profile(device):
+    profile = device["profile"]
+    if profile is None:
+        return None
+    if isinstance(profile, str):
+        return RegisterProfile.load(profile, device["seed"])
+    return RegisterProfile(profile, device["seed"])
+
+
+def build_block(spec, profile, table):
+    if spec["datastore"] == "sparse":
+        # Intervals are protocol addresses, the block sees them shifted
+        intervals = [tuple(interval) for interval in spec["map"].get(table, [])] or [(0, spec["registers"])]
+        if profile:
+            intervals += [(block.address, block.count) for block in profile.blocks if block.table == table]
+        return SparseDataBlock([(address + BLOCK_ADDRESS_OFFSET, count) for address, count in intervals], table in BIT_TABLES)
+    size = max(spec["registers"], profile.size(table) if profile else 0)
+    if spec["datastore"] == "list":
+        return ModbusSequentialDataBlock(0, [0]*size)
+    return CompactDataBlock(0, size, table in BIT_TABLES)
+
+
+class Device:
+    def __init__(self, spec, start_time):
+        self.name = spec["name"]
+        self.profile = build_profile(spec)
+        self.store = ModbusDeviceContext(
+            di=build_block(spec, self.profile, "di"),  # Discrete Inputs
+            co=build_block(spec, self.profile, "co"),  # Coils
+            hr=build_block(spec, self.profile, "hr"),  # Holding Registers
+            ir=build_block(spec, self.profile, "ir")   # Input Registers
+        )
+        self.signal = build_signal(spec)
+        self.random = random.Random(spec["seed"])
+        self.start_time = start_time
+
+    def update(self):
+        if self.signal:
+            # Registers hold unsigned 16-bit values
+            value = min(max(int(self.signal.sample(time.monotonic() - self.start_time)), 0), 65535)
+        else:
+            value = self.random.randint(0, 1000)
+        self.store.setValues(4, 0, [value])
+        log.debug(f"[{self.name}] IR0 = {value}")
+
+    def jobs(self, interval):
+        """
+        Returns (name, interval, func) for every periodic update of the device.
+        """
+        if self.profile:
+            return [
+                (f"{self.name}/{index}", block.interval, partial(block.apply, self.store))
+                for index, block in enumerate(self.profile.blocks)
+            ]
+        return [(self.name, interval, self.update)]
+
+
+async def serve(devices, address, limits=None, journal=None, detector=None):
+    """
+    Runs the servers and register updates of devices on the current event loop.
+    With limits the ports are served by fast_modbus under those limits.
+    Client writes to every device go to journal, and all register writes
+    to the anomaly detector, if given.
+    """
+    start_time = time.monotonic()
+    scheduler = Scheduler()
+    servers = []
+    position = 0
+    for port, group in group_by_port(devices).items():
+        hosted = {spec["unit"]: Device(spec, start_time) for spec in group}
+        if journal:
+            for spec, device in zip(group, hosted.values()):
+                journal.watch(device.store, spec["name"])
+        if detector:
+            for spec, device in zip(group, hosted.values()):
+                detector.watch(device.store, spec["name"])
+        for spec, device in zip(group, hosted.values()):
+            # Stagger the first updates so devices don't all tick at once
+            for name, interval, func in device.jobs(spec["interval"]):
+                scheduler.every(name, interval, func, delay=interval * position / len(devices))
+            position += 1
+        if len(group) == 1 and group[0]["unit"] is None:
+            # A lone device answers on every unit ID, like random_modbus.py
+            context = ModbusServerContext(devices=hosted[None].store, single=True)
+        else:
+            context = ModbusServerContext(devices={unit: device.store for unit, device in hosted.items()}, single=False)
+        if limits:
+            servers.append(FastModbusServer(context, (address, port), limits=limits))
+        else:
+            server = ModbusTcpServer(context, address=(address, port))
+            servers.append(journal.trace(server) if journal else server)
+    log.info(f"Serving {len(devices)} device(s) on {len(servers)} port(s)")
+    await asyncio.gather(scheduler.run_async(), *[server.serve_forever() for server in servers])
+
+
+def run_shard(devices, address, limits=None, args=None, shard=0):
+    journal = None
+    detector = None
+    if args:
+        detector = AnomalyDetector.from_args(args)
+        # One journal per process, told apart by a suffix on its file and port
+        if shard:
+            args.journal = args.journal and f"{args.journal}.{shard}"
+            args.journal_port = args.journal_port and args.journal_port + shard
+        journal = WriteJournal.from_args(args, current_source)
+    if journal:
+        journal.start()
+        if args.journal_port:
+            journal.serve(address, args.journal_port)
+    if detector:
+        detector.start()
+    try:
+        asyncio.run(serve(devices, address, limits, journal, detector))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Worker processes skip atexit handlers, so flush the rest here
+        if journal:
+            journal.close()
+        if detector:
+            detector.close()
+
+
+def shard_devices(devices, processes):
+    """
+    Splits devices into at most processes shards. Devices sharing a port
+    stay together, since only one process can listen on it.
+    """
+    shards = [[] for _ in range(processes)]
+    for index, group in enumerate(group_by_port(devices).values()):
+        shards[index % processes].extend(group)
+    return [shard for shard in shards if shard]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-device Modbus host")
+    parser.add_argument("-c", "--config", required=True, help="JSON device config file")
+    parser.add_argument("-a", "--address", required=False, default="0.0.0.0", help="ModbusTCP Address")
+    parser.add_argument("--fast-modbus", action="store_true", help="Serve reads and writes with the lightweight fast_modbus server, other requests still go to pymodbus")
+    parser.add_argument("-P", "--processes", type=int, required=False, default=1, help="Processes to spread the device ports over")
+    add_limit_arguments(parser)
+    add_journal_arguments(parser)
+    add_anomaly_arguments(parser)
+    args = parser.parse_args()
+
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    with open(args.config) as f:
+        config = json.load(f)
+    try:
+        devices = expand_devices(config)
+    except ValueError as e:
+        parser.error(str(e))
+    if not devices:
+        parser.error(f"No devices in {args.config}")
+
+    limits = Limits.from_args(args)
+    # Limits are enforced by the fast server, so any limit switches it on
+    limits = limits if args.fast_modbus or limits.enabled else None
+    shards = shard_devices(devices, args.processes)
+    print(f"Hosting {len(devices)} device(s) in {len(shards)} process(es)")
+    # Exit normally on SIGTERM so the worker processes are stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = [
+        multiprocessing.Process(target=run_shard, args=(shard, args.address, limits, args, index), daemon=True)
+        for index, shard in enumerate(shards[1:], 1)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        run_shard(shards[0], args.address, limits, args)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        # Let them flush their journals before exiting, which would terminate them again
+        for worker in workers:
+            worker.join(5)
+
+
+if __name__ == "__main__":
+    main()
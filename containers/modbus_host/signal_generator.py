@@ -0,0 +1,129 @@
+"""
+Signal sources for simulated sensors. Periodic waveforms are precomputed
+into a lookup table covering one period and recorded traces are
+memory-mapped, so every sample costs an index computation no matter how
+long the signal or how high the sample rate.
+
+All sources share sample(t), with t in seconds since the signal started.
+"""
+import math
+import os
+
+import numpy as np
+
+# Lookup table entries per waveform period
+TABLE_SIZE = 4096
+
+SOURCES = ("sine", "square", "ramp", "noise", "trace")
+
+
+class Waveform:
+    """
+    Periodic signal: offset + amplitude * table, one table per period.
+    """
+
+    def __init__(self, table, period, amplitude=1.0, offset=0.0):
+        if period <= 0:
+            raise ValueError(f"Invalid period {period}")
+        self.table = offset + amplitude * np.asarray(table, dtype=np.float64)
+        self.period = period
+        self.rate = len(self.table) / period
+
+    def sample(self, t):
+        return float(self.table[int(t * self.rate) % len(self.table)])
+
+
+class Trace:
+    """
+    Replays a recorded trace sampled every sample_period seconds, looping at
+    its end unless loop is False. .npy files and raw little-endian float32
+    files are memory-mapped directly. CSV files are converted once into a
+    float32 file next to them (<path>.f32), which is then memory-mapped.
+    """
+
+    def __init__(self, path, sample_period=1.0, loop=True, column=-1):
+        if sample_period <= 0:
+            raise ValueError(f"Invalid sample period {sample_period}")
+        if path.endswith(".npy"):
+            self.values = np.load(path, mmap_mode="r")
+        elif path.endswith(".csv"):
+            self.values = np.memmap(csv_to_binary(path, column), dtype="<f4", mode="r")
+        else:
+            self.values = np.memmap(path, dtype="<f4", mode="r")
+        if len(self.values) == 0:
+            raise ValueError(f"Trace {path} has no samples")
+        self.rate = 1.0 / sample_period
+        self.loop = loop
+
+    def sample(self, t):
+        index = int(t * self.rate)
+        if self.loop:
+            index %= len(self.values)
+        else:
+            index = min(index, len(self.values) - 1)
+        return float(self.values[index])
+
+
+def csv_to_binary(path, column=-1):
+    """
+    Writes the given column of a CSV trace as float32 to <path>.f32, streaming
+    line by line, unless it is already up to date. Lines whose column does
+    not parse as a number (headers, comments) are skipped.
+    """
+    binary = path + ".f32"
+    if os.path.exists(binary) and os.path.getmtime(binary) >= os.path.getmtime(path):
+        return binary
+    partial = binary + ".tmp"
+    chunk = []
+    with open(path) as source, open(partial, "wb") as target:
+        for line in source:
+            try:
+                chunk.append(float(line.split(",")[column]))
+            except (ValueError, IndexError):
+                continue
+            if len(chunk) == 65536:
+                np.asarray(chunk, dtype="<f4").tofile(target)
+                chunk = []
+        np.asarray(chunk, dtype="<f4").tofile(target)
+    os.replace(partial, binary)
+    return binary
+
+
+def sine_table(size=TABLE_SIZE):
+    return np.sin(2 * np.pi * np.arange(size) / size)
+
+
+def square_table(size=TABLE_SIZE):
+    return np.where(np.arange(size) < size // 2, 1.0, -1.0)
+
+
+def ramp_table(size=TABLE_SIZE):
+    # Sawtooth from -1 up to (almost) 1
+    return -1.0 + 2.0 * np.arange(size) / size
+
+
+def noise_table(size=TABLE_SIZE, seed=None):
+    return np.random.default_rng(seed).standard_normal(size)
+
+
+def create(source, period=60.0, amplitude=1.0, offset=0.0, seed=None, trace=None, sample_period=1.0):
+    """
+    Builds a signal by source name. Noise is Gaussian with standard deviation
+    amplitude, drawn from seed, and repeats every period seconds.
+    """
+    if source == "trace":
+        if not trace:
+            raise ValueError("The trace source needs a trace file")
+        return Trace(trace, sample_period)
+    if source == "sine":
+        table = sine_table()
+    elif source == "square":
+        table = square_table()
+    elif source == "ramp":
+        table = ramp_table()
+    elif source == "noise":
+        # Keep roughly one new value per 10 ms whatever the period
+        table = noise_table(max(TABLE_SIZE, math.ceil(period * 100)), seed)
+    else:
+        raise ValueError(f"Unknown signal source {source}")
+    return Waveform(table, period, amplitude, offset)
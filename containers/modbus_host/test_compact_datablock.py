@@ -0,0 +1,99 @@
+import pytest
+from pymodbus.constants import ExcCodes
+from pymodbus.datastore import ModbusDeviceContext
+
+from compact_datablock import CompactDataBlock, SparseDataBlock
+
+
+def test_registers_round_trip_in_wire_order():
+    block = CompactDataBlock(0, 8)
+    assert block.setValues(2, [1, 0xABCD]) is None
+    assert block.getValues(2, 2) == [1, 0xABCD]
+    assert bytes(block.view(2, 2)) == b"\x00\x01\xab\xcd"
+    # Raw request payloads are taken as is
+    block.setValues(4, b"\x12\x34")
+    assert block.getValues(4) == [0x1234]
+    block.setValues(5, 7)
+    assert block.getValues(5) == [7]
+
+
+def test_bits():
+    block = CompactDataBlock(0, 8, bits=True)
+    block.setValues(1, [True, 0, 5])
+    assert block.getValues(0, 4) == [False, True, False, True]
+    assert bytes(block.view(1, 3)) == b"\x01\x00\x01"
+
+
+@pytest.mark.parametrize("address, count", [(-1, 1), (7, 2), (8, 1), (0, 9), (0, -1)])
+def test_reads_outside_the_block(address, count):
+    block = CompactDataBlock(0, 8)
+    assert block.getValues(address, count) == ExcCodes.ILLEGAL_ADDRESS
+    assert block.view(address, count) == ExcCodes.ILLEGAL_ADDRESS
+
+
+def test_reads_at_the_edges():
+    block = CompactDataBlock(10, 4)
+    assert block.getValues(10, 4) == [0, 0, 0, 0]
+    assert block.getValues(13) == [0]
+    assert block.getValues(9) == ExcCodes.ILLEGAL_ADDRESS
+
+
+def test_writes_outside_the_block_change_nothing():
+    block = CompactDataBlock(0, 4)
+    assert block.setValues(3, [1, 2]) == ExcCodes.ILLEGAL_ADDRESS
+    assert block.setValues(-1, [1]) == ExcCodes.ILLEGAL_ADDRESS
+    # Odd byte counts do not make whole registers
+    assert block.setValues(0, b"\x00\x01\x02") == ExcCodes.ILLEGAL_ADDRESS
+    assert block.getValues(0, 4) == [0, 0, 0, 0]
+
+
+def test_values_over_16_bits_are_illegal():
+    block = CompactDataBlock(0, 4)
+    assert block.setValues(0, [0x10000]) == ExcCodes.ILLEGAL_VALUE
+    assert block.setValues(0, [-1]) == ExcCodes.ILLEGAL_VALUE
+
+
+def test_view_tracks_writes():
+    block = CompactDataBlock(0, 4)
+    view = block.view(0, 1)
+    block.setValues(0, [2])
+    assert bytes(view) == b"\x00\x02"
+
+
+def test_sparse_intervals_are_merged():
+    block = SparseDataBlock([(100, 10), (0, 4), (105, 10), (4, 2), (50, 0)])
+    assert [(segment.address, segment.count) for segment in block.segments] == [(0, 6), (100, 15)]
+    assert len(block) == 21
+
+
+def test_sparse_reads_and_writes_inside_segments():
+    block = SparseDataBlock([(0, 4), (100, 10)])
+    assert block.setValues(108, [1, 2]) is None
+    assert block.getValues(108, 2) == [1, 2]
+    assert bytes(block.view(108, 2)) == b"\x00\x01\x00\x02"
+    # Adjacent intervals merged into one segment serve ranges across them
+    merged = SparseDataBlock([(0, 4), (4, 4)])
+    assert merged.setValues(3, b"\x00\x05\x00\x06") is None
+    assert merged.getValues(2, 4) == [0, 5, 6, 0]
+
+
+@pytest.mark.parametrize("address, count", [(4, 1), (3, 2), (50, 1), (99, 2), (109, 2), (110, 1), (-1, 1)])
+def test_sparse_gaps_are_illegal(address, count):
+    block = SparseDataBlock([(0, 4), (100, 10)])
+    assert block.getValues(address, count) == ExcCodes.ILLEGAL_ADDRESS
+    assert block.view(address, count) == ExcCodes.ILLEGAL_ADDRESS
+    assert block.setValues(address, [1] * count) == ExcCodes.ILLEGAL_ADDRESS
+
+
+def test_sparse_bits():
+    block = SparseDataBlock([(0, 8)], bits=True)
+    assert block.setValues(0, b"\x01\x00\x01") is None
+    assert block.getValues(0, 3) == [True, False, True]
+
+
+def test_device_context_shifts_protocol_addresses():
+    device = ModbusDeviceContext(hr=CompactDataBlock(0, 4))
+    device.setValues(3, 0, [9])
+    assert device.getValues(3, 0, 1) == [9]
+    # The block's last register is out of reach of protocol address 3
+    assert device.getValues(3, 3, 1) == ExcCodes.ILLEGAL_ADDRESS
@@ -0,0 +1,87 @@
+import json
+import os
+from collections import Counter
+
+import pytest
+
+from modbus_host import expand_devices, shard_devices
+
+
+def test_defaults_apply_and_entries_override():
+    devices = expand_devices({"defaults": {"registers": 32}, "devices": [
+        {"name": "apg", "port": 1502},
+        {"name": "laser", "port": 1503, "registers": 8, "datastore": "list"},
+    ]})
+    assert [(device["name"], device["registers"], device["datastore"], device["unit"]) for device in devices] == [
+        ("apg", 32, "compact", None), ("laser", 8, "list", None),
+    ]
+    assert "count" not in devices[0]
+
+
+def test_count_without_unit_gives_each_device_a_port():
+    devices = expand_devices({"devices": [{"name": "plc", "port": 1600, "count": 3, "seed": 10}]})
+    assert [(device["name"], device["port"], device["unit"], device["seed"]) for device in devices] == [
+        ("plc-0", 1600, None, 10), ("plc-1", 1601, None, 11), ("plc-2", 1602, None, 12),
+    ]
+
+
+def test_count_with_unit_shares_the_port():
+    devices = expand_devices({"devices": [{"name": "field", "port": 1600, "unit": 5, "count": 3, "unit_step": 2}]})
+    assert [(device["name"], device["port"], device["unit"]) for device in devices] == [
+        ("field-0", 1600, 5), ("field-1", 1600, 7), ("field-2", 1600, 9),
+    ]
+
+
+def test_explicit_steps():
+    devices = expand_devices({"devices": [{"name": "rack", "port": 1700, "unit": 1, "count": 4, "port_step": 1, "unit_step": 0}]})
+    assert [(device["port"], device["unit"]) for device in devices] == [(1700, 1), (1701, 1), (1702, 1), (1703, 1)]
+
+
+def test_single_entry_keeps_its_name():
+    assert expand_devices({"devices": [{"name": "apg", "port": 1502, "count": 1}]})[0]["name"] == "apg"
+
+
+@pytest.mark.parametrize("devices", [
+    [{"port": 1502}],
+    [{"name": "apg"}],
+    [{"name": "apg", "port": 1502}, {"name": "apg", "port": 1503}],
+    [{"name": "apg", "port": 1502, "datastore": "disk"}],
+    [{"name": "apg", "port": 1502}, {"name": "laser", "port": 1502, "unit": 1}],
+    [{"name": "apg", "port": 1502, "unit": 1}, {"name": "laser", "port": 1502, "unit": 1}],
+    [{"name": "field", "port": 1600, "unit": 1, "count": 2, "unit_step": 0}],
+])
+def test_invalid_configs(devices):
+    with pytest.raises(ValueError):
+        expand_devices({"devices": devices})
+
+
+def test_shipped_config():
+    with open(os.path.join(os.path.dirname(__file__), "devices.json")) as f:
+        devices = expand_devices(json.load(f))
+    assert len(devices) == 105
+    assert Counter(device["port"] for device in devices)[1600] == 100
+
+
+@pytest.mark.parametrize("processes", [1, 2, 3, 7, 50])
+def test_shards_give_every_device_to_one_process(processes):
+    devices = expand_devices({"devices": [
+        {"name": "apg", "port": 1502},
+        {"name": "laser", "port": 1503},
+        {"name": "field", "port": 1600, "unit": 1, "count": 20},
+        {"name": "plc", "port": 1700, "count": 10},
+    ]})
+    shards = shard_devices(devices, processes)
+    assert 1 <= len(shards) <= processes
+    assert all(shards)
+    assigned = Counter(device["name"] for shard in shards for device in shard)
+    assert assigned == Counter(device["name"] for device in devices)
+    # A port is listened on by one process only
+    owners = {}
+    for index, shard in enumerate(shards):
+        for device in shard:
+            assert owners.setdefault(device["port"], index) == index
+
+
+def test_shards_balance_ports():
+    devices = expand_devices({"devices": [{"name": "plc", "port": 1700, "count": 9}]})
+    assert [len(shard) for shard in shard_devices(devices, 4)] == [3, 2, 2, 2]
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from pymodbus.datastore import ModbusDeviceContext, ModbusSequentialDataBlock
+
+from register_profile import RegisterProfile
+
+SPEC = {
+    "seed": 42,
+    "interval": 1.0,
+    "blocks": [
+        {"table": "ir", "address": 0, "count": 50, "distribution": "normal", "mean": 500, "std": 50, "correlation": 0.5, "persistence": 0.9},
+        {"table": "hr", "address": 10, "count": 5, "distribution": "uniform", "low": 0, "high": 1000},
+        {"table": "co", "address": 0, "count": 16, "distribution": "bernoulli", "p": 0.25, "interval": 5.0},
+    ],
+}
+
+
+def draws(profile, rounds=3):
+    return [[block.draw() for block in profile.blocks] for _ in range(rounds)]
+
+
+def test_same_seed_same_sequence():
+    assert draws(RegisterProfile(SPEC)) == draws(RegisterProfile(SPEC))
+
+
+def test_seed_argument_overrides_the_profile():
+    assert draws(RegisterProfile(SPEC, seed=42)) == draws(RegisterProfile(SPEC))
+    assert draws(RegisterProfile(SPEC, seed=7)) != draws(RegisterProfile(SPEC))
+
+
+def test_blocks_draw_independent_streams():
+    # Appending a block does not change the draws of the others
+    extended = dict(SPEC, blocks=SPEC["blocks"] + [{"table": "di", "count": 4, "distribution": "bernoulli"}])
+    assert [rounds[:3] for rounds in draws(RegisterProfile(extended))] == draws(RegisterProfile(SPEC))
+
+
+def test_unseeded_profiles_differ():
+    spec = dict(SPEC, seed=None)
+    assert draws(RegisterProfile(spec)) != draws(RegisterProfile(spec))
+
+
+def test_values_are_rounded_and_clipped():
+    profile = RegisterProfile({"seed": 1, "blocks": [
+        {"distribution": "normal", "count": 1000, "mean": 100, "std": 1000, "min": 10, "max": 200},
+        {"distribution": "uniform", "count": 1000, "low": 3, "high": 5},
+        {"table": "co", "distribution": "bernoulli", "count": 1000, "p": 0.25},
+    ]})
+    normal, uniform, bits = [block.draw() for block in profile.blocks]
+    assert min(normal) == 10 and max(normal) == 200
+    assert set(uniform) == {3, 4, 5}
+    assert set(bits) == {0, 1}
+    assert 0.2 < np.mean(bits) < 0.3
+
+
+def test_normal_block_statistics():
+    block = RegisterProfile({"seed": 3, "blocks": [
+        {"distribution": "normal", "count": 20, "mean": 1000, "std": 10, "correlation": 0.9, "persistence": 0.0}
+    ]}).blocks[0]
+    samples = np.array([block.draw() for _ in range(2000)], dtype=float)
+    assert samples.mean() == pytest.approx(1000, abs=1)
+    assert samples.std() == pytest.approx(10, rel=0.1)
+    assert np.corrcoef(samples[:, 0], samples[:, 1])[0, 1] == pytest.approx(0.9, abs=0.05)
+
+
+def test_persistence_correlates_successive_values():
+    block = RegisterProfile({"seed": 5, "blocks": [
+        {"distribution": "normal", "count": 1, "mean": 30000, "std": 1000, "persistence": 0.95}
+    ]}).blocks[0]
+    series = np.array([block.draw()[0] for _ in range(3000)], dtype=float)
+    assert np.corrcoef(series[:-1], series[1:])[0, 1] == pytest.approx(0.95, abs=0.03)
+
+
+def test_intervals_and_sizes():
+    profile = RegisterProfile(SPEC)
+    assert [block.interval for block in profile.blocks] == [1.0, 1.0, 5.0]
+    assert profile.size("ir") == 51
+    assert profile.size("hr") == 16
+    assert profile.size("di") == 0
+
+
+def test_apply_writes_the_block():
+    profile = RegisterProfile(SPEC)
+    store = ModbusDeviceContext(hr=ModbusSequentialDataBlock(0, [0] * profile.size("hr")))
+    block = profile.blocks[1]
+    block.apply(store)
+    expected = RegisterProfile(SPEC).blocks[1].draw()
+    assert store.getValues(3, 10, 5) == expected
+
+
+@pytest.mark.parametrize("spec", [
+    {"blocks": []},
+    {"blocks": [{"table": "xx"}]},
+    {"blocks": [{"distribution": "poisson"}]},
+    {"blocks": [{"count": 0}]},
+    {"blocks": [{"interval": 0}]},
+])
+def test_invalid_profiles(spec):
+    with pytest.raises(ValueError):
+        RegisterProfile(spec)
@@ -0,0 +1,54 @@
+import time
+
+
+class AdaptiveFetch:
+    """
+    Fetch policy that doubles the fetch interval, up to maximum, while each
+    fetched temperature lands within dead_band of the linear extrapolation
+    of the previous fetches and the slope stays under rate_threshold. Any
+    miss or steeper slope brings the interval back to base.
+    """
+
+    def __init__(self, base, maximum, dead_band, rate_threshold, clock=time.monotonic):
+        self.base = base
+        self.maximum = max(base, maximum)
+        self.dead_band = dead_band
+        self.rate_threshold = rate_threshold
+        self.clock = clock
+        self.interval = base
+        # (time, temperature, slope) of the last fetch, replaced as a whole for readers
+        self.anchor = None
+        self.started = clock()
+        self.fetches = 0
+
+    def estimate(self, now):
+        if self.anchor is None:
+            return None
+        fetched_at, temperature, slope = self.anchor
+        # Never extrapolate past the next planned fetch
+        return temperature + slope * min(max(0.0, now - fetched_at), self.interval)
+
+    def update(self, now, temperature):
+        """
+        Records a fetched temperature and returns the next fetch interval.
+        """
+        self.fetches += 1
+        if self.anchor is None:
+            self.anchor = (now, temperature, 0.0)
+            return self.interval
+        fetched_at, previous, slope = self.anchor
+        error = abs(temperature - self.estimate(now))
+        if now > fetched_at:
+            slope = (temperature - previous) / (now - fetched_at)
+        self.anchor = (now, temperature, slope)
+        if error <= self.dead_band and abs(slope) <= self.rate_threshold:
+            self.interval = min(self.interval * 2, self.maximum)
+        else:
+            self.interval = self.base
+        return self.interval
+
+    def saved(self, now):
+        """
+        Fetches avoided so far compared to fetching every base seconds.
+        """
+        return max(0, int((now - self.started) / self.base) + 1 - self.fetches)
@@ -0,0 +1,355 @@
+"""
+Streaming anomaly detection on the registers of a simulated device.
+
+watch() wraps a device context's setValues, like write_journal, and
+queues every successful write, the device's own updates and client
+writes alike, for a background thread. The request path only appends a
+tuple to a bounded deque; when the thread falls behind, the oldest
+writes are dropped and counted rather than slowing the device down.
+
+The thread keeps O(1) incremental statistics per register:
+
+- EWMA mean and variance of the value, for the z-score of a new value
+- EWMA mean and variance of its rate of change, for sudden jumps
+- an exponentially decayed count of client writes, for write bursts
+- an exponentially decayed count of the changes of binary registers
+  (coils, discrete inputs and registers that only ever held 0 or 1), whose
+  flips are too small for the z-scores, e.g. an engine's start/stop HR0
+
+and checks values against optional ranges, e.g. hr:0=0:3000 for a fan's
+target RPM. Alerts are rate-limited per register and kind, and pushed to
+Loki in batches as JSON lines with the labels {job="anomaly",
+level="warning", host, device}.
+"""
+import argparse
+import atexit
+import json
+import logging
+import math
+import os
+import socket
+import struct
+import threading
+import time
+import urllib.request
+from collections import deque
+
+log = logging.getLogger("anomaly_detector")
+
+# Register table written by each function code; devices update their own registers with FC1-4
+TABLES = {1: "co", 2: "di", 3: "hr", 4: "ir", 5: "co", 6: "hr", 15: "co", 16: "hr", 22: "hr", 23: "hr"}
+# Function codes clients use to change registers and coils
+WRITE_FUNCTION_CODES = (5, 6, 15, 16, 22, 23)
+
+# Seconds over which client writes are counted for the write rate
+WRITE_RATE_WINDOW = 1.0
+# Shortest interval between two values, so simultaneous writes don't divide by zero
+MIN_INTERVAL = 0.001
+# Seconds over which changes of a binary register are counted for the toggle rate
+TOGGLE_WINDOW = 10.0
+# Smallest variance z-scores are taken against, a standard deviation of one register count
+MIN_VARIANCE = 1.0
+# Queued writes handled between two checks for due alert batches
+DRAIN_BATCH = 4096
+# Alerts that trigger a push before the flush interval is over
+MAX_BATCH = 500
+PUSH_TIMEOUT = 2.0
+POLL_INTERVAL = 0.05
+
+
+def parse_range(spec):
+    """
+    Parses an allowed register range such as "hr:0=0:3000" or
+    "fan/hr:0=0:3000" into (device or None, table, address, low, high).
+    """
+    try:
+        point, _, bounds = spec.partition("=")
+        device, _, point = point.rpartition("/")
+        table, _, address = point.partition(":")
+        low, _, high = bounds.partition(":")
+        table = table.lower()
+        if table not in ("co", "di", "hr", "ir"):
+            raise ValueError(table)
+        return device or None, table, int(address), float(low), float(high)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid range '{spec}', expected [device/]table:address=low:high")
+
+
+def add_anomaly_arguments(parser):
+    """
+    Adds the anomaly detection options to parser, with defaults from the
+    ANOMALY_* environment variables.
+    """
+    env = os.environ.get
+    group = parser.add_argument_group("Register anomaly detection")
+    group.add_argument("--anomaly", action="store_true", default=env("ANOMALY", "false") == "true", help="Detect abnormal register activity and push alerts to Loki")
+    group.add_argument("--anomaly-loki", default=env("ANOMALY_LOKI", "http://10.1.0.254:3100"), help="Loki base URL alerts are pushed to, empty to log them instead")
+    group.add_argument("--anomaly-alpha", type=float, default=float(env("ANOMALY_ALPHA", 0.05)), help="EWMA smoothing factor of the register statistics")
+    group.add_argument("--anomaly-z", type=float, default=float(env("ANOMALY_Z", 5.0)), help="Z-score of a value or rate of change that raises an alert")
+    group.add_argument("--anomaly-warmup", type=int, default=int(env("ANOMALY_WARMUP", 20)), help="Values seen per register before z-score alerts")
+    group.add_argument("--anomaly-write-rate", type=float, default=float(env("ANOMALY_WRITE_RATE", 20.0)), help="Client writes per second to one register that raise an alert")
+    group.add_argument("--anomaly-toggle-rate", type=float, default=float(env("ANOMALY_TOGGLE_RATE", 0.3)), help=f"Changes per second of a binary register, over {TOGGLE_WINDOW:g} seconds, that raise an alert")
+    group.add_argument("--anomaly-range", type=parse_range, action="append", default=[parse_range(spec) for spec in env("ANOMALY_RANGES", "").split()],
+                       help="Allowed range of a register, [device/]table:address=low:high (repeatable)")
+    group.add_argument("--anomaly-cooldown", type=float, default=float(env("ANOMALY_COOLDOWN", 10.0)), help="Seconds between alerts of one kind for one register")
+    group.add_argument("--anomaly-flush", type=float, default=float(env("ANOMALY_FLUSH", 2.0)), help="Seconds between alert batches")
+    group.add_argument("--anomaly-queue", type=int, default=int(env("ANOMALY_QUEUE", 65536)), help="Register writes queued for the detector before the oldest are dropped")
+    return group
+
+
+class RegisterStats:
+    __slots__ = ("range", "count", "mean", "var", "value", "time", "rate_mean", "rate_var", "writes", "write_time",
+                 "binary", "toggles", "toggle_time", "alerts")
+
+    def __init__(self, allowed=None):
+        self.range = allowed
+        self.count = 0
+        self.mean = self.var = 0.0
+        self.value = self.time = 0.0
+        self.rate_mean = self.rate_var = 0.0
+        self.writes = self.write_time = 0.0
+        # Until it holds a value other than 0 or 1
+        self.binary = True
+        self.toggles = self.toggle_time = 0.0
+        # Time of the last alert of each kind, allocated on the first one
+        self.alerts = None
+
+
+class AnomalyDetector:
+    def __init__(self, loki=None, alpha=0.05, z=5.0, warmup=20, write_rate=20.0, ranges=(), cooldown=10.0,
+                 flush_interval=2.0, queue_size=65536, host=None, toggle_rate=0.3):
+        """
+        ranges holds (device or None, table, address, low, high); a range
+        without a device applies to that register of every device.
+        """
+        self.loki = loki
+        self.alpha = alpha
+        self.z = z
+        self.warmup = warmup
+        self.write_rate = write_rate
+        self.toggle_rate = toggle_rate
+        self.ranges = {(device, table, address): (low, high) for device, table, address, low, high in ranges}
+        self.cooldown = cooldown
+        self.flush_interval = flush_interval
+        self.host = host or socket.gethostname()
+        self.queue = deque(maxlen=queue_size)
+        self.devices = []
+        # Per device, RegisterStats by (table, address)
+        self.registers = []
+        self.pending = []
+        self.stats = {"samples": 0, "dropped": 0, "alerts": 0, "pushed": 0, "push_errors": 0}
+        self._reported_drops = 0
+        self._failing = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_args(cls, args, host=None):
+        if not args.anomaly:
+            return None
+        return cls(args.anomaly_loki, args.anomaly_alpha, args.anomaly_z, args.anomaly_warmup, args.anomaly_write_rate,
+                   args.anomaly_range, args.anomaly_cooldown, args.anomaly_flush, args.anomaly_queue, host,
+                   args.anomaly_toggle_rate)
+
+    def watch(self, device, name="device"):
+        """
+        Feeds the successful writes to a pymodbus device context to the
+        detector by wrapping its setValues. Returns the device.
+        """
+        index = len(self.devices)
+        self.devices.append(name)
+        self.registers.append({})
+        set_values = device.setValues
+        queue = self.queue
+        stats = self.stats
+
+        def observed(function_code, address, values):
+            result = set_values(function_code, address, values)
+            if not result:
+                if len(queue) == queue.maxlen:
+                    stats["dropped"] += 1
+                queue.append((time.time(), index, function_code, address, values))
+            return result
+
+        device.setValues = observed
+        return device
+
+    def observe(self, device, function_code, address, values):
+        """
+        Queues an update of the registers of the watched device with index
+        device that did not go through its setValues, e.g. one written
+        straight into the datastore.
+        """
+        if len(self.queue) == self.queue.maxlen:
+            self.stats["dropped"] += 1
+        self.queue.append((time.time(), device, function_code, address, values))
+
+    def process(self, now, device, function_code, address, values):
+        table = TABLES.get(function_code)
+        if table is None:
+            return
+        if type(values) is list:
+            pass
+        elif isinstance(values, (bytes, bytearray, memoryview)):
+            # Register writes in wire order
+            values = struct.unpack(f">{len(values) // 2}H", values)
+        elif not isinstance(values, tuple):
+            values = [values]
+        registers = self.registers[device]
+        write = function_code in WRITE_FUNCTION_CODES
+        for offset, value in enumerate(values):
+            key = (table, address + offset)
+            stats = registers.get(key)
+            if stats is None:
+                name = self.devices[device]
+                allowed = self.ranges.get((name, table, key[1])) or self.ranges.get((None, table, key[1]))
+                stats = registers[key] = RegisterStats(allowed)
+            self.update(device, key, stats, now, float(value), write)
+
+    def update(self, device, key, stats, now, value, write):
+        allowed = stats.range
+        if allowed and not allowed[0] <= value <= allowed[1]:
+            low, high = allowed
+            self.alert(device, key, stats, now, "range", f"value {value:g} outside {low:g}-{high:g}", value=value, low=low, high=high)
+
+        count = stats.count
+        if count:
+            alpha = self.alpha
+            # Both z-scores are taken against the statistics before this value
+            diff = value - stats.mean
+            elapsed = now - stats.time
+            rate = (value - stats.value) / (elapsed if elapsed > MIN_INTERVAL else MIN_INTERVAL)
+            rate_diff = rate - stats.rate_mean
+            if count >= self.warmup:
+                # Squared deviations are compared, the square root is only taken for an alert
+                threshold = self.z * self.z
+                var = stats.var if stats.var > MIN_VARIANCE else MIN_VARIANCE
+                if diff * diff >= threshold * var:
+                    z = diff / math.sqrt(var)
+                    self.alert(device, key, stats, now, "zscore", f"value {value:g} at z-score {z:.1f} (mean {stats.mean:.1f})", value=value, mean=stats.mean, z=z)
+                var = stats.rate_var if stats.rate_var > MIN_VARIANCE else MIN_VARIANCE
+                if rate_diff * rate_diff >= threshold * var:
+                    z = rate_diff / math.sqrt(var)
+                    self.alert(device, key, stats, now, "rate", f"changing at {rate:.1f}/s, z-score {z:.1f}", value=value, rate=rate, z=z)
+            increment = alpha * diff
+            stats.mean += increment
+            stats.var = (1 - alpha) * (stats.var + diff * increment)
+            if count > 1:
+                increment = alpha * rate_diff
+                stats.rate_mean += increment
+                stats.rate_var = (1 - alpha) * (stats.rate_var + rate_diff * increment)
+            else:
+                stats.rate_mean = rate
+        else:
+            stats.mean = value
+        if stats.binary:
+            if value != 0.0 and value != 1.0:
+                stats.binary = False
+            elif count and value != stats.value:
+                stats.toggles = stats.toggles * math.exp((stats.toggle_time - now) / TOGGLE_WINDOW) + 1
+                stats.toggle_time = now
+                rate = stats.toggles / TOGGLE_WINDOW
+                if rate >= self.toggle_rate:
+                    self.alert(device, key, stats, now, "toggle", f"toggling at {rate:.1f}/s", value=value, rate=rate)
+        stats.count = count + 1
+        stats.value = value
+        stats.time = now
+
+        if write:
+            stats.writes = stats.writes * math.exp((stats.write_time - now) / WRITE_RATE_WINDOW) + 1
+            stats.write_time = now
+            rate = stats.writes / WRITE_RATE_WINDOW
+            if rate >= self.write_rate:
+                self.alert(device, key, stats, now, "write_rate", f"{rate:.1f} client writes/s", rate=rate)
+
+    def alert(self, device, key, stats, now, kind, description, **fields):
+        if stats.alerts is None:
+            stats.alerts = {}
+        last = stats.alerts.get(kind)
+        if last is not None and now - last < self.cooldown:
+            return
+        stats.alerts[kind] = now
+        self.stats["alerts"] += 1
+        name = self.devices[device]
+        table, address = key
+        self.pending.append((now, name, {
+            "message": f"{name} {table.upper()}{address}: {description}",
+            "device": name, "table": table, "address": address, "kind": kind, **fields
+        }))
+
+    def push(self):
+        """
+        Sends the pending alerts to Loki in one request, one stream per device.
+        """
+        batch, self.pending = self.pending, []
+        dropped = self.stats["dropped"]
+        if dropped != self._reported_drops:
+            log.warning(f"Anomaly detector fell behind, {dropped - self._reported_drops} register write(s) dropped")
+            self._reported_drops = dropped
+        if not batch:
+            return
+        if not self.loki:
+            for _, _, alert in batch:
+                log.warning(alert["message"])
+            return
+        streams = {}
+        for now, name, alert in batch:
+            streams.setdefault(name, []).append([str(int(now * 1e9)), json.dumps(alert, separators=(",", ":"))])
+        body = {"streams": [
+            {"stream": {"job": "anomaly", "level": "warning", "host": self.host, "device": name}, "values": values}
+            for name, values in streams.items()
+        ]}
+        request = urllib.request.Request(
+            self.loki.rstrip("/") + "/loki/api/v1/push", json.dumps(body).encode(), {"Content-Type": "application/json"}
+        )
+        try:
+            urllib.request.urlopen(request, timeout=PUSH_TIMEOUT).close()
+        except OSError as e:
+            # The batch is dropped, alerts are not worth queueing while Loki is away
+            self.stats["push_errors"] += 1
+            if not self._failing:
+                log.error(f"Pushing {len(batch)} anomaly alert(s) to {self.loki} failed: {e}")
+                self._failing = True
+            return
+        self.stats["pushed"] += len(batch)
+        if self._failing:
+            log.warning(f"Pushing anomaly alerts to {self.loki} works again")
+            self._failing = False
+
+    def drain(self, limit=DRAIN_BATCH):
+        queue = self.queue
+        done = 0
+        while queue and done < limit:
+            try:
+                self.process(*queue.popleft())
+            except Exception as e:
+                log.error(f"Anomaly detection failed: {e}")
+            done += 1
+        self.stats["samples"] += done
+        return done
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="anomaly_detector", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def close(self):
+        """
+        Stops the thread once it has handled the queued writes and pushed their alerts.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(PUSH_TIMEOUT * 2)
+
+    def _run(self):
+        next_push = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            if not self.drain():
+                self._stop.wait(POLL_INTERVAL)
+            now = time.monotonic()
+            if now >= next_push or len(self.pending) >= MAX_BATCH:
+                self.push()
+                next_push = now + self.flush_interval
+        self.drain(len(self.queue))
+        self.push()
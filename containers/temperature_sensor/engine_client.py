@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger("engine_client")
+
+
+class EngineClient:
+    """
+    Keep-alive HTTP client for the engine REST API with per-request deadlines
+    and a circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and
+    requests are skipped for backoff seconds, doubling on every failed retry
+    up to max_backoff. While the engine is unreachable, callers get the last
+    state it answered with and stale=True.
+    """
+
+    def __init__(self, endpoint, timeout=1.0, failure_threshold=3, backoff=0.5, max_backoff=30.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # One persistent connection is enough for a device ticking on one thread
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.failures = 0
+        self.open_until = 0.0
+        self.last_state = None
+        self._lock = threading.Lock()
+
+    def get(self, path="engine", deadline=None):
+        return self.request("GET", path, deadline=deadline)
+
+    def post(self, path, payload, deadline=None):
+        return self.request("POST", path, payload, deadline)
+
+    def request(self, method, path, payload=None, deadline=None):
+        """
+        Returns (state, stale). deadline is a time.monotonic() timestamp the
+        answer is needed by, e.g. the end of the caller's tick; it bounds the
+        connect and read timeouts. state is None if the engine never answered.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self.open_until:
+                return self.last_state, True
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = max(0.001, min(timeout, deadline - now))
+        try:
+            response = self.session.request(method, self.endpoint + path, json=payload, timeout=timeout)
+            response.raise_for_status()
+            state = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self._failed(e)
+            return self.last_state, True
+        with self._lock:
+            if self.failures >= self.failure_threshold:
+                log.info(f"Engine reachable again after {self.failures} failed requests")
+            self.failures = 0
+            self.open_until = 0.0
+            self.last_state = state
+        return state, False
+
+    def _failed(self, error):
+        with self._lock:
+            self.failures += 1
+            if self.failures < self.failure_threshold:
+                log.warning(f"Engine request failed ({self.failures}/{self.failure_threshold}): {error}")
+                return
+            delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - self.failure_threshold))
+            self.open_until = time.monotonic() + delay
+            log.error(f"Engine request failed {self.failures} times, pausing requests for {delay:.1f}s: {error}")
@@ -0,0 +1,40 @@
+import logging
+
+from pymodbus.client import ModbusTcpClient
+
+log = logging.getLogger("engine_modbus")
+
+# engine.py mirrors its temperature into IR0-IR1 as a big-endian float32
+TEMPERATURE_REGISTER = 0
+
+
+class EngineModbus:
+    """
+    Reads the engine temperature from its Modbus server instead of the REST API.
+    The connection is kept open and re-established by the next read after a failure.
+    """
+
+    def __init__(self, address, device_id=1, timeout=1.0):
+        host, _, port = address.rpartition(":")
+        if not host:
+            host, port = port, "502"
+        self.device_id = device_id
+        self.client = ModbusTcpClient(host, port=int(port), timeout=timeout)
+
+    def temperature(self):
+        """
+        Returns the engine temperature, or None if it could not be read.
+        """
+        try:
+            if not self.client.connected and not self.client.connect():
+                log.error(f"Cannot connect to engine Modbus server {self.client.comm_params.host}:{self.client.comm_params.port}")
+                return None
+            response = self.client.read_input_registers(TEMPERATURE_REGISTER, count=2, device_id=self.device_id)
+            if response.isError():
+                log.error(f"Error reading engine temperature: {response}")
+                return None
+            return self.client.convert_from_registers(response.registers, self.client.DATATYPE.FLOAT32)
+        except Exception as e:
+            log.error(f"Exception reading engine temperature: {e}")
+            self.client.close()
+            return None
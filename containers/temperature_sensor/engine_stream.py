@@ -0,0 +1,64 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+
+log = logging.getLogger("engine_stream")
+
+
+class EngineStream:
+    """
+    Follows the engine's server-sent event stream from a background thread
+    and keeps the most recent state. States are ordered by their version, so
+    a newer state learned from another response is never overwritten by an
+    older event.
+    """
+
+    def __init__(self, url, on_change=None, retry_delay=2.0, read_timeout=60.0):
+        self.url = url
+        self.on_change = on_change
+        self.retry_delay = retry_delay
+        self.read_timeout = read_timeout
+        self._state = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="engine-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def offer(self, state):
+        """
+        Records state if it is newer than the current one. Returns True if it was.
+        """
+        with self._lock:
+            current = self._state
+            if current is not None and state.get("version", 0) <= current.get("version", 0):
+                return False
+            self._state = state
+        if self.on_change:
+            self.on_change(state)
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                with requests.get(self.url, stream=True, timeout=(5, self.read_timeout)) as response:
+                    if response.status_code != 200:
+                        log.error(f"Error subscribing to {self.url}: {response.status_code}")
+                    else:
+                        log.info(f"Subscribed to {self.url}")
+                        for line in response.iter_lines(decode_unicode=True):
+                            if line and line.startswith("data:"):
+                                self.offer(json.loads(line[5:]))
+            except Exception as e:
+                log.error(f"Engine stream interrupted: {e}")
+            time.sleep(self.retry_delay)
@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+
+log = logging.getLogger("scheduler")
+
+
+class Job:
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.deadline = None
+        self.cancelled = False
+        self.runs = 0
+        self.overruns = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "last_lateness": self.last_lateness,
+            "max_lateness": self.max_lateness,
+        }
+
+
+class Scheduler:
+    """
+    Runs periodic jobs at fixed deadlines on a monotonic clock.
+    Jobs are keyed by name: scheduling a name again replaces the previous job,
+    so each device owns at most one job. Use start() to run the jobs on a
+    dedicated thread or run_async() to run them as a task of an event loop.
+    If given, on_run(job, lateness, duration) is called after every run.
+    """
+
+    def __init__(self, clock=time.monotonic, on_run=None):
+        self.clock = clock
+        self.on_run = on_run
+        self._jobs = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._loop = None
+        self._wakeup = None
+
+    def every(self, name, interval, func, delay=None):
+        """
+        Runs func every interval seconds. The first run happens after delay
+        seconds (defaults to one interval).
+        """
+        if interval <= 0:
+            raise ValueError(f"Invalid interval {interval} for job {name}")
+        job = Job(name, interval, func)
+        with self._cond:
+            previous = self._jobs.get(name)
+            if previous:
+                previous.cancelled = True
+            job.deadline = self.clock() + (interval if delay is None else delay)
+            self._jobs[name] = job
+            self._push(job)
+            self._notify()
+        return job
+
+    def cancel(self, name):
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            if job:
+                job.cancelled = True
+                self._notify()
+
+    def stats(self):
+        with self._cond:
+            return {name: job.stats() for name, job in self._jobs.items()}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def run_forever(self):
+        while True:
+            with self._cond:
+                job, deadline, now = self._pop_due()
+                if job is None:
+                    self._cond.wait(deadline)
+                    continue
+            self._run(job, deadline, now)
+
+    async def run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            with self._cond:
+                job, deadline, now = self._pop_due()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), deadline)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._run(job, deadline, now)
+            # Let the rest of the loop run between back-to-back jobs
+            await asyncio.sleep(0)
+
+    def _notify(self):
+        self._cond.notify()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _push(self, job):
+        self._seq += 1
+        heapq.heappush(self._heap, (job.deadline, self._seq, job))
+
+    def _pop_due(self):
+        """
+        Returns (job, deadline, now) for the next due job, or (None, wait, None)
+        with the seconds to wait for it (None if there are no jobs).
+        Must be called with the condition held.
+        """
+        while self._heap:
+            deadline, _, job = self._heap[0]
+            if job.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            now = self.clock()
+            if deadline > now:
+                return None, deadline - now, None
+            heapq.heappop(self._heap)
+            return job, deadline, now
+        return None, None, None
+
+    def _run(self, job, deadline, now):
+        lateness = now - deadline
+        job.last_lateness = lateness
+        job.max_lateness = max(job.max_lateness, lateness)
+        try:
+            job.func()
+        except Exception as e:
+            log.error(f"Job {job.name} failed: {e}")
+        job.runs += 1
+
+        # Keep the original phase: skip the deadlines we already missed instead of bursting
+        next_deadline = deadline + job.interval
+        end = self.clock()
+        if self.on_run:
+            try:
+                self.on_run(job, lateness, end - now)
+            except Exception as e:
+                log.error(f"Scheduler observer failed for {job.name}: {e}")
+        if end > next_deadline:
+            missed = int((end - next_deadline) // job.interval) + 1
+            job.overruns += missed
+            log.warning(f"Job {job.name} overran its {job.interval}s period, skipping {missed} tick(s)")
+            next_deadline += missed * job.interval
+
+        with self._cond:
+            if not job.cancelled:
+                job.deadline = next_deadline
+                self._push(job)
@@ -20,6 +20,53 @@ if [ "${SINE_WAVE:-false}" = "true" ]; then
     fi
 fi
 
+if [ -n "$SIGNAL" ]; then
+    ARGS="$ARGS --signal $SIGNAL"
+    if [ -n "$SIGNAL_PERIOD" ]; then
+        ARGS="$ARGS --period $SIGNAL_PERIOD"
+    fi
+    if [ -n "$SIGNAL_AMPLITUDE" ]; then
+        ARGS="$ARGS --amplitude $SIGNAL_AMPLITUDE"
+    fi
+    if [ -n "$SIGNAL_OFFSET" ]; then
+        ARGS="$ARGS --offset $SIGNAL_OFFSET"
+    fi
+    if [ -n "$SIGNAL_SEED" ]; then
+        ARGS="$ARGS --seed $SIGNAL_SEED"
+    fi
+    if [ -n "$SIGNAL_TRACE" ]; then
+        ARGS="$ARGS --trace $SIGNAL_TRACE"
+    fi
+    if [ -n "$SIGNAL_SAMPLE_PERIOD" ]; then
+        ARGS="$ARGS --sample-period $SIGNAL_SAMPLE_PERIOD"
+    fi
+fi
+
+if [ "${STREAM:-false}" = "true" ]; then
+    ARGS="$ARGS --stream"
+fi
+
+if [ "${ADAPTIVE:-false}" = "true" ]; then
+    ARGS="$ARGS --adaptive"
+    if [ -n "$DEAD_BAND" ]; then
+        ARGS="$ARGS --dead-band $DEAD_BAND"
+    fi
+    if [ -n "$RATE_THRESHOLD" ]; then
+        ARGS="$ARGS --rate-threshold $RATE_THRESHOLD"
+    fi
+    if [ -n "$MAX_FETCH_TIME" ]; then
+        ARGS="$ARGS --max-fetch-time $MAX_FETCH_TIME"
+    fi
+fi
+
+if [ "${FAST_MODBUS:-false}" = "true" ]; then
+    ARGS="$ARGS --fast-modbus"
+fi
+
+if [ -n "$ENGINE_MODBUS" ]; then
+    ARGS="$ARGS --engine-modbus $ENGINE_MODBUS --engine-unit ${ENGINE_UNIT:-1}"
+fi
+
 # Run the temperature sensor with the constructed arguments
 source .venv/bin/activate
 uv pip install -r requirements.txt
@@ -0,0 +1,69 @@
+import pytest
+
+from adaptive_fetch import AdaptiveFetch
+
+
+def fetch(base=1.0, maximum=8.0, dead_band=0.5, rate_threshold=0.5):
+    return AdaptiveFetch(base, maximum, dead_band, rate_threshold, clock=lambda: 0.0)
+
+
+def test_interval_doubles_up_to_maximum_while_predictable():
+    adaptive = fetch()
+    now = 0.0
+    intervals = [adaptive.update(now, 20.0)]
+    for _ in range(5):
+        now += intervals[-1]
+        intervals.append(adaptive.update(now, 20.0))
+    assert intervals == [1.0, 2.0, 4.0, 8.0, 8.0, 8.0]
+
+
+def test_miss_returns_to_base():
+    adaptive = fetch()
+    adaptive.update(0.0, 20.0)
+    adaptive.update(1.0, 20.0)
+    adaptive.update(3.0, 20.0)
+    assert adaptive.interval == 4.0
+    # 1 degree off the flat extrapolation
+    assert adaptive.update(7.0, 21.0) == 1.0
+
+
+def test_steep_slope_returns_to_base_even_when_predicted():
+    adaptive = fetch(dead_band=100.0)
+    adaptive.update(0.0, 20.0)
+    assert adaptive.update(1.0, 20.4) == 2.0
+    assert adaptive.update(3.0, 22.0) == 1.0
+
+
+def test_estimate_extrapolates_no_further_than_the_interval():
+    adaptive = fetch()
+    assert adaptive.estimate(0.0) is None
+    adaptive.update(0.0, 20.0)
+    adaptive.update(1.0, 20.25)
+    assert adaptive.interval == 2.0
+    assert adaptive.estimate(2.0) == pytest.approx(20.5)
+    assert adaptive.estimate(10.0) == pytest.approx(20.75)
+    # Never before the fetch either
+    assert adaptive.estimate(0.5) == pytest.approx(20.25)
+
+
+def test_linear_trend_within_threshold_keeps_growing():
+    adaptive = fetch(maximum=30.0)
+    now, intervals = 0.0, []
+    for _ in range(6):
+        intervals.append(adaptive.update(now, 20.0 + 0.1 * now))
+        now += intervals[-1]
+    assert intervals == [1.0, 2.0, 4.0, 8.0, 16.0, 30.0]
+
+
+def test_saved_counts_fetches_avoided():
+    adaptive = fetch()
+    for now in (0.0, 1.0, 3.0, 7.0):
+        adaptive.update(now, 20.0)
+    # Fixed-rate polling would have fetched at 0, 1, ..., 7
+    assert adaptive.fetches == 4
+    assert adaptive.saved(7.0) == 4
+    assert fetch().saved(0.0) == 1
+
+
+def test_maximum_is_at_least_base():
+    assert fetch(base=5.0, maximum=1.0).maximum == 5.0
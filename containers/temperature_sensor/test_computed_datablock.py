@@ -0,0 +1,72 @@
+from pymodbus.datastore import ModbusDeviceContext
+
+from computed_datablock import ComputedDataBlock
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bound_register_is_computed_on_read():
+    clock = FakeClock()
+    block = ComputedDataBlock(0, [0] * 8, clock)
+    calls = []
+    block.bind(2, lambda now: calls.append(now) or int(now * 10))
+    device = ModbusDeviceContext(ir=block)
+    clock.now = 1.5
+    assert device.getValues(4, 2, 1) == [15]
+    clock.now = 2.0
+    assert device.getValues(4, 0, 4) == [0, 0, 20, 0]
+    # Reads that do not cover it leave it alone
+    device.getValues(4, 3, 2)
+    assert calls == [1.5, 2.0]
+
+
+def test_ttl_caches_the_value():
+    clock = FakeClock()
+    block = ComputedDataBlock(0, [0] * 4, clock)
+    values = iter(range(1, 10))
+    block.bind(0, lambda now: next(values), ttl=1.0)
+    device = ModbusDeviceContext(ir=block)
+    readings = []
+    for now in (0.0, 0.5, 0.99, 1.0, 1.5):
+        clock.now = now
+        readings.append(device.getValues(4, 0, 1)[0])
+    assert readings == [1, 1, 1, 2, 2]
+
+
+def test_multi_register_binding():
+    block = ComputedDataBlock(0, [0] * 8, FakeClock())
+    block.bind(1, lambda now: [7, 8], count=2)
+    device = ModbusDeviceContext(ir=block)
+    # Overlapping only the second register still refreshes both
+    assert device.getValues(4, 2, 2) == [8, 0]
+    assert device.getValues(4, 0, 3) == [0, 7, 8]
+
+
+def test_failures_keep_the_previous_value():
+    clock = FakeClock()
+    block = ComputedDataBlock(0, [0] * 4, clock)
+    results = [5, RuntimeError("engine unreachable"), [1, 2]]
+
+    def compute(now):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    block.bind(0, compute)
+    device = ModbusDeviceContext(ir=block)
+    # Failing, then computing the wrong number of values
+    assert [device.getValues(4, 0, 1) for _ in range(3)] == [[5], [5], [5]]
+
+
+def test_unbound_registers_are_plain():
+    block = ComputedDataBlock(0, [0] * 4, FakeClock())
+    device = ModbusDeviceContext(hr=block)
+    device.setValues(3, 1, [42])
+    assert device.getValues(3, 0, 3) == [0, 42, 0]
@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
-import requests
 import pymodbus
 import argparse
-from pymodbus.server import StartTcpServer
+import asyncio
 from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
 from pymodbus.pdu.device import ModbusDeviceIdentification
 import logging
@@ -10,7 +9,16 @@ import random
 import time
 import threading
 
-import math
+from scheduler import Scheduler
+from engine_stream import EngineStream
+from engine_modbus import EngineModbus
+from engine_client import EngineClient
+import signal_generator
+from computed_datablock import ComputedDataBlock
+from adaptive_fetch import AdaptiveFetch
+import fast_modbus
+import write_journal
+import anomaly_detector
 
 # Argument parsing
 parser = argparse.ArgumentParser(description="modbusTCP")
@@ -18,23 +26,35 @@ parser.add_argument("-a", "--address", required=False, default="0.0.0.0", help="
 parser.add_argument("-p", "--port", required=False, default=502, type=int, help="ModbusTCP port")
 parser.add_argument("-ft", "--fetch-time", required=False, default=1.0, type=float, help="Fetch time seconds")
 parser.add_argument("-e", "--endpoint", required=False, default="http://localhost:8000/", help="Endpoint API REST")
-# Sine wave arguments
-parser.add_argument("--sine", action="store_true", help="Enable sine wave simulation mode")
-parser.add_argument("--period", type=float, default=60.0, help="Period of the sine wave in seconds")
-parser.add_argument("--amplitude", type=float, default=10.0, help="Amplitude of the sine wave")
+parser.add_argument("-to", "--timeout", required=False, default=1.0, type=float, help="Longest wait for an engine answer in seconds, also bounded by the fetch time")
+parser.add_argument("--stream", action="store_true", help="Follow the engine event stream instead of polling the endpoint")
+parser.add_argument("-em", "--engine-modbus", required=False, help="Poll the engine temperature from its Modbus server (host[:port]) instead of the endpoint")
+parser.add_argument("--fast-modbus", action="store_true", help="Serve reads and writes with the lightweight fast_modbus server, other requests still go to pymodbus")
+fast_modbus.add_limit_arguments(parser)
+write_journal.add_journal_arguments(parser)
+anomaly_detector.add_anomaly_arguments(parser)
+parser.add_argument("-eu", "--engine-unit", required=False, default=1, type=int, help="Modbus unit ID of the engine")
+# Signal generator arguments
+parser.add_argument("--signal", choices=signal_generator.SOURCES, help="Generate the temperature instead of fetching it")
+parser.add_argument("--sine", action="store_true", help="Enable sine wave simulation mode (same as --signal sine)")
+parser.add_argument("--period", type=float, default=60.0, help="Period of the waveform in seconds")
+parser.add_argument("--amplitude", type=float, default=10.0, help="Amplitude of the waveform (standard deviation for noise)")
 parser.add_argument("--offset", type=float, default=25.0, help="Vertical offset (average temperature)")
+parser.add_argument("--seed", type=int, help="Seed of the noise signal")
+parser.add_argument("--trace", help="Temperature trace to replay with --signal trace (.csv, .npy or raw float32)")
+parser.add_argument("--sample-period", type=float, default=1.0, help="Seconds between samples of the trace")
+parser.add_argument("--cache-ttl", type=float, default=0.0, help="Seconds a generated temperature is reused across reads")
+# Adaptive fetching arguments
+parser.add_argument("--adaptive", action="store_true", help="Fetch less often while the temperature is predictable, extrapolating in between")
+parser.add_argument("--dead-band", type=float, default=0.5, help="Largest prediction error (degrees) that still lets the fetch interval grow")
+parser.add_argument("--rate-threshold", type=float, default=0.5, help="Slope (degrees/s) above which fetching returns to --fetch-time")
+parser.add_argument("--max-fetch-time", type=float, default=30.0, help="Longest adaptive fetch interval in seconds")
 
 args = parser.parse_args()
-
-# Auto-adjust fetch time for sine wave to avoid aliasing
 if args.sine:
-    # We want at least 10 samples per period for a smooth wave
-    max_fetch_time = args.period / 10.0
-    if args.fetch_time > max_fetch_time:
-        # Limit the minimum fetch time to avoid CPU hogging, e.g., 0.01s
-        new_fetch_time = max(max_fetch_time, 0.01)
-        print(f"WARNING: Fetch time {args.fetch_time}s is too slow for sine period {args.period}s. Auto-adjusting to {new_fetch_time:.3f}s.")
-        args.fetch_time = new_fetch_time
+    args.signal = "sine"
+if args.adaptive and (args.signal or (args.stream and not args.engine_modbus)):
+    parser.error("--adaptive only applies to polling the engine, not to --signal or --stream")
 
 # Enable logging
 logging.basicConfig()
@@ -47,50 +67,112 @@ COILS=16
 HOLDING_REGS=16
 INPUT_REGS=16
 
+# Generated temperatures are computed when a client reads them
+input_registers = ComputedDataBlock(0, [0]*INPUT_REGS)
 store = ModbusDeviceContext(
 	di=ModbusSequentialDataBlock(0, [0]*DISCRETE_INPUTS),  # Discrete Inputs
 	co=ModbusSequentialDataBlock(0, [0]*COILS),  # Coils
 	hr=ModbusSequentialDataBlock(0, [0]*HOLDING_REGS),  # Holding Registers
-	ir=ModbusSequentialDataBlock(0, [0]*INPUT_REGS)   # Input Registers
+	ir=input_registers   # Input Registers
 )
 context = ModbusServerContext(devices=store, single=True)
 
+# Client writes are journaled with the address of the client that sent them
+journal = write_journal.WriteJournal.from_args(args, fast_modbus.current_source)
+if journal:
+	journal.watch(store, "tsens")
+	journal.start()
+	if args.journal_port:
+		journal.serve(args.address, args.journal_port)
+
+# Register activity is checked for anomalies off the request path
+detector = anomaly_detector.AnomalyDetector.from_args(args)
+if detector:
+	detector.watch(store, "tsens")
+	detector.start()
+
+signal = signal_generator.create(
+	args.signal, args.period, args.amplitude, args.offset, args.seed, args.trace, args.sample_period
+) if args.signal else None
+start_time = time.monotonic()
+
+def to_register(value):
+	# Registers hold unsigned 16-bit values
+	return min(max(int(value), 0), 65535)
+
 def update_values(context):
-	start_time = time.time()
-	while True:
-		try:
-			temperature = None
-			if args.sine:
-				# Calculate sine wave temperature
-				current_time = time.time() - start_time
-				# Formula: offset + amplitude * sin(2 * pi * t / period)
-				val = args.offset + args.amplitude * math.sin(2 * math.pi * current_time / args.period)
-				temperature = val
-				log.info(f"Generated sine temperature: {temperature:.2f}")
+	try:
+		temperature = None
+		stale = False
+		if engine_modbus:
+			temperature = engine_modbus.temperature()
+			# A failed read leaves the previous temperature in place
+			stale = temperature is None
+		else:
+			# Fetch from endpoint, answers arriving after the next tick is due are useless
+			data, stale = engine.get("", time.monotonic() + tick_period)
+			if data is None:
+				log.warning("No engine state received yet")
 			else:
-				# Fetch from endpoint
-				response = requests.get(args.endpoint)
-				if response.status_code == 200:
-					data = response.json()
-					temperature = data.get("temperature")
-					if temperature is None:
-						log.warning("No temperature in response")
-				else:
-					log.error(f"Error fetching endpoint: {response.status_code}")
-			
-			if temperature is not None:
-				# Update Input Register (Function Code 4) address 0 with temperature
-				# We cast to int because Modbus registers are essentially integers
-				context[0].setValues(4, 0, [int(temperature)])
-				log.info(f"Updated temperature to {int(temperature)}")
-
-		except Exception as e:
-			log.error(f"Exception in fetching: {e}")
-		
-		time.sleep(args.fetch_time)
-
-threading.Thread(target=update_values, args=(context,), daemon=True).start()
+				temperature = data.get("temperature")
+				if temperature is None:
+					log.warning("No temperature in response")
+		# Flag a temperature that could not be refreshed (DI 0)
+		context[0].setValues(2, 0, [int(stale)])
+
+		if temperature is not None and adaptive:
+			if stale:
+				# Keep extrapolating rather than learning from a repeated old value
+				return
+			# IR 0 is extrapolated from the fetches on every read
+			interval = adaptive.update(time.monotonic(), temperature)
+			if interval != tick_period:
+				log.debug(f"Fetching every {interval}s")
+				schedule(interval)
+		elif temperature is not None:
+			# Update Input Register (Function Code 4) address 0 with temperature
+			# We cast to int because Modbus registers are essentially integers
+			context[0].setValues(4, 0, [int(temperature)])
+			log.debug(f"Updated temperature to {int(temperature)}")
+
+	except Exception as e:
+		log.error(f"Exception in fetching: {e}")
+
+def publish_state(state):
+	temperature = state.get("temperature")
+	if temperature is not None:
+		context[0].setValues(4, 0, [int(temperature)])
+		log.info(f"Updated temperature to {int(temperature)}")
+
+engine_modbus = EngineModbus(args.engine_modbus, args.engine_unit) if args.engine_modbus else None
+engine = EngineClient(args.endpoint, timeout=args.timeout)
+adaptive = AdaptiveFetch(args.fetch_time, args.max_fetch_time, args.dead_band, args.rate_threshold) if args.adaptive else None
+
+if signal:
+	# No update thread: IR 0 is sampled from the signal on every read
+	input_registers.bind(0, lambda now: to_register(signal.sample(now - start_time)), ttl=args.cache_ttl)
+elif args.stream and not engine_modbus:
+	# Registers are updated as soon as the engine publishes a change
+	EngineStream(args.endpoint + "engine/stream", on_change=publish_state).start()
+else:
+	scheduler = Scheduler().start()
+	tick_period = None
+
+	def schedule(period, delay=None):
+		global tick_period
+		tick_period = period
+		scheduler.every("tsens", period, lambda: update_values(context), delay=delay)
+
+	if adaptive:
+		input_registers.bind(0, lambda now: to_register(adaptive.estimate(now) or 0))
+		# Fetches made and fetches saved versus fixed-rate polling (IR 2, IR 3), wrapping at 16 bits
+		input_registers.bind(2, lambda now: [adaptive.fetches % 65536, adaptive.saved(now) % 65536], count=2)
+	schedule(args.fetch_time, delay=0)
 	
 # Start the server
 print(f"Server has started on port {args.port}")
-StartTcpServer(context=context, address=(args.address, args.port))
+limits = fast_modbus.Limits.from_args(args)
+if args.fast_modbus or limits.enabled:
+	fast_modbus.run(context, (args.address, args.port), limits=limits)
+else:
+	asyncio.run(write_journal.serve_modbus(context, (args.address, args.port), journal))